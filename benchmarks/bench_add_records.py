@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark MdbLayer.add_records for a range of batch sizes.
+
+pyodbc is replaced by fake_pyodbc, which runs the plugin's SQL against a SQLite file,
+so neither Windows nor the Access driver is needed. Every batch size loads the table
+with a complete MdbLayer, timing only its add_records. Run it with the Python interpreter that comes with QGIS:
+
+    python benchmarks/bench_add_records.py [row_count]
+"""
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import fake_pyodbc
+sys.modules['pyodbc'] = fake_pyodbc
+
+from qgis.core import QgsApplication
+
+BATCH_SIZES = [1, 100, 1000, 5000, 20000]
+
+
+def create_table(path, row_count):
+    """ Write a SQLite file with a 'survey' table holding row_count rows """
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE survey (id INTEGER PRIMARY KEY, code TEXT, depth DOUBLE, remark TEXT)")
+    conn.executemany("INSERT INTO survey VALUES (?, ?, ?, ?)",
+                     ((i, 'S{}'.format(i % 50), i * 0.25, 'remark {}'.format(i)) for i in range(row_count)))
+    conn.commit()
+    conn.close()
+
+
+def bench(path, batch_size):
+    """ Load the survey table into a fresh MdbLayer and return the rows/sec of add_records """
+    import mdb_layer
+
+    class TimedMdbLayer(mdb_layer.MdbLayer):
+        def add_records(self):
+            start = time.time()
+            mdb_layer.MdbLayer.add_records(self)
+            self.add_records_time = time.time() - start
+
+    layer = TimedMdbLayer(path, 'survey', batch_size=batch_size, background=False, use_cache=False,
+                          show_progress=False, add_to_map=False)
+    if layer.error:
+        raise RuntimeError(layer.error)
+    return layer.lyr.featureCount() / layer.add_records_time
+
+
+def main():
+    row_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    app = QgsApplication([], False)
+    app.setPrefixPath(os.environ.get('QGIS_PREFIX_PATH', '/usr'), True)
+    app.initQgis()
+
+    directory = tempfile.mkdtemp(prefix='mdb_bench_')
+    try:
+        path = os.path.join(directory, 'survey.mdb')
+        create_table(path, row_count)
+        print("rows: {}".format(row_count))
+        for batch_size in BATCH_SIZES:
+            print("batch size {:>6}: {:>10.0f} rows/sec".format(batch_size, bench(path, batch_size)))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    app.exitQgis()
+
+
+if __name__ == '__main__':
+    main()
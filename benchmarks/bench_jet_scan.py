@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Compare full table scans of a real Access database with the file reader (mdb_jet) and with ODBC.
+
+mdb_jet doesn't need QGIS, so this runs with any Python 2.7. ODBC is only measured when pyodbc and
+the Access driver are installed:
+
+    python benchmarks/bench_jet_scan.py database.mdb [table ...]
+
+Without a database at hand, --generate writes one with a table of that many records first (see
+jet_fixture); only the file reader can read it:
+
+    python benchmarks/bench_jet_scan.py --generate 200000 generated.mdb
+"""
+import datetime
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mdb_jet
+from jet_fixture import Table, write_database
+from mdb_jet import LONG, DOUBLE, DATETIME, TEXT, MEMO
+
+BATCH_SIZE = 5000
+ACCESS_DRIVER = "Microsoft Access Driver (*.mdb, *.accdb)"
+
+
+def scan(conn, table):
+    """ Fetch all rows of a table in batches, like MdbLayer does; return (rows, seconds) """
+    start = time.time()
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM [{}]".format(table.replace("]", "]]")))
+    count = 0
+    while True:
+        rows = cur.fetchmany(BATCH_SIZE)
+        if not rows:
+            break
+        count += len(rows)
+    return count, time.time() - start
+
+
+def generate(path, count):
+    """ Write a database with a table 'generated' of count records, with the column types of a survey """
+    start = datetime.datetime(2000, 1, 1)
+    rows = ((i, i * 0.25, -i * 0.5, start + datetime.timedelta(minutes=i), u'point {}'.format(i),
+             u'note {}'.format(i) if i % 10 == 0 else None) for i in range(1, count + 1))
+    write_database(path, [Table('generated', [('id', LONG), ('x', DOUBLE), ('y', DOUBLE), ('taken', DATETIME),
+                                              ('name', TEXT, 50), ('notes', MEMO)], rows, ['id'])])
+
+
+def odbc_connection(path):
+    try:
+        import pyodbc
+    except ImportError:
+        return None
+    if ACCESS_DRIVER not in pyodbc.drivers():
+        return None
+    return pyodbc.connect("DRIVER={" + ACCESS_DRIVER + "};DBQ=" + os.path.abspath(path))
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    if sys.argv[1] == '--generate':
+        if len(sys.argv) != 4:
+            sys.exit(__doc__)
+        generate(sys.argv[3], int(sys.argv[2]))
+        del sys.argv[1:3]
+    path = sys.argv[1]
+    jet = mdb_jet.connect(path)
+    tables = sys.argv[2:] or sorted(jet.database.table_names())
+    odbc = odbc_connection(path)
+    if odbc is None:
+        print("pyodbc or the Access driver is missing, only the file reader is measured")
+
+    print("{:<30} {:>10} {:>14} {:>14}".format("table", "rows", "jet rows/s", "odbc rows/s"))
+    for table in tables:
+        count, seconds = scan(jet, table)
+        odbc_rate = ""
+        if odbc is not None:
+            odbc_count, odbc_seconds = scan(odbc, table)
+            odbc_rate = "{:.0f}".format(odbc_count / max(odbc_seconds, 1e-9))
+        print("{:<30} {:>10} {:>14.0f} {:>14}".format(table, count, count / max(seconds, 1e-9), odbc_rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark loading and writing back tables with MdbLayer, without Windows or the Access driver.
+
+pyodbc is replaced by fake_pyodbc, which runs the plugin's SQL against SQLite files with
+synthetic tables of several sizes and schemas. For every table a separate process
+creates an MdbLayer and measures:
+
+* the whole MdbLayer.__init__ and MdbLayer.add_records, as rows/sec
+* the peak resident memory of the process
+* MdbLayer.before_commit for 1000 updated, added and deleted features, in ms
+* MdbWriter building the statements of 1000 checked updates, as rows/sec
+* MdbWriter.find_conflicts and MdbWriter.apply for those updates, in ms
+* the memory per row of a batch as a list of lists and as the ColumnBatch background loads stage rows in
+
+along with the seconds per phase of the load and the commits, as reported by MdbLayer.timings.
+
+Results are written to a JSON file; two of them can be compared. Run it with the Python
+interpreter that comes with QGIS:
+
+    python benchmarks/bench_suite.py [--rows 10000,100000] [--schemas narrow,mixed] [--output results.json]
+    python benchmarks/bench_suite.py --compare old.json new.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import decimal
+import datetime
+import platform
+import tempfile
+import argparse
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import fake_pyodbc
+
+ROW_COUNTS = [10000, 100000, 1000000]
+EDIT_COUNT = 1000
+STATEMENT_ROUNDS = 10
+
+# column definitions per schema, besides the integer primary key 'id'
+SCHEMAS = {
+    'narrow': [('code', 'TEXT'), ('depth', 'DOUBLE')],
+    'wide': [('col{}'.format(i), ('TEXT', 'DOUBLE', 'INTEGER')[i % 3]) for i in range(60)],
+    'mixed': [('name', 'TEXT'), ('amount', 'DECIMAL(19,4)'), ('active', 'BIT'), ('created', 'DATETIME'),
+              ('day', 'DATE'), ('visits', 'INTEGER'), ('ratio', 'DOUBLE'), ('photo', 'LONGBINARY'),
+              ('remark', 'MEMO')],
+}
+
+
+def value(column_type, i):
+    """ Return a synthetic value for row i of a column, about one in ten values of some types is NULL """
+    if column_type == 'TEXT':
+        return u'value {}'.format(i % 1000)
+    if column_type == 'MEMO':
+        return None if i % 10 == 0 else u'remark ' * (i % 20)
+    if column_type == 'DOUBLE':
+        return i * 0.25
+    if column_type == 'INTEGER':
+        return i % 100000
+    if column_type == 'BIT':
+        return i % 2 == 0
+    if column_type.startswith('DECIMAL'):
+        return str(decimal.Decimal(i % 10000) / 100)
+    if column_type == 'DATETIME':
+        return datetime.datetime(2000, 1, 1) + datetime.timedelta(minutes=i)
+    if column_type == 'DATE':
+        return datetime.date(2000, 1, 1) + datetime.timedelta(days=i % 10000)
+    if column_type == 'LONGBINARY':
+        return None if i % 10 else bytearray(b'\x89PNG' * 16)
+    raise ValueError(column_type)
+
+
+def create_database(path, schema, row_count):
+    """ Write a SQLite file with a table named after the schema, holding row_count rows """
+    columns = SCHEMAS[schema]
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE {} (id INTEGER PRIMARY KEY, {})'.format(
+        schema, ", ".join('"{}" {}'.format(name, column_type) for name, column_type in columns)))
+    conn.executemany('INSERT INTO {} VALUES ({})'.format(schema, ", ".join("?" * (len(columns) + 1))),
+                     ([i] + [value(column_type, i) for _, column_type in columns] for i in range(1, row_count + 1)))
+    conn.commit()
+    conn.close()
+
+
+def peak_rss():
+    """ Return the peak resident memory of this process in bytes, or None if it can't be determined """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset
+    except (ImportError, AttributeError):
+        return None
+
+
+def deep_size(value, seen=None):
+    """ Return the memory used by a value and everything it refers to, counting shared objects once """
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        size += sum(deep_size(item, seen) for item in value)
+    elif isinstance(value, dict):
+        size += sum(deep_size(key, seen) + deep_size(item, seen) for key, item in value.items())
+    elif hasattr(value, '__dict__'):
+        size += deep_size(vars(value), seen)
+    return size
+
+
+def staging_sizes(path, schema, batch_size=5000):
+    """ Return the bytes per row of a batch as list of lists and as ColumnBatch """
+    from mdb_staging import ColumnBatch
+    cur = fake_pyodbc.connect("DBQ=" + path).cursor()
+    cur.execute("SELECT * FROM [{}]".format(schema))
+    rows = cur.fetchmany(batch_size)
+    lists = [list(row) for row in rows]
+    batch = ColumnBatch(rows, cur.description)
+    return deep_size(lists) / float(len(rows)), deep_size(batch) / float(len(rows))
+
+
+def writer_timings(path, schema):
+    """ Measure MdbWriter on EDIT_COUNT updates of the first column, checked against the values read """
+    from mdb_writeback import ChangeSet, MdbWriter
+    column, column_type = SCHEMAS[schema][0]
+    conn = fake_pyodbc.connect("DBQ=" + path)
+    cur = conn.cursor()
+    rows = cur.execute('SELECT id, "{}" FROM [{}]'.format(column, schema)).fetchmany(EDIT_COUNT)
+    changes = ChangeSet()
+    for pk, original in rows:
+        changes.updates.append(((pk,), {column: value(column_type, pk + 7)}))
+        changes.originals[(pk,)] = {column: original}
+
+    writer = MdbWriter(schema, ['id'])
+    start = time.time()
+    for i in range(STATEMENT_ROUNDS):
+        for pk_values, values in changes.updates:
+            checks, nulls, params = writer.checked(changes.originals[pk_values])
+            writer.update_sql(tuple(sorted(values)), checks, nulls)
+    statements_per_sec = STATEMENT_ROUNDS * len(changes.updates) / (time.time() - start)
+
+    start = time.time()
+    conflicts = writer.find_conflicts(cur, changes, [column])
+    find_conflicts_ms = (time.time() - start) * 1000.0
+    start = time.time()
+    writer.apply(cur, changes.without(conflicts))
+    apply_ms = (time.time() - start) * 1000.0
+    conn.close()
+    return {
+        'writer_statements_per_sec': statements_per_sec,
+        'writer_ms_per_1k_edits': {'find_conflicts': find_conflicts_ms * 1000 / len(rows),
+                                   'apply': apply_ms * 1000 / len(rows)},
+    }
+
+
+def run_benchmark(path, schema, row_count):
+    """ Load the table of a database file made by create_database and measure the MdbLayer methods """
+    sys.modules['pyodbc'] = fake_pyodbc
+
+    from qgis.core import QgsApplication, QgsMapLayerRegistry, QgsFeatureRequest
+    app = QgsApplication([], False)
+    app.setPrefixPath(os.environ.get('QGIS_PREFIX_PATH', '/usr'), True)
+    app.initQgis()
+
+    import mdb_layer
+
+    class TimedMdbLayer(mdb_layer.MdbLayer):
+        def add_records(self):
+            start = time.time()
+            mdb_layer.MdbLayer.add_records(self)
+            self.add_records_time = time.time() - start
+
+    mdb_layer.READ_ONLY = False
+    start = time.time()
+    layer = TimedMdbLayer(path, schema, background=False, use_cache=False, show_progress=False)
+    init_time = time.time() - start
+    if layer.error:
+        raise RuntimeError(layer.error)
+    result = {
+        'schema': schema,
+        'rows': layer.loaded_count,
+        'columns': len(SCHEMAS[schema]) + 1,
+        'init_rows_per_sec': layer.loaded_count / init_time,
+        'add_records_rows_per_sec': layer.loaded_count / layer.add_records_time,
+        'peak_rss_bytes': peak_rss(),
+        'load_phases': layer.timings['load']['phases'],
+    }
+    result['list_bytes_per_row'], result['staged_bytes_per_row'] = staging_sizes(path, schema)
+
+    # write back: time before_commit on a batch of edits, then drop them from the layer again
+    lyr = layer.lyr
+    fids = [feature.id() for feature in
+            lyr.getFeatures(QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry).setLimit(EDIT_COUNT * 2))]
+    edit_index = lyr.fieldNameIndex(SCHEMAS[schema][0][0])
+    commit_ms = {}
+    commit_phases = {}
+
+    def timed_commit(kind, edit):
+        lyr.startEditing()
+        edit()
+        start = time.time()
+        layer.before_commit()
+        commit_ms[kind] = (time.time() - start) * 1000.0 * 1000 / EDIT_COUNT
+        for phase, seconds in layer.timings['commit']['phases'].items():
+            commit_phases['{}_{}'.format(kind, phase)] = seconds
+        lyr.rollBack()
+
+    def update():
+        for fid in fids[:EDIT_COUNT]:
+            lyr.changeAttributeValue(fid, edit_index, value(SCHEMAS[schema][0][1], fid + 1))
+
+    def insert():
+        template = next(lyr.getFeatures(QgsFeatureRequest().setFilterFid(fids[0])))
+        for i in range(EDIT_COUNT):
+            feature = mdb_layer.QgsFeature(template)
+            feature.setAttribute('id', row_count + 1 + i)
+            lyr.addFeature(feature)
+
+    def delete():
+        lyr.deleteFeatures(fids[EDIT_COUNT:EDIT_COUNT * 2])
+
+    timed_commit('update', update)
+    timed_commit('insert', insert)
+    timed_commit('delete', delete)
+    result['commit_ms_per_1k_edits'] = commit_ms
+    result['commit_phases'] = commit_phases
+
+    result.update(writer_timings(path, schema))
+
+    QgsMapLayerRegistry.instance().removeMapLayer(lyr.id())
+    app.exitQgis()
+    return result
+
+
+def run_all(row_counts, schemas, output):
+    """ Run every schema and row count in its own process, so peak memory is measured per table """
+    results = []
+    directory = tempfile.mkdtemp(prefix='mdb_bench_')
+    try:
+        for schema in schemas:
+            for row_count in row_counts:
+                path = os.path.join(directory, '{}_{}.mdb'.format(schema, row_count))
+                create_database(path, schema, row_count)
+                result_path = path + '.json'
+                subprocess.check_call([sys.executable, os.path.abspath(__file__), '--run', path, schema,
+                                       str(row_count), result_path])
+                with open(result_path) as f:
+                    result = json.load(f)
+                results.append(result)
+                os.remove(path)
+                print("{schema:>6} {rows:>8} rows: {init_rows_per_sec:>9.0f} rows/sec, {mb:>6.0f} MB, "
+                      "commit per 1k {commit}".format(mb=(result['peak_rss_bytes'] or 0) / 1024.0 / 1024,
+                                                      commit=", ".join("{} {:.0f} ms".format(kind, ms) for kind, ms in
+                                                                       sorted(result['commit_ms_per_1k_edits'].items())),
+                                                      **result))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    report = {
+        'created': datetime.datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'git': git_revision(),
+        'results': results,
+    }
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print("Results written to {}".format(output))
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(BENCH_DIR)).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(result):
+    """ Return {metric: value} for the numbers of a result, nested dicts as 'name.key' """
+    metrics = {}
+    for key, number in result.items():
+        if isinstance(number, dict):
+            metrics.update(('{}.{}'.format(key, sub_key), sub_value) for sub_key, sub_value in number.items())
+        elif isinstance(number, (int, float)) and key not in ('rows', 'columns'):
+            metrics[key] = number
+    return metrics
+
+
+def compare(old_path, new_path):
+    """ Print the metrics of two result files side by side, with the change in percent """
+    with open(old_path) as f:
+        old = dict(((r['schema'], r['rows']), flatten(r)) for r in json.load(f)['results'])
+    with open(new_path) as f:
+        new = dict(((r['schema'], r['rows']), flatten(r)) for r in json.load(f)['results'])
+    for key in sorted(set(old) & set(new)):
+        print("{} {} rows".format(*key))
+        for metric in sorted(set(old[key]) & set(new[key])):
+            before, after = old[key][metric], new[key][metric]
+            if before is None or after is None:
+                continue
+            change = (after - before) * 100.0 / before if before else 0
+            print("  {:<32} {:>14.1f} {:>14.1f} {:>+8.1f}%".format(metric, before, after, change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MdbLayer against SQLite stand-in databases")
+    parser.add_argument('--rows', default=",".join(str(count) for count in ROW_COUNTS),
+                        help="comma separated row counts")
+    parser.add_argument('--schemas', default=",".join(sorted(SCHEMAS)), help="comma separated schemas")
+    parser.add_argument('--output', default=os.path.join(
+        BENCH_DIR, 'results', datetime.datetime.now().strftime('%Y%m%d_%H%M%S') + '.json'))
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="compare two result files")
+    parser.add_argument('--run', nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        path, schema, row_count, result_path = args.run
+        result = run_benchmark(path, schema, int(row_count))
+        with open(result_path, 'w') as f:
+            json.dump(result, f)
+    elif args.compare:
+        compare(*args.compare)
+    else:
+        if not os.path.isdir(os.path.dirname(args.output)):
+            os.makedirs(os.path.dirname(args.output))
+        run_all([int(count) for count in args.rows.split(",")], args.schemas.split(","), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+A stand-in for pyodbc that runs the plugin's Access SQL against SQLite.
+
+Only the parts of pyodbc the plugin uses are there: connect(), cursors with execute,
+executemany, fetchone/fetchmany/fetchall and description, and the tables() and
+statistics() catalog functions. The database path in the connection string (DBQ=...)
+is a SQLite file; its declared column types decide the python types in the cursor
+description and of the fetched values, like the Access driver does:
+
+    INTEGER, LONG, COUNTER  int          DECIMAL, CURRENCY   Decimal
+    DOUBLE, REAL            float        DATETIME, DATE      datetime, date
+    TEXT, VARCHAR, MEMO     unicode      LONGBINARY, BLOB    bytearray
+    BIT                     bool
+
+Use it by putting it in sys.modules['pyodbc'] before the plugin modules are imported.
+"""
+import re
+import sys
+import decimal
+import datetime
+import sqlite3
+
+text_type = type(u'')
+binary_type = buffer if sys.version_info[0] == 2 else bytes
+
+
+class Error(Exception):
+    pass
+
+
+def _parse_datetime(value):
+    value = value.decode() if isinstance(value, bytes) else value
+    value = value.replace('T', ' ')
+    return datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S.%f' if '.' in value else '%Y-%m-%d %H:%M:%S')
+
+
+def _parse_date(value):
+    value = value.decode() if isinstance(value, bytes) else value
+    return datetime.datetime.strptime(value[:10], '%Y-%m-%d').date()
+
+
+sqlite3.register_converter('BIT', lambda value: bool(int(value)))
+sqlite3.register_converter('DATETIME', _parse_datetime)
+sqlite3.register_converter('DATE', _parse_date)
+sqlite3.register_converter('DECIMAL', lambda value: decimal.Decimal(value.decode()))
+sqlite3.register_converter('CURRENCY', lambda value: decimal.Decimal(value.decode()))
+sqlite3.register_converter('LONGBINARY', bytearray)
+sqlite3.register_adapter(decimal.Decimal, str)
+sqlite3.register_adapter(bytearray, binary_type)
+
+# first word of a declared column type: (python type, size, precision, scale) in the cursor description
+_declared_types = {
+    'INTEGER': (int, 10, 10, 0), 'INT': (int, 10, 10, 0), 'LONG': (int, 10, 10, 0), 'COUNTER': (int, 10, 10, 0),
+    'DOUBLE': (float, 53, 53, 0), 'REAL': (float, 53, 53, 0),
+    'TEXT': (text_type, 255, 255, 0), 'VARCHAR': (text_type, 255, 255, 0), 'MEMO': (text_type, 0, 0, 0),
+    'BIT': (bool, 1, 1, 0),
+    'DECIMAL': (decimal.Decimal, 19, 19, 4), 'CURRENCY': (decimal.Decimal, 19, 19, 4),
+    'DATETIME': (datetime.datetime, 19, 19, 0), 'DATE': (datetime.date, 10, 10, 0),
+    'LONGBINARY': (bytearray, 0, 0, 0), 'BLOB': (bytearray, 0, 0, 0),
+}
+
+_quoted = re.compile(r'\[((?:[^\]]|\]\])*)\]')
+_top = re.compile(r'^\s*SELECT\s+TOP\s+(\d+)\s+', re.IGNORECASE)
+_from = re.compile(r'\bFROM\s+"((?:[^"]|"")*)"', re.IGNORECASE)
+
+
+def translate(sql):
+    """ Return Access SQL rewritten for SQLite: [quoted] names, DELETE * FROM, SELECT TOP n and @@IDENTITY """
+    sql = sql.replace('@@IDENTITY', 'last_insert_rowid()')
+    sql = _quoted.sub(lambda match: '"' + match.group(1).replace(']]', ']').replace('"', '""') + '"', sql)
+    sql = re.sub(r'^\s*DELETE\s+\*\s+FROM\b', 'DELETE FROM', sql, flags=re.IGNORECASE)
+    top = _top.match(sql)
+    if top:
+        sql = "SELECT " + sql[top.end():] + " LIMIT " + top.group(1)
+    return sql
+
+
+def connect(connection_string, timeout=0, autocommit=False):
+    settings = dict(part.split('=', 1) for part in connection_string.split(';') if '=' in part)
+    return Connection(settings['DBQ'])
+
+
+def _mid(value, start, length):
+    if value is None:
+        return None
+    part = value[start - 1:start - 1 + length]
+    return part if isinstance(value, text_type) else binary_type(part)
+
+
+class Row(tuple):
+    """ A result row of a catalog function, with its values also available by column name """
+
+    def __new__(cls, names, values):
+        row = tuple.__new__(cls, values)
+        row.names = names
+        return row
+
+    def __getattr__(self, name):
+        try:
+            return self[self.names.index(name)]
+        except ValueError:
+            raise AttributeError(name)
+
+
+class Connection:
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+        self.conn.text_factory = text_type
+        # Access string functions the plugin uses, positions and lengths count characters (Mid) or bytes (MidB)
+        self.conn.create_function('Mid', 3, _mid)
+        self.conn.create_function('MidB', 3, _mid)
+
+    def cursor(self):
+        return Cursor(self)
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+    def column_types(self, table):
+        """ Return {column name: (python type, size, precision, scale)} for a table """
+        columns = {}
+        for row in self.conn.execute('PRAGMA table_info("{}")'.format(table.replace('"', '""'))):
+            declared = (row[2] or '').upper().split('(')[0].strip()
+            columns[row[1]] = _declared_types.get(declared.split(' ')[0] if declared else '', (text_type, 255, 255, 0))
+        return columns
+
+
+class Cursor:
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.cur = None
+        self.rows = None
+        self.description = None
+        self.rowcount = -1
+
+    def execute(self, sql, *params):
+        if len(params) == 1 and isinstance(params[0], (list, tuple)):
+            params = params[0]
+        sql = translate(sql)
+        try:
+            self.cur = self.connection.conn.execute(sql, tuple(params))
+        except sqlite3.Error as e:
+            raise Error("{} [{}]".format(e, sql))
+        self.rows = None
+        self.rowcount = self.cur.rowcount
+        self.description = self._description(sql)
+        return self
+
+    def executemany(self, sql, params):
+        sql = translate(sql)
+        try:
+            self.cur = self.connection.conn.executemany(sql, [tuple(values) for values in params])
+        except sqlite3.Error as e:
+            raise Error("{} [{}]".format(e, sql))
+        self.rows = None
+        self.rowcount = self.cur.rowcount
+        self.description = None
+
+    def _description(self, sql):
+        if self.cur.description is None:
+            return None
+        table = _from.search(sql)
+        types = self.connection.column_types(table.group(1).replace('""', '"')) if table else {}
+        description = []
+        for column in self.cur.description:
+            python_type, size, precision, scale = types.get(column[0], (int, 10, 10, 0))
+            description.append((column[0], python_type, None, size, precision, scale, True))
+        return description
+
+    def fetchone(self):
+        if self.rows is not None:
+            return self.rows.pop(0) if self.rows else None
+        return self.cur.fetchone()
+
+    def fetchmany(self, size=1):
+        if self.rows is not None:
+            rows, self.rows = self.rows[:size], self.rows[size:]
+            return rows
+        return self.cur.fetchmany(size)
+
+    def fetchall(self):
+        if self.rows is not None:
+            rows, self.rows = self.rows, []
+            return rows
+        return self.cur.fetchall()
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def tables(self, table=None, tableType=None):
+        """ Tables are reported as TABLE, views as VIEW (what Access calls a query) """
+        types = [name.strip() for name in tableType.split(',')] if tableType else ['TABLE', 'VIEW']
+        names = ('table_cat', 'table_schem', 'table_name', 'table_type', 'remarks')
+        self.rows = []
+        for name, kind in self.connection.conn.execute(
+                "SELECT name, type FROM sqlite_master WHERE type IN ('table', 'view') ORDER BY name"):
+            table_type = 'TABLE' if kind == 'table' else 'VIEW'
+            if (table is None or name == table) and table_type in types:
+                self.rows.append(Row(names, (self.connection.path, None, name, table_type, None)))
+        return self
+
+    def statistics(self, table):
+        """ The row count of the table, and the primary key as the index named PrimaryKey like Access does """
+        names = ('table_cat', 'table_schem', 'table_name', 'non_unique', 'index_qualifier', 'index_name', 'type',
+                 'ordinal_position', 'column_name', 'asc_or_desc', 'cardinality', 'pages', 'filter_condition')
+        columns = sorted((row[5], row[1]) for row in
+                         self.connection.conn.execute('PRAGMA table_info("{}")'.format(table.replace('"', '""')))
+                         if row[5])
+        count = self.connection.conn.execute('SELECT COUNT(*) FROM "{}"'.format(table.replace('"', '""'))).fetchone()[0]
+        self.rows = [Row(names, (self.connection.path, None, table, None, None, None, 0, None, None, None, count,
+                                 None, None))]
+        self.rows.extend(Row(names, (self.connection.path, None, table, False, None, 'PrimaryKey', 1, position, name,
+                                     'A', None, None, None))
+                         for position, name in columns)
+        return self
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        self.cur = None
+        self.rows = None
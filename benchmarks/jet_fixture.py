@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+Write small Jet 4 (Access 2000) database files, for testing and benchmarking mdb_jet without Access.
+
+Only what mdb_jet reads is written: the header, MSysObjects with the user tables, table definitions with
+their columns and primary key, usage maps, data pages and long value (memo and OLE) rows. Long values are
+stored in the row, on one other page or in a chain of rows, depending on their length. Text that fits in
+latin-1 is stored 'compressed', other text as UCS-2. Access can't open the result, it has no system
+tables besides MSysObjects and no index pages.
+
+    write_database('test.mdb', [Table('survey', [('id', LONG), ('name', TEXT, 100)], rows, ['id'])])
+"""
+import os
+import sys
+import struct
+import datetime
+import decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mdb_jet import (BOOL, BYTE, INT, LONG, MONEY, FLOAT, DOUBLE, DATETIME, TEXT, OLE, MEMO, DATA_PAGE,
+                     TABLE_PAGE, DELETED_ROW)
+
+PAGE_SIZE = 4096
+INLINE_MAX = 64         # longer long values go on a page of their own
+LVAL_CHUNK = 1500       # longer ones than this go in a chain of rows of this size
+
+SYSTEM_FLAGS = -2147483646          # 0x80000002, system object
+TABLE_TYPE, QUERY_TYPE = 1, 5
+
+_FIXED = {BOOL: ('', 0), BYTE: ('<B', 1), INT: ('<h', 2), LONG: ('<i', 4), MONEY: ('<q', 8), FLOAT: ('<f', 4),
+          DOUBLE: ('<d', 8), DATETIME: ('<d', 8)}
+_HEADER_KEY = bytearray([0xC7, 0xDA, 0x39, 0x6B])
+_EPOCH = datetime.datetime(1899, 12, 30)
+
+
+class Table:
+    """ A table to write: columns are (name, type) or (name, type, length in characters) for TEXT;
+    rows are tuples in column order, None for NULL. Deleted rows are written with the deleted flag. """
+
+    def __init__(self, name, columns, rows, primary_key=(), deleted_rows=()):
+        self.name = name
+        self.columns = [tuple(column) + (None,) * (3 - len(column)) for column in columns]
+        self.rows = list(rows)
+        self.primary_key = list(primary_key)
+        self.deleted_rows = list(deleted_rows)
+
+
+def _rc4(key, data):
+    state = list(range(256))
+    j = 0
+    for i in range(256):
+        j = (j + state[i] + key[i % len(key)]) & 0xFF
+        state[i], state[j] = state[j], state[i]
+    out = bytearray(len(data))
+    i = j = 0
+    for n, byte in enumerate(data):
+        i = (i + 1) & 0xFF
+        j = (j + state[i]) & 0xFF
+        state[i], state[j] = state[j], state[i]
+        out[n] = byte ^ state[(state[i] + state[j]) & 0xFF]
+    return out
+
+
+def _text(value):
+    """ Jet 4 text: 'compressed' (0xFF 0xFE and one byte per character) when latin-1 will do, else UCS-2 """
+    try:
+        if u'\x00' not in value:
+            return bytearray(b'\xff\xfe' + value.encode('latin-1'))
+    except UnicodeEncodeError:
+        pass
+    return bytearray(value.encode('utf-16-le'))
+
+
+def _days(value):
+    """ Days since 1899-12-30; before that the whole days count back and the time of day still forward """
+    delta = value - _EPOCH
+    fraction = (delta.seconds + delta.microseconds / 1e6) / 86400.0
+    return delta.days - fraction if delta.days < 0 else delta.days + fraction
+
+
+class _Writer:
+
+    def __init__(self):
+        self.pages = [bytearray(PAGE_SIZE), bytearray(PAGE_SIZE)]     # header, usage maps
+        self.usage_rows = []
+        self.lval_page = None
+        self.lval_rows = []
+
+    def new_page(self):
+        self.pages.append(bytearray(PAGE_SIZE))
+        return len(self.pages) - 1
+
+    def data_page(self, owner):
+        number = self.new_page()
+        page = self.pages[number]
+        page[0], page[1] = DATA_PAGE, 1
+        struct.pack_into('<I', page, 4, owner)
+        self.set_rows(number, [])
+        return number
+
+    def set_rows(self, number, rows, flags=()):
+        """ Put rows (bytearrays) on a page, from its end backwards; flags per row, e.g. DELETED_ROW """
+        page = self.pages[number]
+        end = PAGE_SIZE
+        struct.pack_into('<H', page, 12, len(rows))
+        for i, row in enumerate(rows):
+            start = end - len(row)
+            page[start:end] = row
+            struct.pack_into('<H', page, 14 + 2 * i, start | (flags[i] if i < len(flags) else 0))
+            end = start
+        struct.pack_into('<H', page, 2, end - 14 - 2 * len(rows))
+
+    def add_rows(self, owner, rows, flags=()):
+        """ Spread rows over new data pages of a table; return (page numbers, row pointers) """
+        pages, pointers = [], []
+        current, on_page, on_flags, used = None, [], [], 0
+        for row, flag in zip(rows, list(flags) + [0] * (len(rows) - len(flags))):
+            if current is None or used + len(row) + 2 > PAGE_SIZE - 14:
+                if current is not None:
+                    self.set_rows(current, on_page, on_flags)
+                current, on_page, on_flags, used = self.data_page(owner), [], [], 0
+                pages.append(current)
+            pointers.append(current << 8 | len(on_page))
+            on_page.append(row)
+            on_flags.append(flag)
+            used += len(row) + 2
+        if current is not None:
+            self.set_rows(current, on_page, on_flags)
+        return pages, pointers
+
+    def lval_row(self, data):
+        """ Store a long value row on a long value page; return its pointer """
+        page = self.pages[self.lval_page] if self.lval_page is not None else None
+        if page is None or struct.unpack_from('<H', page, 2)[0] < len(data) + 2:
+            self.lval_page = self.data_page(0)
+            self.lval_rows = []
+        self.lval_rows.append(bytearray(data))
+        self.set_rows(self.lval_page, self.lval_rows)
+        return self.lval_page << 8 | len(self.lval_rows) - 1
+
+    def long_value(self, data):
+        """ The 12 byte reference to a memo or OLE value, with the value after it when it's short """
+        data = bytearray(data)
+        if len(data) <= INLINE_MAX:
+            return bytearray(struct.pack('<III', len(data) | 0x80000000, 0, 0)) + data
+        if len(data) <= LVAL_CHUNK:
+            return bytearray(struct.pack('<III', len(data) | 0x40000000, self.lval_row(data), 0))
+        pointer = 0
+        chunks = [data[i:i + LVAL_CHUNK] for i in range(0, len(data), LVAL_CHUNK)]
+        for chunk in reversed(chunks):
+            pointer = self.lval_row(bytearray(struct.pack('<I', pointer)) + chunk)
+        return bytearray(struct.pack('<III', len(data), pointer, 0))
+
+    def encode_row(self, columns, values):
+        fixed = [(i, column) for i, column in enumerate(columns) if column[1] in _FIXED]
+        var = [(i, column) for i, column in enumerate(columns) if column[1] not in _FIXED]
+        row = bytearray(struct.pack('<H', len(columns)))
+        mask = bytearray((len(columns) + 7) // 8)
+        for i, value in enumerate(values):
+            if value is not None and (columns[i][1] != BOOL or value):
+                mask[i // 8] |= 1 << i % 8
+        for i, (name, column_type, length) in fixed:
+            fmt, size = _FIXED[column_type]
+            value = values[i]
+            if not size:
+                continue
+            if value is None:
+                row += bytearray(size)
+            elif column_type == DATETIME:
+                row += struct.pack(fmt, _days(value))
+            elif column_type == MONEY:
+                row += struct.pack(fmt, int(decimal.Decimal(value).scaleb(4)))
+            else:
+                row += struct.pack(fmt, value)
+        if not var:
+            return row + mask
+        offsets = []
+        for i, (name, column_type, length) in var:
+            offsets.append(len(row))
+            value = values[i]
+            if value is None:
+                continue
+            if column_type == TEXT:
+                row += _text(value)
+            elif column_type == MEMO:
+                row += self.long_value(_text(value))
+            elif column_type == OLE:
+                row += self.long_value(value)
+            else:
+                row += bytearray(value)
+        offsets.append(len(row))
+        for offset in reversed(offsets):
+            row += struct.pack('<H', offset)
+        row += struct.pack('<H', len(var))
+        return row + mask
+
+    def table_definition(self, number, table, usage_map, row_count):
+        """ Write the definition of a table on its page: columns, names and the primary key index """
+        page = self.pages[number]
+        page[0], page[1] = TABLE_PAGE, 1
+        page[2:4] = b'VC'
+        columns = table.columns
+        var_count = len([column for column in columns if column[1] not in _FIXED])
+        indexes = 1 if table.primary_key else 0
+        struct.pack_into('<I', page, 16, row_count)
+        struct.pack_into('<HH', page, 43, var_count, len(columns))
+        struct.pack_into('<II', page, 47, indexes, indexes)
+        struct.pack_into('<I', page, 55, usage_map)
+
+        tdef = bytearray(12 * indexes)
+        fixed_offset, var_number = 0, 0
+        for number_in_table, (name, column_type, length) in enumerate(columns):
+            column = bytearray(25)
+            column[0] = column_type
+            struct.pack_into('<H', column, 5, number_in_table)
+            if column_type in _FIXED:
+                size = _FIXED[column_type][1]
+                column[15] = 0x01
+                struct.pack_into('<HH', column, 21, fixed_offset, size)
+                fixed_offset += size
+            else:
+                struct.pack_into('<H', column, 7, var_number)
+                struct.pack_into('<H', column, 23, 2 * length if column_type == TEXT else 0)
+                var_number += 1
+            tdef += column
+        for name, column_type, length in columns:
+            encoded = bytearray(name.encode('utf-16-le'))
+            tdef += struct.pack('<H', len(encoded)) + encoded
+        if indexes:
+            names = [column[0] for column in columns]
+            real_index = bytearray(52)
+            for i in range(10):
+                number_in_table = names.index(table.primary_key[i]) if i < len(table.primary_key) else 0xFFFF
+                struct.pack_into('<HB', real_index, 4 + 3 * i, number_in_table, 1)
+            real_index[4 + 38] = 0x01
+            tdef += real_index
+            logical = bytearray(28)
+            struct.pack_into('<I', logical, 8, 0)
+            logical[4 + 19] = 1
+            tdef += logical
+            encoded = bytearray(u'PrimaryKey'.encode('utf-16-le'))
+            tdef += struct.pack('<H', len(encoded)) + encoded
+        if 63 + len(tdef) > PAGE_SIZE:
+            raise ValueError("The definition of table {} doesn't fit on a page".format(table.name))
+        page[63:63 + len(tdef)] = tdef
+        struct.pack_into('<I', page, 8, 63 + len(tdef))
+
+    def table(self, table):
+        """ Write a table; return the page of its definition """
+        number = self.new_page()
+        rows = [self.encode_row(table.columns, values) for values in table.rows]
+        deleted = [self.encode_row(table.columns, values) for values in table.deleted_rows]
+        # deleted rows go between the others, as they would after deleting
+        ordered = []
+        flags = []
+        for i, row in enumerate(rows):
+            if i < len(deleted):
+                ordered.append(deleted[i])
+                flags.append(DELETED_ROW)
+            ordered.append(row)
+            flags.append(0)
+        for row in deleted[len(rows):]:
+            ordered.append(row)
+            flags.append(DELETED_ROW)
+        pages, pointers = self.add_rows(number, ordered, flags)
+        self.table_definition(number, table, self.usage_map(pages), len(rows))
+        return number
+
+    def usage_map(self, pages):
+        """ Add an inline usage map (a bitmap of pages from the first one on); return its row pointer """
+        start = pages[0] if pages else 0
+        bitmap = bytearray((pages[-1] - start) // 8 + 1 if pages else 1)
+        for number in pages:
+            bitmap[(number - start) // 8] |= 1 << (number - start) % 8
+        self.usage_rows.append(bytearray(struct.pack('<BI', 0, start)) + bitmap)
+        self.set_rows(1, self.usage_rows)
+        return 1 << 8 | len(self.usage_rows) - 1
+
+    def header(self):
+        page = self.pages[0]
+        page[0:4] = b'\x00\x01\x00\x00'
+        page[4:19] = b'Standard Jet DB'
+        page[0x14] = 1
+        page[0x18:0x18 + 128] = _rc4(_HEADER_KEY, bytearray(128))
+
+
+def write_database(path, tables, queries=()):
+    """ Write a Jet 4 database with the tables, and query names in MSysObjects that mdb_jet should skip
+
+    :param tables: The tables to write.
+    :type tables: list of Table
+    """
+    writer = _Writer()
+    writer.pages[1][0], writer.pages[1][1] = DATA_PAGE, 1
+    writer.new_page()           # page 2, MSysObjects
+    definitions = [(table.name, writer.table(table)) for table in tables]
+
+    objects = [(2, 0, u'MSysObjects', TABLE_TYPE, SYSTEM_FLAGS)]
+    objects.extend((number, 0, name, TABLE_TYPE, 0) for name, number in definitions)
+    objects.extend((1000 + i, 0, name, QUERY_TYPE, 0) for i, name in enumerate(queries))
+    catalog = Table('MSysObjects', [('Id', LONG), ('ParentId', LONG), ('Name', TEXT, 128), ('Type', INT),
+                                    ('Flags', LONG)], objects)
+    rows = [writer.encode_row(catalog.columns, values) for values in objects]
+    pages, pointers = writer.add_rows(2, rows)
+    writer.table_definition(2, catalog, writer.usage_map(pages), len(rows))
+    writer.header()
+
+    with open(path, 'wb') as f:
+        for page in writer.pages:
+            f.write(bytes(page))
@@ -0,0 +1,121 @@
+from PyQt4.QtGui import QProgressBar, QPushButton
+from PyQt4.QtCore import Qt, QTimer
+from qgis.utils import iface, QgsMessageBar
+from qgis.core import QgsMessageLog
+from mdb_layer import MdbLayer
+from mdb_connection import MAX_CONNECTIONS, RESERVED_CONNECTIONS
+
+
+logger = lambda msg: QgsMessageLog.logMessage(msg, 'Mdb Loader', 1)
+
+# tables loading at the same time; the reserved connections are left for setting up the next table
+MAX_PARALLEL = MAX_CONNECTIONS - RESERVED_CONNECTIONS
+
+
+class MdbBatchImport:
+    """ Load several tables of one database, a limited number of them at the same time
+
+    Every table is an MdbLayer loading in the background, so the records of the running tables are fetched
+    concurrently, each on its own connection. Progress is shown for the batch as a whole and a summary is
+    logged when all tables are done.
+    """
+
+    def __init__(self, mdb_path, tables, max_parallel=MAX_PARALLEL, page_sizes=None, **layer_args):
+        """
+        :param mdb_path: Path to the database.
+        :type mdb_path: str
+
+        :param tables: Names of the tables and queries to load.
+        :type tables: list
+
+        :param max_parallel: Maximum number of tables loading at the same time.
+        :type max_parallel: int
+
+        :param page_sizes: Page size per table for the tables to open paged, see MdbLayer.
+        :type page_sizes: dict
+
+        :param layer_args: Extra keyword arguments for every MdbLayer.
+        """
+        self.mdb_path = mdb_path
+        self.tables = list(tables)
+        self.pending = list(tables)
+        self.max_parallel = max(1, max_parallel)
+        self.page_sizes = page_sizes or {}
+        self.layer_args = layer_args
+        self.running = []
+        self.layers = []
+        self.results = []           # (table, loaded records, error)
+        self.cancelled = False
+
+        self.setup_progressbar()
+        self.start_next()
+
+    def start_next(self):
+        """ Start loading pending tables until max_parallel tables are running """
+        while self.pending and len(self.running) < self.max_parallel and not self.cancelled:
+            table = self.pending.pop(0)
+            self.running.append(table)
+            try:
+                layer = MdbLayer(self.mdb_path, table, background=True, show_progress=False,
+                                 on_loaded=self.table_loaded, page_size=self.page_sizes.get(table),
+                                 **self.layer_args)
+            except Exception as e:
+                self.running.remove(table)
+                self.add_result(table, 0, "{}".format(e))
+                continue
+            self.layers.append(layer)
+        self.check_finished()
+
+    def table_loaded(self, layer):
+        if layer.mdb_table not in self.running:
+            return
+        self.running.remove(layer.mdb_table)
+        error = layer.error or ("cancelled" if layer.cancelled else None)
+        self.add_result(layer.mdb_table, layer.loaded_count, error)
+
+        # a table loaded from the cache reports while it is being created, so don't start the next one from here
+        QTimer.singleShot(0, self.start_next)
+
+    def add_result(self, table, count, error):
+        self.results.append((table, count, error))
+        self.progress.setValue(len(self.results))
+        self.progress_bar_item.setText("Loaded {} of {} tables ({} records)...".format(
+            len(self.results), len(self.tables), sum(result[1] for result in self.results)))
+
+    def check_finished(self):
+        if self.running or (self.pending and not self.cancelled) or self.progress is None:
+            return
+
+        failed = [result for result in self.results if result[2]]
+        for table, count, error in self.results:
+            logger("{}: {}".format(table, "failed, {}".format(error) if error else "{} records".format(count)))
+
+        iface.messageBar().popWidget(self.progress_bar_item)
+        self.progress = None
+        message = "{} of {} tables loaded, {} records".format(
+            len(self.results) - len(failed), len(self.tables), sum(result[1] for result in self.results))
+        if failed:
+            message += ". Failed: " + ", ".join(table for table, _, _ in failed) + " (see the log for details)"
+            iface.messageBar().pushMessage("MDB Loader", message, level=QgsMessageBar.WARNING)
+        else:
+            iface.messageBar().pushMessage("Ready", message, level=QgsMessageBar.INFO)
+
+    def cancel(self):
+        """ Skip the tables that didn't start yet and stop the running ones """
+        self.cancelled = True
+        self.pending = []
+        for layer in self.layers:
+            layer.cancel_loading()
+        self.check_finished()
+
+    def setup_progressbar(self):
+        self.progress_bar_item = iface.messageBar().createMessage(
+            "Loading {} tables from {}...".format(len(self.tables), self.mdb_path))
+        self.progress = QProgressBar()
+        self.progress.setMaximum(len(self.tables))
+        self.progress.setAlignment(Qt.AlignLeft | Qt.AlignVCenter)
+        self.progress_bar_item.layout().addWidget(self.progress)
+        cancel_button = QPushButton("Cancel")
+        cancel_button.clicked.connect(self.cancel)
+        self.progress_bar_item.layout().addWidget(cancel_button)
+        iface.messageBar().pushWidget(self.progress_bar_item, iface.messageBar().INFO)
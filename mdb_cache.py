@@ -0,0 +1,222 @@
+import os, glob, json, hashlib, sqlite3
+from PyQt4.QtCore import QVariant
+from qgis.core import QgsApplication, QgsField, QgsMessageLog
+from mdb_types import LAYER_FIELD_TYPES, parse_datetime, parse_date, parse_time
+
+
+logger = lambda msg: QgsMessageLog.logMessage(msg, 'Mdb Cache', 1)
+
+CACHE_MAX_SIZE = 1024 * 1024 * 1024    # bytes
+
+
+def cache_dir():
+    """ Default location of the cache: a folder in the QGIS settings directory """
+    return os.path.join(QgsApplication.qgisSettingsDirPath(), 'mdb_loader', 'cache')
+
+
+def _hash(*values):
+    return hashlib.sha1(json.dumps(values)).hexdigest()[:16]
+
+
+def _to_text(value):
+    if value is None or isinstance(value, basestring):
+        return value
+    return unicode(value)
+
+
+def _to_iso(value):
+    return None if value is None else value.isoformat()
+
+
+def _to_float(value):
+    return None if value is None else float(value)
+
+
+# conversion of database values for storing in SQLite, by field type. SQLite handles int, float and text as is
+_store_converters = {QVariant.String: _to_text, QVariant.Double: _to_float,
+                     QVariant.DateTime: _to_iso, QVariant.Date: _to_iso, QVariant.Time: _to_iso}
+
+# conversion of stored values to attribute values, by field type
+_load_converters = {QVariant.DateTime: parse_datetime, QVariant.Date: parse_date, QVariant.Time: parse_time}
+
+
+class MdbCache:
+    """ On-disk cache of loaded tables
+
+    Every loaded table is stored in a SQLite file with its fields (name, type, length and precision),
+    primary keys and rows. The file name is derived from the database path, the table, the query used
+    to load it, and the modification time and size of the database, so a changed database never matches
+    its old entries.
+    The least recently used entries are removed when the cache grows beyond max_size.
+    """
+
+    def __init__(self, directory=None, max_size=CACHE_MAX_SIZE):
+        self.directory = directory or cache_dir()
+        self.max_size = max_size
+
+    def entry_prefix(self, mdb_path, table, query):
+        """ Return the part of the cache file name that doesn't depend on the state of the database file """
+        return os.path.join(self.directory, "{}_{}".format(_hash(os.path.normcase(os.path.abspath(mdb_path))),
+                                                           _hash(table, query)))
+
+    def entry_path(self, mdb_path, table, query):
+        stat = os.stat(mdb_path)
+        return "{}_{}.sqlite".format(self.entry_prefix(mdb_path, table, query), _hash(stat.st_mtime, stat.st_size))
+
+    def load(self, mdb_path, table, query):
+        """ Return the CacheEntry for a table, or None if the table isn't cached (anymore) """
+        path = self.entry_path(mdb_path, table, query)
+        if not os.path.isfile(path):
+            return None
+        try:
+            entry = CacheEntry(path)
+        except sqlite3.Error as e:
+            logger("Ignoring broken cache file {}. Error: {}".format(path, e))
+            self._remove(path)
+            return None
+        os.utime(path, None)    # mark as recently used
+        return entry
+
+    def last_count(self, mdb_path, table, query):
+        """ Return the number of records of the last complete load of a table, whether or not it's cached """
+        return self._counts().get(os.path.basename(self.entry_prefix(mdb_path, table, query)))
+
+    def store_count(self, mdb_path, table, query, record_count):
+        counts = self._counts()
+        counts[os.path.basename(self.entry_prefix(mdb_path, table, query))] = record_count
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        with open(os.path.join(self.directory, 'counts.json'), 'w') as f:
+            json.dump(counts, f)
+
+    def _counts(self):
+        try:
+            with open(os.path.join(self.directory, 'counts.json')) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def writer(self, mdb_path, table, query, fields, pk_cols, read_only):
+        """ Return a CacheWriter for a table that is about to be loaded
+
+        :param fields: The fields of the layer.
+        :type fields: list of QgsField
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        return CacheWriter(self, self.entry_path(mdb_path, table, query), fields, pk_cols, read_only)
+
+    def invalidate(self, mdb_path=None, table=None, query=None):
+        """ Remove the cached tables of a database, or a single table of it. Without arguments everything is removed """
+        if mdb_path is None:
+            pattern = os.path.join(self.directory, "*.sqlite")
+        elif table is None:
+            pattern = self.entry_prefix(mdb_path, '', '').rsplit('_', 1)[0] + "_*.sqlite"
+        else:
+            pattern = self.entry_prefix(mdb_path, table, query) + "_*.sqlite"
+        for path in glob.glob(pattern):
+            self._remove(path)
+
+    def invalidate_prefix(self, path):
+        """ Remove the entries that only differ from path in the state of the database file """
+        for old_path in glob.glob(path.rsplit('_', 1)[0] + "_*.sqlite"):
+            self._remove(old_path)
+
+    def evict(self):
+        """ Remove the least recently used entries until the cache fits in max_size """
+        entries = [(os.path.getmtime(path), os.path.getsize(path), path)
+                   for path in glob.glob(os.path.join(self.directory, "*.sqlite"))]
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            self._remove(path)
+            total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger("Couldn't remove cache file {}. Error: {}".format(path, e))
+
+
+class CacheEntry:
+    """ A cached table """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        meta = dict(self.conn.execute("SELECT key, value FROM meta"))
+        # files of versions that only stored name and type fail here and are loaded from the database again
+        self.fields = [QgsField(name, field_type, type_name, length, precision)
+                       for name, field_type, type_name, length, precision in self.conn.execute(
+                           "SELECT name, type, type_name, length, precision FROM fields ORDER BY position")]
+        if any(field.type() not in LAYER_FIELD_TYPES for field in self.fields):
+            raise sqlite3.DatabaseError("fields of a type the memory layer doesn't take")
+        self.pk_cols = json.loads(meta['pk_cols'])
+        self.read_only = json.loads(meta['read_only'])
+        self.record_count = json.loads(meta['record_count'])
+        self.converters = [(i, _load_converters[field.type()]) for i, field in enumerate(self.fields)
+                           if field.type() in _load_converters]
+
+    def batches(self, batch_size):
+        """ Yield the cached rows, converted to attribute values, as lists of lists of batch_size rows """
+        cur = self.conn.execute("SELECT * FROM rows ORDER BY rowid")
+        while True:
+            rows = [list(row) for row in cur.fetchmany(batch_size)]
+            if not rows:
+                break
+            for i, converter in self.converters:
+                for row in rows:
+                    if row[i] is not None:
+                        row[i] = converter(row[i])
+            yield rows
+        self.conn.close()
+
+
+class CacheWriter:
+    """ Store the rows of a table while it is loaded. The entry becomes visible when committed """
+
+    def __init__(self, cache, path, fields, pk_cols, read_only):
+        self.cache = cache
+        self.path = path
+        self.temp_path = path + '.part'
+        self.meta = {'pk_cols': pk_cols, 'read_only': read_only}
+        self.converters = [(i, _store_converters[field.type()]) for i, field in enumerate(fields)
+                           if field.type() in _store_converters]
+
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+        self.conn = sqlite3.connect(self.temp_path)
+        self.conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.execute("CREATE TABLE fields (position INTEGER PRIMARY KEY, name TEXT, type INTEGER, "
+                          "type_name TEXT, length INTEGER, precision INTEGER)")
+        self.conn.executemany("INSERT INTO fields VALUES (?, ?, ?, ?, ?, ?)",
+                              [(i, field.name(), field.type(), field.typeName(), field.length(), field.precision())
+                               for i, field in enumerate(fields)])
+        self.conn.execute("CREATE TABLE rows ({})".format(", ".join("c{}".format(i) for i in range(len(fields)))))
+        self.insert_sql = "INSERT INTO rows VALUES ({})".format(", ".join("?" * len(fields)))
+
+    def add_rows(self, rows):
+        if self.converters:
+            rows = [list(row) for row in rows]
+            for row in rows:
+                for i, converter in self.converters:
+                    row[i] = converter(row[i])
+        self.conn.executemany(self.insert_sql, rows)
+
+    def commit(self, record_count):
+        """ Finish the entry and make it available to the next load """
+        self.meta['record_count'] = record_count
+        self.conn.executemany("INSERT INTO meta VALUES (?, ?)",
+                              [(key, json.dumps(value)) for key, value in self.meta.items()])
+        self.conn.commit()
+        self.conn.close()
+
+        # replace entries of older versions of the database file
+        self.cache.invalidate_prefix(self.path)
+        os.rename(self.temp_path, self.path)
+        self.cache.evict()
+
+    def discard(self):
+        self.conn.close()
+        self.cache._remove(self.temp_path)
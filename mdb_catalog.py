@@ -0,0 +1,132 @@
+import os, json, hashlib
+from PyQt4.QtCore import QObject, pyqtSignal
+from qgis.core import QgsMessageLog
+from mdb_cache import cache_dir
+from mdb_connection import quote, SQL_TABLE_STAT
+
+logger = lambda msg: QgsMessageLog.logMessage(msg, 'Mdb Catalog', 1)
+
+
+def catalog_path(mdb_path, directory=None):
+    key = hashlib.sha1(json.dumps(os.path.normcase(os.path.abspath(mdb_path)))).hexdigest()[:16]
+    return os.path.join(directory or cache_dir(), "catalog_{}.json".format(key))
+
+
+def file_state(mdb_path):
+    stat = os.stat(mdb_path)
+    return [stat.st_mtime, stat.st_size]
+
+
+def load_catalog(mdb_path, directory=None):
+    """ Return the stored MdbCatalog of a database, or None if there is none or the database changed since """
+    path = catalog_path(mdb_path, directory)
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (IOError, ValueError):
+        return None
+    catalog = MdbCatalog(mdb_path, data['tables'], data['columns'], data['pk_cols'], data['row_counts'],
+                         data['state'])
+    return catalog if catalog.is_current() else None
+
+
+def store_row_count(mdb_path, table, count, directory=None):
+    """ Put the number of records of a completely loaded table in the stored catalog of its database, if it
+    has a current one. cursor.statistics doesn't always know the row count, a load does """
+    catalog = load_catalog(mdb_path, directory)
+    if catalog is None or catalog.row_counts.get(table) == count:
+        return
+    catalog.row_counts[table] = count
+    catalog.save(directory)
+
+
+def read_catalog(cur, mdb_path, tables_only=False):
+    """ Read the catalog of a database. tables_only skips the columns, primary keys and row counts,
+    which take a query per table """
+    state = file_state(mdb_path)
+    tables = [(row.table_name, row.table_type) for row in cur.tables(tableType="TABLE, VIEW").fetchall()]
+    catalog = MdbCatalog(mdb_path, tables, state=state)
+    if tables_only:
+        return catalog
+
+    for name, table_type in tables:
+        try:
+            cur.execute("SELECT * FROM {} WHERE 1 = 0".format(quote(name)))
+            catalog.columns[name] = [(column[0], column[1].__name__) for column in cur.description]
+            if table_type == 'TABLE':
+                statistics = cur.statistics(name).fetchall()
+                catalog.pk_cols[name] = [row[8] for row in statistics if row[5] == 'PrimaryKey']
+                count = next((row[10] for row in statistics if row[6] == SQL_TABLE_STAT), None)
+                if count is not None:
+                    catalog.row_counts[name] = count
+        except Exception as e:
+            # a broken query or a linked table that can't be reached shouldn't hide the others
+            logger("Couldn't read the columns of {}. Error: {}".format(name, e))
+    return catalog
+
+
+class MdbCatalog:
+    """ What's in a database: its tables and queries, their columns (name and python type name),
+    primary keys and last known row counts
+
+    A catalog is stored as JSON in the cache folder with the modification time and size of the database
+    file it was read from; once the file changes, the stored catalog is no longer used.
+    """
+
+    def __init__(self, mdb_path, tables, columns=None, pk_cols=None, row_counts=None, state=None):
+        self.mdb_path = mdb_path
+        self.tables = [tuple(table) for table in tables]     # [(name, 'TABLE' or 'VIEW')]
+        self.columns = columns or {}
+        self.pk_cols = pk_cols or {}
+        self.row_counts = row_counts or {}
+        self.state = state
+
+    def is_current(self):
+        try:
+            return self.state == file_state(self.mdb_path)
+        except OSError:
+            return False
+
+    def column_names(self, table):
+        """ Return the column names of a table, or None if they aren't in the catalog """
+        if table not in self.columns:
+            return None
+        return [name for name, _ in self.columns[table]]
+
+    def save(self, directory=None):
+        path = catalog_path(self.mdb_path, directory)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        data = {'tables': self.tables, 'columns': self.columns, 'pk_cols': self.pk_cols,
+                'row_counts': self.row_counts, 'state': self.state}
+        with open(path + '.part', 'w') as f:
+            json.dump(data, f)
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(path + '.part', path)
+
+
+class MdbCatalogWorker(QObject):
+    """ Read the complete catalog of a database on a separate thread and store it """
+
+    finished = pyqtSignal(str, object)      # the database path and its MdbCatalog, or None if it couldn't be read
+
+    def __init__(self, pool, mdb_path):
+        QObject.__init__(self)
+        self.pool = pool
+        self.mdb_path = mdb_path
+
+    def run(self):
+        catalog = None
+        try:
+            with self.pool.connection() as conn:
+                catalog = read_catalog(conn.cursor(), self.mdb_path)
+            # keep the counts that loads stored for tables the statistics have no row count of
+            previous = load_catalog(self.mdb_path)
+            if previous is not None:
+                for table, count in previous.row_counts.items():
+                    catalog.row_counts.setdefault(table, count)
+            catalog.save()
+        except Exception as e:
+            logger("Couldn't read the catalog of {}. Error: {}".format(self.mdb_path, e))
+        self.finished.emit(self.mdb_path, catalog)
@@ -0,0 +1,250 @@
+import time, threading
+from contextlib import contextmanager
+from qgis.core import QgsMessageLog
+import mdb_jet
+
+try:
+    import pyodbc
+except ImportError:
+    pyodbc = None
+
+
+logger = lambda msg: QgsMessageLog.logMessage(msg, 'Mdb Connection', 1)
+
+MAX_CONNECTIONS = 4         # per database
+CONNECT_TIMEOUT = 3         # seconds
+ACQUIRE_TIMEOUT = 30        # seconds to wait for a free connection
+GUI_ACQUIRE_TIMEOUT = 3     # seconds the GUI thread waits for a free connection
+RESERVED_CONNECTIONS = 1    # connections per database that only the GUI thread uses, background reads can't
+IDLE_TIMEOUT = 300          # seconds after which an unused connection is closed
+CHECK_AFTER = 10            # seconds idle after which a connection is checked before handing it out
+REAP_INTERVAL = 30          # seconds between looking for idle connections to close
+
+SQL_TABLE_STAT = 0          # type of the row of cursor.statistics with the number of rows of the table
+
+# how databases are read: 'odbc' with the Access driver, 'jet' straight from the file (read only, see mdb_jet),
+# or 'auto' for ODBC where the Access driver is installed and the file otherwise
+BACKENDS = ('auto', 'odbc', 'jet')
+DEFAULT_BACKEND = 'auto'
+ACCESS_DRIVER = "Microsoft Access Driver (*.mdb, *.accdb)"
+
+_pools = {}
+_pools_lock = threading.Lock()
+_reaper = []                # the thread closing idle connections, while there are pools
+_gui_thread = threading.current_thread()        # the plugin is imported on the GUI thread
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+def connection_string(mdb_path):
+    return "DRIVER={" + ACCESS_DRIVER + "};FIL={MS Access};DBQ=" + mdb_path
+
+
+def odbc_available():
+    """ Return whether pyodbc and the Access driver are installed """
+    if pyodbc is None:
+        return False
+    try:
+        return ACCESS_DRIVER in pyodbc.drivers()
+    except AttributeError:      # pyodbc before 3.0.10 can't list its drivers
+        return True
+
+
+def resolve_backend(backend=None):
+    """ Return 'odbc' or 'jet' for a backend setting, None meaning DEFAULT_BACKEND """
+    backend = backend or DEFAULT_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError("Unknown backend '{}', use one of {}".format(backend, ", ".join(BACKENDS)))
+    if backend == 'auto':
+        return 'odbc' if odbc_available() else 'jet'
+    return backend
+
+
+def quote(name):
+    """ Return a table or column name quoted for Access SQL """
+    return "[" + name.replace("]", "]]") + "]"
+
+
+def column_names(cur, table):
+    """ Return the column names of a table or query, without fetching any records """
+    cur.execute("SELECT * FROM {} WHERE 1 = 0".format(quote(table)))
+    return [column[0] for column in cur.description]
+
+
+def get_pool(mdb_path, backend=None):
+    """ Return the connection pool of a database, creating it on first use
+
+    :param backend: How the database is read: 'odbc', 'jet' or 'auto'; None for DEFAULT_BACKEND.
+    :type backend: str
+    """
+    backend = resolve_backend(backend)
+    with _pools_lock:
+        if (mdb_path, backend) not in _pools:
+            _pools[(mdb_path, backend)] = ConnectionPool(mdb_path, backend=backend)
+        if not _reaper:
+            _reaper.append(_Reaper())
+            _reaper[0].start()
+        return _pools[(mdb_path, backend)]
+
+
+def close_all():
+    """ Close the connections of all databases, connections in use are closed when they are released """
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+        reapers = list(_reaper)
+        del _reaper[:]
+    for reaper in reapers:
+        reaper.stop()
+
+
+class _Reaper(threading.Thread):
+    """ Close connections that were idle for longer than their pool's idle_timeout every REAP_INTERVAL seconds,
+    so a loaded layer doesn't keep the database (and its .ldb lock file) open """
+
+    def __init__(self):
+        threading.Thread.__init__(self, name='mdb connection reaper')
+        self.daemon = True
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(REAP_INTERVAL):
+            with _pools_lock:
+                pools = list(_pools.values())
+            for pool in pools:
+                pool.close_expired()
+
+    def stop(self):
+        self.stopped.set()
+        self.join(1)
+
+
+class ConnectionPool:
+    """ A limited number of pyodbc connections to one database, reused between the plugin and its layers
+
+    A connection must only be used by one thread at a time: acquire it, use it, and release it again.
+    RESERVED_CONNECTIONS are kept for the GUI thread: workers reading in the background can't take all
+    connections, so opening a layer or loading a page doesn't freeze QGIS waiting for one of them.
+    With the 'jet' backend the connections read the file directly and can't write.
+    """
+
+    def __init__(self, mdb_path, max_connections=MAX_CONNECTIONS, idle_timeout=IDLE_TIMEOUT, backend='odbc'):
+        self.mdb_path = mdb_path
+        self.backend = backend
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.idle = []             # (connection, released at)
+        self.in_use = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def acquire(self, timeout=None):
+        """ Return a healthy connection, opening one if none is idle. Blocks while all connections are in use
+
+        :param timeout: Seconds to wait for a free connection; None for GUI_ACQUIRE_TIMEOUT on the GUI thread
+            and ACQUIRE_TIMEOUT on others.
+        :type timeout: float
+
+        :raises PoolTimeout: when no connection became available within timeout seconds.
+        """
+        on_gui_thread = threading.current_thread() is _gui_thread
+        if timeout is None:
+            timeout = GUI_ACQUIRE_TIMEOUT if on_gui_thread else ACQUIRE_TIMEOUT
+        limit = self.max_connections if on_gui_thread else max(1, self.max_connections - RESERVED_CONNECTIONS)
+        deadline = time.time() + timeout
+        conn = None
+        with self.condition:
+            expired = self._take_expired()
+            while True:
+                if self.in_use < limit:
+                    if self.idle:
+                        conn, released = self.idle.pop()
+                    self.in_use += 1
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise PoolTimeout("No free connection to {} within {} seconds".format(self.mdb_path, timeout))
+                self.condition.wait(remaining)
+        for item in expired:
+            self._close(item[0])
+
+        # check and connect outside the lock, both may take a while on a network share
+        if conn is not None:
+            if time.time() - released < CHECK_AFTER or self._healthy(conn):
+                return conn
+            self._close(conn)       # its place goes to a new connection
+        try:
+            if self.backend == 'jet':
+                return mdb_jet.connect(self.mdb_path)
+            if pyodbc is None:
+                raise ImportError("pyodbc is not installed, open the database with the 'jet' backend")
+            return pyodbc.connect(connection_string(self.mdb_path), timeout=CONNECT_TIMEOUT)
+        except Exception:
+            with self.condition:
+                self.in_use -= 1
+                self.condition.notify()
+            raise
+
+    def release(self, conn):
+        """ Hand a connection back to the pool. Uncommitted changes are rolled back """
+        # roll back before taking the lock, so other threads aren't held up by a slow database
+        try:
+            conn.rollback()
+            healthy = True
+        except Exception:
+            healthy = False
+        with self.condition:
+            self.in_use -= 1
+            keep = healthy and not self.closed
+            if keep:
+                self.idle.append((conn, time.time()))
+            self.condition.notify()
+        if not keep:
+            self._close(conn)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """ Close the idle connections and make sure connections still in use are closed on release """
+        with self.condition:
+            self.closed = True
+            while self.idle:
+                self._close(self.idle.pop()[0])
+
+    def close_expired(self):
+        """ Close the connections that were idle for longer than idle_timeout """
+        with self.condition:
+            expired = self._take_expired()
+        for item in expired:
+            self._close(item[0])
+
+    def _take_expired(self):
+        """ Remove the expired connections from the idle ones and return them; call with the condition held """
+        now = time.time()
+        expired = [item for item in self.idle if now - item[1] > self.idle_timeout]
+        for item in expired:
+            self.idle.remove(item)
+        return expired
+
+    def _healthy(self, conn):
+        try:
+            conn.cursor().tables(tableType='TABLE').fetchone()
+            return True
+        except Exception as e:
+            logger("Dropping broken connection to {}. Error: {}".format(self.mdb_path, e))
+            return False
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
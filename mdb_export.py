@@ -0,0 +1,300 @@
+import os, datetime, decimal
+from PyQt4.QtCore import QObject, pyqtSignal
+from qgis.core import QgsMessageLog
+from mdb_connection import get_pool, quote
+
+
+logger = lambda msg: QgsMessageLog.logMessage(msg, 'Mdb Export', 1)
+
+EXPORT_BATCH_SIZE = 5000
+FORMATS = ('gpkg', 'parquet')
+
+
+class ExportError(Exception):
+    pass
+
+
+def export_tables(mdb_path, tables, output, file_format='gpkg', batch_size=EXPORT_BATCH_SIZE, subsets=None,
+                  x_column=None, y_column=None, crs=4326, progress=None, cancelled=None, backend=None):
+    """ Write tables of a database to a GeoPackage or Parquet file(s) without loading them in a layer
+
+    The records are fetched in batches and every batch is written before the next one is fetched, so
+    memory use depends on the batch size, not on the size of the tables. The tables are exported one
+    after another on a single connection.
+
+    :param mdb_path: Path to the database.
+    :type mdb_path: str
+
+    :param tables: Names of the tables and queries to export.
+    :type tables: list
+
+    :param output: The GeoPackage file, every table becomes a layer in it (existing layers are replaced).
+        For Parquet a folder, every table becomes a file <table>.parquet in it.
+    :type output: str
+
+    :param file_format: 'gpkg' or 'parquet'.
+    :type file_format: str
+
+    :param subsets: Access SQL condition (without WHERE) per table, limiting the exported records.
+    :type subsets: dict
+
+    :param x_column: Column with the x coordinate; tables having both coordinate columns get point geometries
+        in a GeoPackage.
+    :type x_column: str
+
+    :param y_column: Column with the y coordinate.
+    :type y_column: str
+
+    :param crs: EPSG code of the coordinates.
+    :type crs: int
+
+    :param progress: Called with the table name and the number of records written so far, after every batch.
+    :type progress: function
+
+    :param cancelled: Called before every batch, stops the export when it returns True.
+    :type cancelled: function
+
+    :param backend: How the database is read, see mdb_connection.get_pool. The 'jet' backend can't filter
+        with subsets.
+    :type backend: str
+
+    :returns: Number of exported records per table.
+    :rtype: dict
+
+    :raises ExportError: when the format is unknown or its library is missing.
+    """
+    if file_format == 'gpkg':
+        writer = GpkgWriter(output, x_column, y_column, crs)
+    elif file_format == 'parquet':
+        writer = ParquetWriter(output)
+    else:
+        raise ExportError("Unknown export format '{}', use one of {}".format(file_format, ", ".join(FORMATS)))
+
+    subsets = subsets or {}
+    counts = {}
+    try:
+        with get_pool(mdb_path, backend).connection() as conn:
+            cur = conn.cursor()
+            try:
+                for table in tables:
+                    sql = "SELECT * FROM {}".format(quote(table))
+                    if subsets.get(table):
+                        sql += " WHERE " + subsets[table]
+                    cur.execute(sql)
+                    writer.begin_table(table, cur.description)
+                    counts[table] = 0
+                    while not (cancelled and cancelled()):
+                        rows = cur.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        writer.write_rows(rows)
+                        counts[table] += len(rows)
+                        if progress is not None:
+                            progress(table, counts[table])
+                    writer.end_table()
+                    logger("{} records of {} exported to {}".format(counts[table], table, output))
+                    if cancelled and cancelled():
+                        break
+            finally:
+                cur.close()
+    finally:
+        writer.close()
+    return counts
+
+
+def _to_float(value):
+    return float(value)
+
+
+def _to_bytes(value):
+    return bytes(value)
+
+
+class GpkgWriter:
+    """ Write tables as layers of a GeoPackage with OGR, one transaction per batch """
+
+    def __init__(self, path, x_column=None, y_column=None, crs=4326):
+        try:
+            from osgeo import ogr, osr
+        except ImportError:
+            raise ExportError("GeoPackage export needs the GDAL python bindings (osgeo)")
+        self.ogr = ogr
+        self.x_column = x_column
+        self.y_column = y_column
+        self.srs = osr.SpatialReference()
+        self.srs.ImportFromEPSG(crs)
+
+        driver = ogr.GetDriverByName('GPKG')
+        if driver is None:
+            raise ExportError("This GDAL version can't write GeoPackages")
+        self.datasource = driver.Open(path, 1) if os.path.exists(path) else driver.CreateDataSource(path)
+        if self.datasource is None:
+            raise ExportError("Couldn't open {} for writing".format(path))
+        self.layer = None
+
+    def begin_table(self, table, description):
+        ogr = self.ogr
+        names = [column[0] for column in description]
+        self.xy_indexes = None
+        if self.x_column in names and self.y_column in names:
+            self.xy_indexes = (names.index(self.x_column), names.index(self.y_column))
+
+        for i in range(self.datasource.GetLayerCount()):
+            if self.datasource.GetLayer(i).GetName() == table:
+                self.datasource.DeleteLayer(i)
+                break
+        self.layer = self.datasource.CreateLayer(table.encode('utf-8'), self.srs if self.xy_indexes else None,
+                                                 ogr.wkbPoint if self.xy_indexes else ogr.wkbNone,
+                                                 ['SPATIAL_INDEX=YES'] if self.xy_indexes else [])
+
+        # how to set the value of every column, chosen once per table
+        self.setters = []
+        for i, column in enumerate(description):
+            field, setter = self.field_definition(column)
+            self.layer.CreateField(field)
+            self.setters.append((i, setter))
+        self.definition = self.layer.GetLayerDefn()
+
+    def field_definition(self, column):
+        """ Return an OGR field definition for a column of a cursor description, and a function setting its value """
+        ogr = self.ogr
+        name, python_type = column[0], column[1]
+        if python_type in (int, long, bool):
+            field_type = ogr.OFTInteger64 if python_type is long and hasattr(ogr, 'OFTInteger64') else ogr.OFTInteger
+            field = ogr.FieldDefn(name, field_type)
+            if python_type is bool and hasattr(ogr, 'OFSTBoolean'):
+                field.SetSubType(ogr.OFSTBoolean)
+            return field, lambda feature, i, value: feature.SetField(i, int(value))
+        if python_type in (float, decimal.Decimal):
+            field = ogr.FieldDefn(name, ogr.OFTReal)
+            if python_type is decimal.Decimal and column[4]:
+                field.SetWidth(column[4])
+                field.SetPrecision(column[5] or 0)
+            return field, lambda feature, i, value: feature.SetField(i, float(value))
+        if python_type is datetime.datetime:
+            return ogr.FieldDefn(name, ogr.OFTDateTime), lambda feature, i, value: feature.SetField(
+                i, value.year, value.month, value.day, value.hour, value.minute, value.second, 0)
+        if python_type is datetime.date:
+            return ogr.FieldDefn(name, ogr.OFTDate), lambda feature, i, value: feature.SetField(
+                i, value.year, value.month, value.day, 0, 0, 0, 0)
+        if python_type is datetime.time:
+            return ogr.FieldDefn(name, ogr.OFTTime), lambda feature, i, value: feature.SetField(
+                i, 0, 0, 0, value.hour, value.minute, value.second, 0)
+        if python_type in (bytearray, buffer):
+            return ogr.FieldDefn(name, ogr.OFTBinary), lambda feature, i, value: \
+                feature.SetFieldBinaryFromHexString(i, bytes(value).encode('hex'))
+        field = ogr.FieldDefn(name, ogr.OFTString)
+        if column[3]:
+            field.SetWidth(column[3])
+        return field, lambda feature, i, value: feature.SetField(
+            i, (value if isinstance(value, unicode) else unicode(value)).encode('utf-8'))
+
+    def write_rows(self, rows):
+        ogr = self.ogr
+        self.layer.StartTransaction()
+        for row in rows:
+            feature = ogr.Feature(self.definition)
+            for i, setter in self.setters:
+                if row[i] is not None:
+                    setter(feature, i, row[i])
+            if self.xy_indexes:
+                x, y = row[self.xy_indexes[0]], row[self.xy_indexes[1]]
+                if x is not None and y is not None:
+                    point = ogr.Geometry(ogr.wkbPoint)
+                    point.AddPoint_2D(float(x), float(y))
+                    feature.SetGeometryDirectly(point)
+            self.layer.CreateFeature(feature)
+        self.layer.CommitTransaction()
+
+    def end_table(self):
+        self.layer.SyncToDisk()
+        self.layer = None
+
+    def close(self):
+        self.layer = None
+        self.datasource = None     # closes the file
+
+
+class ParquetWriter:
+    """ Write every table to its own Parquet file with pyarrow, one row group per batch """
+
+    def __init__(self, directory):
+        try:
+            import pyarrow, pyarrow.parquet
+        except ImportError:
+            raise ExportError("Parquet export needs pyarrow, install it in the Python of QGIS")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.writer = None
+
+    def begin_table(self, table, description):
+        pa = self.pa
+        types = {int: pa.int32(), long: pa.int64(), bool: pa.bool_(), float: pa.float64(),
+                 decimal.Decimal: pa.float64(), datetime.datetime: pa.timestamp('us'), datetime.date: pa.date32(),
+                 datetime.time: pa.time64('us'), bytearray: pa.binary(), buffer: pa.binary()}
+        converters = {decimal.Decimal: _to_float, bytearray: _to_bytes, buffer: _to_bytes}
+        self.columns = []          # (name, pyarrow type, converter)
+        for column in description:
+            self.columns.append((column[0], types.get(column[1], pa.string()), converters.get(column[1])))
+        self.schema = pa.schema([pa.field(name, arrow_type) for name, arrow_type, _ in self.columns])
+        path = os.path.join(self.directory, "".join(c if c.isalnum() or c in '-_' else '_' for c in table) + '.parquet')
+        self.writer = self.pq.ParquetWriter(path, self.schema)
+
+    def write_rows(self, rows):
+        pa = self.pa
+        arrays = []
+        for i, (name, arrow_type, converter) in enumerate(self.columns):
+            values = [row[i] for row in rows]
+            if converter is not None:
+                values = [None if value is None else converter(value) for value in values]
+            elif arrow_type == pa.string():
+                values = [None if value is None or isinstance(value, unicode) else unicode(value) for value in values]
+            arrays.append(pa.array(values, type=arrow_type))
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def end_table(self):
+        self.writer.close()
+        self.writer = None
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class MdbExportWorker(QObject):
+    """ Run export_tables on a separate thread; start it with mdb_worker.start_worker """
+
+    progress = pyqtSignal(str, int)
+    finished = pyqtSignal(int, bool)
+    error = pyqtSignal(str)
+
+    def __init__(self, mdb_path, tables, output, file_format='gpkg', **export_args):
+        QObject.__init__(self)
+        self.mdb_path = mdb_path
+        self.tables = tables
+        self.output = output
+        self.file_format = file_format
+        self.export_args = export_args
+        self.killed = False
+        self.counts = {}
+
+    def run(self):
+        try:
+            self.counts = export_tables(self.mdb_path, self.tables, self.output, self.file_format,
+                                        progress=self.table_progress, cancelled=lambda: self.killed,
+                                        **self.export_args)
+        except Exception as e:
+            self.error.emit("{}".format(e))
+        self.finished.emit(sum(self.counts.values()), self.killed)
+
+    def table_progress(self, table, count):
+        """ Keep the counts up to date, so a failing export still reports what was written """
+        self.counts[table] = count
+        self.progress.emit(table, count)
+
+    def kill(self):
+        self.killed = True
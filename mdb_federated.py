@@ -0,0 +1,312 @@
+import glob
+from PyQt4.QtGui import QProgressBar, QPushButton
+from PyQt4.QtCore import Qt, QVariant, QEventLoop
+from qgis.utils import iface, QgsMessageBar
+from qgis.core import QgsVectorLayer, QgsField, QgsMapLayerRegistry, QgsMessageLog
+from mdb_worker import MdbLoadWorker, start_worker
+from mdb_connection import ConnectionPool, resolve_backend
+from mdb_types import field_from_column, row_converter
+from mdb_reader import (BATCH_SIZE, DEFAULT_CRS, select_list, select_sql, fields_from_description,
+                        coordinate_indexes, features_from_rows)
+
+
+logger = lambda msg: QgsMessageLog.logMessage(msg, 'Mdb Federated', 1)
+
+MAX_PARALLEL_FILES = 8          # databases read at the same time, each on its own connection and thread
+SOURCE_COLUMN = 'source_file'   # attribute with the path of the database a record comes from
+
+
+def database_files(sources):
+    """ Return the database paths of a glob pattern or a list of paths and patterns, in order, without duplicates """
+    if isinstance(sources, basestring):
+        sources = [sources]
+    paths = []
+    for source in sources:
+        matches = sorted(glob.glob(source)) if glob.has_magic(source) else [source]
+        paths.extend(path for path in matches if path not in paths)
+    return paths
+
+
+def schema_differences(reference, description):
+    """ Return why a table can't be loaded into a layer made for another one, an empty list if it can
+
+    Every column of the reference must be in the table (names are compared like Access does, ignoring case)
+    with the same field type; extra columns are fine, they aren't selected.
+
+    :param reference: Cursor description of the selected columns of the first database.
+    :type reference: list
+
+    :param description: Cursor description of all columns of the table in another database.
+    :type description: list
+    """
+    types = dict((column[0].lower(), field_from_column(column)[0].type()) for column in description)
+    problems = []
+    for column in reference:
+        name = column[0].lower()
+        if name not in types:
+            problems.append("column {} is missing".format(column[0]))
+        elif types[name] != field_from_column(column)[0].type():
+            problems.append("column {} has another type".format(column[0]))
+    return problems
+
+
+class _Source:
+    """ One database of a federated layer and the worker reading it """
+
+    def __init__(self, path):
+        self.path = path
+        self.pool = None            # connections of this database only, closed once it's read
+        self.worker = None
+        self.thread = None
+        self.convert = None         # row converter for this database, set by the worker once it checked the schema
+        self.count = 0
+        self.error = None
+
+
+class MdbFederatedLayer:
+    """ One read only layer with a table that is in many databases with the same schema, like the databases
+    field crews return
+
+    The schema of the first database makes the fields of the layer, plus SOURCE_COLUMN with the path of the
+    database of every record. Every database is checked against it with schema_differences before its records
+    are read; databases that don't match are skipped and reported. Up to max_parallel databases are read at the
+    same time, every one by its own MdbLoadWorker with its own connection pool, and their batches all go
+    into the layer as they arrive, so loading many databases takes about as long as the largest one.
+    The pools aren't shared with other layers: a pool is closed as soon as its database is read, so the
+    databases aren't kept open (and locked) after loading.
+    """
+
+    def __init__(self, mdb_paths, mdb_table, mdb_columns='*', mdb_subset='', batch_size=BATCH_SIZE,
+                 max_parallel=MAX_PARALLEL_FILES, x_column=None, y_column=None, crs=DEFAULT_CRS,
+                 background=True, show_progress=True, add_to_map=True, on_loaded=None, backend=None):
+        """
+        :param mdb_paths: Paths of the databases, with glob patterns like C:/crews/*.mdb, or a single pattern.
+        :type mdb_paths: list
+
+        :param mdb_table: Table or query to load from every database.
+        :type mdb_table: str
+
+        :param mdb_columns: Comma separated list of columns to load. Defaults to all (*) of the first database.
+        :type mdb_columns: str
+
+        :param mdb_subset: Access SQL condition for the records to load, in every database.
+        :type mdb_subset: str
+
+        :param max_parallel: Maximum number of databases read at the same time.
+        :type max_parallel: int
+
+        :param background: Return while the records are loading. Otherwise wait until all databases are done,
+            handling the batches meanwhile (for Processing and scripts).
+        :type background: bool
+
+        :param on_loaded: Called with this layer when all databases are done.
+        :type on_loaded: function
+
+        :param backend: How the databases are read, see MdbLayer.
+        :type backend: str
+        """
+        self.mdb_table = mdb_table
+        self.mdb_subset = mdb_subset
+        self.batch_size = batch_size
+        self.max_parallel = max(1, max_parallel)
+        self.x_column = x_column
+        self.y_column = y_column
+        self.crs = crs
+        self.backend = backend
+        self.show_progress = show_progress
+        self.add_to_map = add_to_map
+        self.on_loaded = on_loaded
+        self.sources = [_Source(path) for path in database_files(mdb_paths)]
+        self.pending = list(self.sources)
+        self.running = []
+        self.loaded_count = 0
+        self.xy_indexes = None
+        self.lyr = None
+        self.loading = False
+        self.cancelled = False
+        self.error = None
+        self.progress = None
+        self.event_loop = None
+
+        if not self.sources:
+            self.fail("No databases found")
+            self.notify_loaded()
+            return
+        try:
+            self.reference = self.read_reference(self.sources[0].path, mdb_columns)
+        except Exception as e:
+            self.fail("Couldn't read {} from {}. Error: {}".format(mdb_table, self.sources[0].path, e))
+            self.notify_loaded()
+            return
+        self.column_names = [column[0] for column in self.reference]
+        self.sql = select_sql(mdb_table, select_list(self.column_names), [mdb_subset])
+        self.create_layer()
+
+        self.loading = True
+        if self.show_progress:
+            self.setup_progressbar()
+        self.start_next()
+        if not background and self.loading:
+            self.event_loop = QEventLoop()
+            self.event_loop.exec_()
+
+    def read_reference(self, path, mdb_columns):
+        """ Return the cursor description of the selected columns in the first database """
+        pool = ConnectionPool(path, backend=resolve_backend(self.backend))
+        try:
+            with pool.connection() as conn:
+                cur = conn.cursor()
+                try:
+                    cur.execute(select_sql(self.mdb_table, select_list(mdb_columns), ["1 = 0"]))
+                    return list(cur.description)
+                finally:
+                    cur.close()
+        finally:
+            pool.close()
+
+    def create_layer(self):
+        fields = fields_from_description(self.reference)[0]
+        self.xy_indexes = coordinate_indexes(self.column_names, self.x_column, self.y_column, self.mdb_table)
+        uri = "Point?crs={}&index=yes".format(self.crs) if self.xy_indexes else "None"
+        self.lyr = QgsVectorLayer(uri, 'mdb_' + self.mdb_table, 'memory')
+        provider = self.lyr.dataProvider()
+        provider.addAttributes(fields + [QgsField(SOURCE_COLUMN, QVariant.String)])
+        self.lyr.updateFields()
+        self.lyr.setReadOnly()
+        if self.add_to_map:
+            QgsMapLayerRegistry.instance().addMapLayer(self.lyr)
+            QgsMapLayerRegistry.instance().layerWillBeRemoved.connect(self.layer_removed)
+
+    def start_next(self):
+        """ Start reading pending databases until max_parallel are running """
+        while self.pending and len(self.running) < self.max_parallel and self.loading:
+            source = self.pending.pop(0)
+            try:
+                source.pool = ConnectionPool(source.path, backend=resolve_backend(self.backend))
+            except Exception as e:
+                source.error = "{}".format(e)
+                continue
+            source.worker = MdbLoadWorker(source.pool, self.sql, self.batch_size,
+                                          check=lambda cur, source=source: self.check_schema(cur, source))
+            source.worker.rows_fetched.connect(lambda batch, source=source: self.add_batch(source, batch))
+            source.worker.error.connect(lambda message, source=source: setattr(source, 'error', message))
+            source.worker.finished.connect(lambda count, cancelled, source=source: self.source_finished(source))
+            self.running.append(source)
+            source.thread = start_worker(source.worker)
+        self.check_finished()
+
+    def check_schema(self, cur, source):
+        """ Compare the table in a database with the reference, on the worker thread of that database """
+        cur.execute(select_sql(self.mdb_table, conditions=["1 = 0"]))
+        description = list(cur.description)
+        problems = schema_differences(self.reference, description)
+        if problems:
+            raise ValueError("the table doesn't match the first database: " + ", ".join(problems))
+        by_name = dict((column[0].lower(), column) for column in description)
+        source.convert = row_converter([by_name[name.lower()] for name in self.column_names])
+
+    def add_batch(self, source, batch):
+        """ Add a batch of rows of one database to the layer
+
+        :param batch: The rows, as staged by the worker.
+        :type batch: ColumnBatch
+        """
+        try:
+            if not self.loading or self.cancelled:
+                return
+            rows = source.convert(batch.rows())
+            self.lyr.dataProvider().addFeatures(features_from_rows(rows, self.xy_indexes, [source.path]))
+            source.count += len(rows)
+            self.loaded_count += len(rows)
+            self.update_progressbar()
+            self.lyr.triggerRepaint()
+        finally:
+            if source.worker is not None:
+                source.worker.batch_done()
+
+    def source_finished(self, source):
+        source.pool.close()
+        source.pool = None
+        source.worker = None
+        source.thread = None
+        if source in self.running:
+            self.running.remove(source)
+        self.update_progressbar()
+        self.start_next()
+
+    def check_finished(self):
+        if self.running or (self.pending and self.loading) or not self.loading:
+            return
+        self.loading = False
+        failed = [source for source in self.sources if source.error]
+        for source in self.sources:
+            logger("{} from {}: {}".format(self.mdb_table, source.path, "failed, {}".format(source.error)
+                                           if source.error else "{} records".format(source.count)))
+        message = "{} records from {} of {} databases added to mdb_{}".format(
+            self.loaded_count, len(self.sources) - len(failed), len(self.sources), self.mdb_table)
+        if self.cancelled:
+            message = "Loading cancelled, " + message
+        if failed:
+            self.error = "{} databases were skipped: {}".format(
+                len(failed), ", ".join(source.path for source in failed))
+            message += ". " + self.error + " (see the log for details)"
+        self.finish_progressbar(message, QgsMessageBar.WARNING if failed else QgsMessageBar.INFO)
+        self.notify_loaded()
+
+    def cancel_loading(self):
+        """ Skip the databases that didn't start yet and stop the running ones """
+        self.cancelled = True
+        self.pending = []
+        for source in self.running:
+            if source.worker is not None:
+                source.worker.kill()
+        self.check_finished()
+
+    def layer_removed(self, layer_id):
+        if layer_id != self.lyr.id():
+            return
+        QgsMapLayerRegistry.instance().layerWillBeRemoved.disconnect(self.layer_removed)
+        self.show_progress = False
+        self.cancel_loading()
+
+    def fail(self, message):
+        """ Report a problem that stops the layer from loading """
+        self.error = message
+        logger("{}: {}".format(self.mdb_table, message))
+        if self.show_progress:
+            iface.messageBar().pushWarning("MDB Layer", message)
+
+    def notify_loaded(self):
+        if self.event_loop is not None:
+            self.event_loop.quit()
+        if self.on_loaded is not None:
+            self.on_loaded(self)
+
+    def setup_progressbar(self):
+        self.progress_bar_item = iface.messageBar().createMessage(
+            "Loading {} from {} databases...".format(self.mdb_table, len(self.sources)))
+        self.progress = QProgressBar()
+        self.progress.setMaximum(len(self.sources))
+        self.progress.setAlignment(Qt.AlignLeft | Qt.AlignVCenter)
+        self.progress_bar_item.layout().addWidget(self.progress)
+        cancel_button = QPushButton("Cancel")
+        cancel_button.clicked.connect(self.cancel_loading)
+        self.progress_bar_item.layout().addWidget(cancel_button)
+        iface.messageBar().pushWidget(self.progress_bar_item, QgsMessageBar.INFO)
+
+    def update_progressbar(self):
+        if self.progress is None:
+            return
+        done = len(self.sources) - len(self.pending) - len(self.running)
+        self.progress.setValue(done)
+        self.progress_bar_item.setText("Loading {} from {} databases: {} done, {} records...".format(
+            self.mdb_table, len(self.sources), done, self.loaded_count))
+
+    def finish_progressbar(self, message, level):
+        if self.progress is not None:
+            iface.messageBar().popWidget(self.progress_bar_item)
+            self.progress = None
+        if self.show_progress:
+            iface.messageBar().pushMessage("MDB Layer", message, level=level)
+        else:
+            logger(message)
@@ -0,0 +1,167 @@
+from mdb_types import to_db
+
+
+class MdbIndex:
+    """ Hash index of the features of a layer on one or more columns: key values to feature ids
+
+    Keys are tuples of database values (see mdb_types.to_db), so a key can be looked up with the values
+    as they come from the database or from pyodbc. A unique index (the primary key) holds one feature id per key;
+    features with a NULL in their key, like records added without reading back their autonumber, are kept apart
+    in keyless as they can't be told apart by key.
+    """
+
+    def __init__(self, columns, positions, unique=False):
+        """
+        :param columns: Names of the indexed columns.
+        :type columns: list
+
+        :param positions: Index of every column in the attributes of a feature.
+        :type positions: list
+
+        :param unique: Every key belongs to one feature.
+        :type unique: bool
+        """
+        self.columns = tuple(columns)
+        self.positions = tuple(positions)
+        self.unique = unique
+        self.fids = {}      # key: feature id, or a set of feature ids if not unique
+        self.keys = {}      # feature id: key
+        self.keyless = set()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def key(self, attributes):
+        """ Return the key of a list of attribute values """
+        return tuple(to_db(attributes[i]) for i in self.positions)
+
+    def add(self, fid, key):
+        if fid in self.keys or fid in self.keyless:
+            self.remove(fid)
+        if self.unique and None in key:
+            self.keyless.add(fid)
+            return
+        self.keys[fid] = key
+        if self.unique:
+            self.fids[key] = fid
+        else:
+            self.fids.setdefault(key, set()).add(fid)
+
+    def remove(self, fid):
+        self.keyless.discard(fid)
+        key = self.keys.pop(fid, None)
+        if key is None:
+            return
+        if self.unique:
+            if self.fids.get(key) == fid:
+                del self.fids[key]
+        else:
+            fids = self.fids.get(key, set())
+            fids.discard(fid)
+            if not fids:
+                self.fids.pop(key, None)
+
+    def change(self, fid, values):
+        """ Update the key of a feature after some of its attributes changed
+
+        :param values: {attribute index: new value}, other attributes are ignored.
+        :type values: dict
+        """
+        if fid not in self.keys and fid not in self.keyless or not set(values) & set(self.positions):
+            return
+        key = self.keys.get(fid, (None,) * len(self.positions))
+        key = tuple(to_db(values[i]) if i in values else value for i, value in zip(self.positions, key))
+        self.add(fid, key)
+
+    def get(self, key):
+        """ Return the feature ids with this key, an empty list if there are none """
+        fids = self.fids.get(tuple(key))
+        if fids is None:
+            return []
+        return [fids] if self.unique else list(fids)
+
+    def clear(self):
+        self.fids = {}
+        self.keys = {}
+        self.keyless = set()
+
+
+class MdbIndexes:
+    """ The indexes of one layer: one on the primary key and one per indexed column
+
+    The indexes follow the features of the memory layer itself (its data provider), not the uncommitted
+    edits of an edit session; edits are taken in when they are committed.
+    """
+
+    def __init__(self, field_names, pk_cols, columns=()):
+        """
+        :param field_names: Names of the attributes of the features, in order.
+        :type field_names: list
+
+        :param pk_cols: Primary key columns, without them there is no primary key index.
+        :type pk_cols: list
+
+        :param columns: Columns to index besides the primary key; names that aren't fields are left out.
+        :type columns: list
+        """
+        self.pk = None
+        self.by_column = {}
+        if pk_cols and set(pk_cols) <= set(field_names):
+            self.pk = MdbIndex(pk_cols, [field_names.index(pk) for pk in pk_cols], unique=True)
+        for column in columns:
+            if column in field_names and (column,) != tuple(pk_cols):
+                self.by_column[column] = MdbIndex([column], [field_names.index(column)])
+        self.all = ([self.pk] if self.pk is not None else []) + self.by_column.values()
+
+    def __nonzero__(self):
+        return bool(self.all)
+
+    def added(self, fids, rows):
+        """ Index added features
+
+        :param fids: Feature ids of the added features.
+        :type fids: list
+
+        :param rows: Attribute values of every feature, in the same order.
+        :type rows: list
+        """
+        for index in self.all:
+            key, add = index.key, index.add
+            for fid, row in zip(fids, rows):
+                add(fid, key(row))
+
+    def removed(self, fids):
+        for index in self.all:
+            for fid in fids:
+                index.remove(fid)
+
+    def changed(self, changes):
+        """ Update the keys of features with changed attribute values
+
+        :param changes: {feature id: {attribute index: new value}}.
+        :type changes: dict
+        """
+        for index in self.all:
+            for fid, values in changes.items():
+                index.change(fid, values)
+
+    def clear(self):
+        for index in self.all:
+            index.clear()
+
+    def fid(self, pk_values):
+        """ Return the feature id of the feature with these primary key values, None if it's not there """
+        fids = self.pk.get(pk_values) if self.pk is not None else []
+        return fids[0] if fids else None
+
+    def pk_values(self, fid):
+        """ Return the primary key values of a feature, None if it's not there """
+        return self.pk.keys.get(fid) if self.pk is not None else None
+
+    def lookup(self, column, value):
+        """ Return the feature ids with this value in a column; None if the column isn't indexed """
+        if column in self.by_column:
+            return self.by_column[column].get((value,))
+        if self.pk is not None and self.pk.columns == (column,):
+            return self.pk.get((value,))
+        return None
@@ -0,0 +1,672 @@
+"""
+Read Access databases (.mdb and .accdb) straight from the file, without ODBC.
+
+The Jet/ACE file is memory mapped and its pages are parsed in python: the catalog (MSysObjects), table
+definitions, data pages and long value (memo and OLE) pages. A connection and cursor with the part of the
+pyodbc interface the plugin uses sit on top, so connections from here can go in a ConnectionPool:
+tables(), statistics(), description, fetchone/fetchmany/fetchall and execute() of
+
+    SELECT [TOP n] * | COUNT(*) | <columns> FROM <table> [WHERE 1 = 0]
+
+Anything else, writing and Access queries (views) need ODBC. Encrypted databases are not supported.
+"""
+import os, re, mmap, struct, datetime, decimal, uuid
+from itertools import islice
+
+
+class JetError(Exception):
+    pass
+
+
+# column types
+BOOL, BYTE, INT, LONG, MONEY, FLOAT, DOUBLE, DATETIME, BINARY, TEXT, OLE, MEMO = range(1, 13)
+GUID, NUMERIC, COMPLEX = 0x0F, 0x10, 0x12
+
+# page types
+DATA_PAGE, TABLE_PAGE, USAGE_MAP_PAGE = 0x01, 0x02, 0x05
+
+DELETED_ROW = 0x8000            # flags in the row offsets of a data page
+OVERFLOW_ROW = 0x4000           # the row holds a pointer to the row somewhere else
+OFFSET_MASK = 0x1FFF
+
+CATALOG_PAGE = 2                # table definition of MSysObjects
+OBJECT_TABLE = 1                # Type of a local table in MSysObjects
+SYSTEM_OBJECT = 0x80000002      # Flags of system and hidden tables
+
+MEMO_MAX_LENGTH = 1073741823    # size ODBC reports for memo columns
+
+_HEADER_KEY = bytearray([0xC7, 0xDA, 0x39, 0x6B])
+_EPOCH = datetime.datetime(1899, 12, 30)
+
+_int16 = struct.Struct('<H')
+_int32 = struct.Struct('<I')
+
+
+class _Format:
+    """ Offsets that differ between Jet 3 (Access 97) and Jet 4 and later (Access 2000 up, .accdb) """
+
+    def __init__(self, jet3):
+        self.jet3 = jet3
+        self.page_size = 2048 if jet3 else 4096
+        self.row_count = 8 if jet3 else 12
+        self.tdef_rows = 12 if jet3 else 16
+        self.tdef_var_cols = 23 if jet3 else 43
+        self.tdef_cols = 25 if jet3 else 45
+        self.tdef_indexes = 27 if jet3 else 47
+        self.tdef_real_indexes = 31 if jet3 else 51
+        self.tdef_usage_map = 35 if jet3 else 55
+        self.tdef_start = 43 if jet3 else 63
+        self.real_index_size = 8 if jet3 else 12
+        self.real_index_def_size = 39 if jet3 else 52
+        self.index_size = 20 if jet3 else 28
+        self.column_size = 18 if jet3 else 25
+        self.col_num = 1 if jet3 else 5
+        self.col_var_num = 3 if jet3 else 7
+        self.col_prec = 7 if jet3 else 11
+        self.col_scale = 8 if jet3 else 12
+        self.col_flags = 13 if jet3 else 15
+        self.col_fixed_offset = 14 if jet3 else 21
+        self.col_length = 16 if jet3 else 23
+        self.name_length_size = 1 if jet3 else 2
+
+
+JET3 = _Format(True)
+JET4 = _Format(False)
+
+
+def connect(mdb_path, encoding='cp1252'):
+    """ Return a read-only JetConnection to a database
+
+    :param encoding: Encoding of the text in Jet 3 (Access 97) databases when the file doesn't tell;
+        later versions store text as unicode.
+    :type encoding: str
+    """
+    return JetConnection(JetDatabase(mdb_path, encoding))
+
+
+def _rc4(key, data):
+    state = list(range(256))
+    j = 0
+    for i in range(256):
+        j = (j + state[i] + key[i % len(key)]) & 0xFF
+        state[i], state[j] = state[j], state[i]
+    out = bytearray(len(data))
+    i = j = 0
+    for n, byte in enumerate(data):
+        i = (i + 1) & 0xFF
+        j = (j + state[i]) & 0xFF
+        state[i], state[j] = state[j], state[i]
+        out[n] = byte ^ state[(state[i] + state[j]) & 0xFF]
+    return out
+
+
+class JetDatabase:
+    """ A memory mapped Access database file and its pages """
+
+    def __init__(self, mdb_path, encoding='cp1252'):
+        self.mdb_path = mdb_path
+        self.encoding = encoding
+        self.file = None
+        self.map = None
+        self.open()
+
+    def open(self):
+        self.file = open(self.mdb_path, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError) as e:
+            self.file.close()
+            raise JetError("Couldn't open {}: {}".format(self.mdb_path, e))
+        self.state = self.file_state()
+        header = bytearray(self.map[:0x18 + 128])
+        if len(header) < 0x18 + 128 or header[0:4] != bytearray(b'\x00\x01\x00\x00'):
+            self.close()
+            raise JetError("{} is not an Access database".format(self.mdb_path))
+        self.format = JET3 if header[0x14] == 0 else JET4
+        size = 126 if self.format.jet3 else 128
+        header[0x18:0x18 + size] = _rc4(_HEADER_KEY, header[0x18:0x18 + size])
+        if _int32.unpack_from(header, 0x3E)[0]:
+            self.close()
+            raise JetError("{} is encrypted, open it with ODBC".format(self.mdb_path))
+        code_page = _int16.unpack_from(header, 0x3C)[0]
+        if self.format.jet3 and code_page:
+            self.encoding = 'cp{}'.format(code_page)
+        self.page_count = len(self.map) // self.format.page_size
+        self.tables = {}
+        self.catalog = None
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def file_state(self):
+        stat = os.stat(self.mdb_path)
+        return stat.st_mtime, stat.st_size
+
+    def reopen_if_changed(self):
+        """ Map the file again if it changed since it was opened, dropping what was read from it """
+        if self.file_state() != self.state:
+            self.close()
+            self.open()
+
+    def page(self, number):
+        start = self.page_start(number)
+        return bytearray(self.map[start:start + self.format.page_size])
+
+    def page_start(self, number):
+        if not 0 < number < self.page_count:
+            raise JetError("Page {} is outside of {}".format(number, self.mdb_path))
+        return number * self.format.page_size
+
+    def row_bounds(self, page, row, page_start=0):
+        """ Return start (with the flags) and end of a row on a data page, in a page or in the file """
+        offset = page_start + self.format.row_count
+        if row >= _int16.unpack_from(page, offset)[0]:
+            raise JetError("Row {} isn't on the page".format(row))
+        start = _int16.unpack_from(page, offset + 2 + 2 * row)[0]
+        end = self.format.page_size if row == 0 else _int16.unpack_from(page, offset + 2 * row)[0] & OFFSET_MASK
+        return start, end
+
+    def row_data(self, pointer):
+        """ Return the bytes of the row a pointer (row number in the low byte, page in the others) refers to """
+        # only the row is copied out of the file, long values would otherwise copy a page for every value
+        page_start = self.page_start(pointer >> 8)
+        start, end = self.row_bounds(self.map, pointer & 0xFF, page_start)
+        return bytearray(self.map[page_start + (start & OFFSET_MASK):page_start + end])
+
+    def long_value(self, data):
+        """ Return the bytes of a memo or OLE value, from the 12 byte reference in a row and the data after it """
+        length = _int32.unpack_from(data, 0)[0]
+        flags, length = length & 0xC0000000, length & 0x3FFFFFFF
+        if flags & 0x80000000:          # in the row itself
+            return data[12:12 + length]
+        pointer = _int32.unpack_from(data, 4)[0]
+        if flags & 0x40000000:          # on one other page
+            return self.row_data(pointer)[:length]
+        value = bytearray()             # in a chain of rows, each starting with the pointer to the next
+        while pointer and len(value) < length:
+            chunk = self.row_data(pointer)
+            pointer = _int32.unpack_from(chunk, 0)[0]
+            value += chunk[4:]
+        return value[:length]
+
+    def text(self, data):
+        """ Decode text: in Jet 4 UCS-2, or 'compressed' to one byte per character between zero bytes """
+        if self.format.jet3:
+            return bytes(data).decode(self.encoding, 'replace')
+        if data[:2] != bytearray(b'\xff\xfe'):
+            return bytes(data[:len(data) & ~1]).decode('utf-16-le', 'replace')
+        if data.find(b'\x00', 2) < 0:       # compressed all the way
+            return bytes(data[2:]).decode('latin-1')
+        parts, compressed, i, n = [], True, 2, len(data)
+        while i < n:
+            if data[i] == 0:
+                compressed = not compressed
+                i += 1
+            elif compressed:
+                end = data.find(b'\x00', i)
+                end = n if end < 0 else end
+                parts.append(bytes(data[i:end]).decode('latin-1'))
+                i = end
+            else:
+                end = i
+                while end + 1 < n and data[end] != 0:
+                    end += 2
+                if end == i:
+                    break
+                parts.append(bytes(data[i:end]).decode('utf-16-le', 'replace'))
+                i = end
+        return u''.join(parts)
+
+    def table_names(self):
+        """ Return {table name: page of its definition} of the user tables, read from MSysObjects """
+        if self.catalog is None:
+            objects = JetTable(self, CATALOG_PAGE, 'MSysObjects')
+            names = [column.name for column in objects.columns]
+            columns = [names.index(name) for name in ('Id', 'Name', 'Type', 'Flags')]
+            self.catalog = {}
+            for row in objects.rows(columns):
+                object_id, name, object_type, flags = row
+                if object_type == OBJECT_TABLE and not (flags or 0) & SYSTEM_OBJECT and name:
+                    self.catalog[name] = object_id & 0x00FFFFFF
+        return self.catalog
+
+    def table(self, name):
+        if name not in self.tables:
+            catalog = self.table_names()
+            match = next((table for table in catalog if table.lower() == name.lower()), None)
+            if match is None:
+                raise JetError("Table {} not found, the file reader can't run queries".format(name))
+            self.tables[name] = JetTable(self, catalog[match], match)
+        return self.tables[name]
+
+
+class JetColumn:
+
+    def __init__(self, name, column_type, number, var_number, fixed, fixed_offset, length, precision, scale):
+        self.name = name
+        self.type = column_type
+        self.number = number
+        self.var_number = var_number
+        self.fixed = fixed
+        self.fixed_offset = fixed_offset
+        self.length = length
+        self.precision = precision
+        self.scale = scale
+
+    def description(self, jet3):
+        """ Return the cursor description of the column, with the python types pyodbc uses """
+        python_type, size, precision, scale = _python_types.get(self.type, (bytearray, self.length, 0, 0))
+        if self.type in (TEXT, BINARY):
+            size = self.length if jet3 or self.type == BINARY else self.length // 2
+        elif self.type == NUMERIC:
+            size, precision, scale = self.precision, self.precision, self.scale
+        return self.name, python_type, None, size, precision, scale, True
+
+
+# column type: (python type, size, precision, scale) like the Access ODBC driver reports them
+_python_types = {
+    BOOL: (bool, 1, 1, 0), BYTE: (int, 3, 3, 0), INT: (int, 5, 5, 0), LONG: (int, 10, 10, 0),
+    MONEY: (decimal.Decimal, 19, 19, 4), FLOAT: (float, 24, 24, 0), DOUBLE: (float, 53, 53, 0),
+    DATETIME: (datetime.datetime, 19, 19, 0), BINARY: (bytearray, 255, 255, 0), TEXT: (type(u''), 255, 255, 0),
+    OLE: (bytearray, MEMO_MAX_LENGTH, MEMO_MAX_LENGTH, 0), MEMO: (type(u''), MEMO_MAX_LENGTH, MEMO_MAX_LENGTH, 0),
+    GUID: (type(u''), 38, 38, 0), NUMERIC: (decimal.Decimal, 18, 18, 0), COMPLEX: (int, 10, 10, 0)}
+
+
+def _datetime(days):
+    whole = int(days)
+    return _EPOCH + datetime.timedelta(days=whole, seconds=int(round(abs(days - whole) * 86400)))
+
+
+def _numeric(data, scale):
+    groups = struct.unpack_from('<IIII', data, 1)
+    value = groups[3] | groups[2] << 32 | groups[1] << 64 | groups[0] << 96
+    value = decimal.Decimal(-value if data[0] & 0x80 else value)
+    return value.scaleb(-scale) if scale else value
+
+
+def _money(value):
+    return decimal.Decimal(value).scaleb(-4)
+
+
+# fixed length column types struct reads: (format, conversion of what it reads)
+_fixed_formats = {BYTE: ('B', None), INT: ('h', None), LONG: ('i', None), MONEY: ('q', _money),
+                  FLOAT: ('f', None), DOUBLE: ('d', None), DATETIME: ('d', _datetime), COMPLEX: ('i', None)}
+
+
+def _fixed_decoder(column):
+    """ Return a function decoding the value of a fixed length column from a page at an offset """
+    if column.type in _fixed_formats:
+        code, convert = _fixed_formats[column.type]
+        unpack = struct.Struct('<' + code).unpack_from
+        if convert is not None:
+            return lambda page, offset: convert(unpack(page, offset)[0])
+        return lambda page, offset: unpack(page, offset)[0]
+    if column.type == GUID:
+        return lambda page, offset: u'{' + str(uuid.UUID(bytes_le=bytes(page[offset:offset + 16]))).upper() + u'}'
+    if column.type == NUMERIC:
+        return lambda page, offset: _numeric(page[offset:offset + 17], column.scale)
+    return lambda page, offset: bytearray(page[offset:offset + column.length])
+
+
+def _var_decoder(column, database):
+    """ Return a function decoding the value of a variable length column from its bytes """
+    if column.type == TEXT:
+        return database.text
+    if column.type == MEMO:
+        return lambda data: database.text(database.long_value(data))
+    if column.type == OLE:
+        return lambda data: bytearray(database.long_value(data))
+    if column.type == NUMERIC:
+        return lambda data: _numeric(data, column.scale)
+    return bytearray
+
+
+class JetTable:
+    """ A table definition and its rows """
+
+    def __init__(self, database, page_number, name):
+        self.database = database
+        self.page_number = page_number
+        self.name = name
+        fmt = database.format
+
+        # a definition can continue on other pages, their contents follow the page header
+        page = database.page(page_number)
+        if page[0] != TABLE_PAGE:
+            raise JetError("Page {} of {} doesn't define a table".format(page_number, name))
+        tdef = page
+        next_page = _int32.unpack_from(page, 4)[0]
+        while next_page:
+            page = database.page(next_page)
+            tdef += page[8:]
+            next_page = _int32.unpack_from(page, 4)[0]
+
+        self.row_count = _int32.unpack_from(tdef, fmt.tdef_rows)[0]
+        self.var_column_count = _int16.unpack_from(tdef, fmt.tdef_var_cols)[0]
+        column_count = _int16.unpack_from(tdef, fmt.tdef_cols)[0]
+        index_count = _int32.unpack_from(tdef, fmt.tdef_indexes)[0]
+        real_index_count = _int32.unpack_from(tdef, fmt.tdef_real_indexes)[0]
+        self.usage_map = _int32.unpack_from(tdef, fmt.tdef_usage_map)[0]
+
+        offset = fmt.tdef_start + real_index_count * fmt.real_index_size
+        definitions = []
+        for i in range(column_count):
+            c = offset + i * fmt.column_size
+            definitions.append((tdef[c], _int16.unpack_from(tdef, c + fmt.col_num)[0],
+                                _int16.unpack_from(tdef, c + fmt.col_var_num)[0], bool(tdef[c + fmt.col_flags] & 0x01),
+                                _int16.unpack_from(tdef, c + fmt.col_fixed_offset)[0],
+                                _int16.unpack_from(tdef, c + fmt.col_length)[0],
+                                tdef[c + fmt.col_prec], tdef[c + fmt.col_scale]))
+        offset += column_count * fmt.column_size
+
+        names = []
+        for _ in range(column_count):
+            offset, name = self.read_name(tdef, offset)
+            names.append(name)
+        self.columns = sorted((JetColumn(name, *definition) for name, definition in zip(names, definitions)),
+                              key=lambda column: column.number)
+
+        # real indexes hold the key columns, logical indexes their names and types (1 is the primary key)
+        real_indexes = []
+        for _ in range(real_index_count):
+            if not fmt.jet3:
+                offset += 4
+            numbers = [_int16.unpack_from(tdef, offset + 3 * i)[0] for i in range(10)]
+            flags = tdef[offset + 38]
+            real_indexes.append(([number for number in numbers if number != 0xFFFF], flags))
+            offset += fmt.real_index_def_size - (0 if fmt.jet3 else 4)
+        logical = []
+        for _ in range(index_count):
+            entry = offset if fmt.jet3 else offset + 4
+            logical.append((_int32.unpack_from(tdef, entry + 4)[0], tdef[entry + 19]))
+            offset += fmt.index_size
+        by_number = dict((column.number, column.name) for column in self.columns)
+        self.indexes = []           # (name, type, column names, unique)
+        for real_index, index_type in logical:
+            offset, name = self.read_name(tdef, offset)
+            if real_index < len(real_indexes):
+                numbers, flags = real_indexes[real_index]
+                self.indexes.append((name, index_type, [by_number[number] for number in numbers if number in by_number],
+                                     bool(flags & 0x01) or index_type == 1))
+
+    def read_name(self, tdef, offset):
+        fmt = self.database.format
+        length = tdef[offset] if fmt.jet3 else _int16.unpack_from(tdef, offset)[0]
+        offset += fmt.name_length_size
+        return offset + length, self.database.text(tdef[offset:offset + length])
+
+    def description(self, columns):
+        return [self.columns[i].description(self.database.format.jet3) for i in columns]
+
+    def data_pages(self):
+        """ Return the numbers of the pages with rows of this table, from its usage map """
+        database = self.database
+        data = database.row_data(self.usage_map)
+        pages = []
+        if data[0] == 0:            # a bitmap of the pages from a start page on
+            start = _int32.unpack_from(data, 1)[0]
+            pages = [start + i * 8 + bit for i, byte in enumerate(data[5:]) if byte
+                     for bit in range(8) if byte & (1 << bit)]
+        elif data[0] == 1:          # pages with bitmaps, each covering a range of pages
+            per_page = (database.format.page_size - 4) * 8
+            for i in range((len(data) - 1) // 4):
+                map_page = _int32.unpack_from(data, 1 + 4 * i)[0]
+                if not map_page:
+                    continue
+                bitmap = database.page(map_page)[4:]
+                pages.extend(i * per_page + j * 8 + bit for j, byte in enumerate(bitmap) if byte
+                             for bit in range(8) if byte & (1 << bit))
+        else:
+            raise JetError("Unknown usage map type {} of table {}".format(data[0], self.name))
+        return [number for number in pages if 0 < number < database.page_count]
+
+    def rows(self, columns=None):
+        """ Yield the rows of the table as tuples of the values of columns (indexes in self.columns) """
+        database = self.database
+        fmt = database.format
+        jet3 = fmt.jet3
+        count_size = 1 if jet3 else 2
+        columns = list(range(len(self.columns))) if columns is None else columns
+        has_var = self.var_column_count > 0
+
+        # how to get every column, decided once: (position in the row, kind, null mask byte and bit, decoder)
+        specs = []
+        fixed_seen = 0
+        for i, column in enumerate(self.columns):
+            if column.type == BOOL:
+                kind, place, decoder = 'bool', fixed_seen, None
+            elif column.fixed:
+                kind, place, decoder = 'fixed', fixed_seen, _fixed_decoder(column)
+            else:
+                kind, place, decoder = 'var', column.var_number, _var_decoder(column, database)
+            if column.fixed:
+                fixed_seen += 1
+            specs.append([kind, place, column.fixed_offset + count_size, column.number // 8,
+                          1 << column.number % 8, decoder, None, None])
+        wanted = [list(specs[i]) for i in columns]
+
+        # the fixed length values struct can read are unpacked together, with one call per row: their spec
+        # gets the position in what is unpacked and the conversion of the value
+        packed_format, packed_end, packed_places = '<', 0, []
+        for spec, i in sorted(zip(wanted, columns), key=lambda pair: pair[0][2]):
+            column = self.columns[i]
+            if spec[0] == 'fixed' and column.type in _fixed_formats and spec[2] >= packed_end:
+                code, convert = _fixed_formats[column.type]
+                packed_format += '{}x{}'.format(spec[2] - packed_end, code)
+                packed_end = spec[2] + struct.calcsize('<' + code)
+                spec[6:8] = len(packed_places), convert
+                packed_places.append(spec[1])
+        unpack_fixed = struct.Struct(packed_format).unpack_from if packed_places else None
+        packed_fixed_cols = max(packed_places) + 1 if packed_places else 0
+        wanted = [tuple(spec) for spec in wanted]
+        var_offset_structs = {}
+
+        row_count = fmt.row_count
+        page_size = fmt.page_size
+        for page_number in self.data_pages():
+            page = database.page(page_number)
+            if page[0] != DATA_PAGE or _int32.unpack_from(page, 4)[0] != self.page_number:
+                continue
+            count = _int16.unpack_from(page, row_count)[0]
+            offsets = struct.unpack_from('<{}H'.format(count), page, row_count + 2)
+            for row in range(count):
+                start = offsets[row]
+                end = page_size if row == 0 else offsets[row - 1] & OFFSET_MASK
+                if start & DELETED_ROW:
+                    continue
+                row_page = page
+                if start & OVERFLOW_ROW:
+                    row_page = database.row_data(_int32.unpack_from(page, start & OFFSET_MASK)[0])
+                    start, end = 0, len(row_page)
+                start &= OFFSET_MASK
+
+                # the row ends with the null mask, before it the offsets of the variable length values
+                row_cols = row_page[start] if jet3 else _int16.unpack_from(row_page, start)[0]
+                mask_size = (row_cols + 7) // 8
+                mask = end - mask_size
+                var_offsets, row_var_cols = (), 0
+                if has_var:
+                    if jet3:
+                        row_var_cols = row_page[end - 1 - mask_size]
+                        var_offsets = self.jet3_offsets(row_page, start, end, mask_size, row_var_cols)
+                    else:
+                        # the offsets are stored last to first
+                        row_var_cols = _int16.unpack_from(row_page, end - mask_size - 2)[0]
+                        if row_var_cols not in var_offset_structs:
+                            var_offset_structs[row_var_cols] = struct.Struct('<{}H'.format(row_var_cols + 1))
+                        var_offsets = var_offset_structs[row_var_cols].unpack_from(
+                            row_page, end - mask_size - 2 - 2 * (row_var_cols + 1))[::-1]
+                row_fixed_cols = row_cols - row_var_cols
+                fixed = unpack_fixed(row_page, start) if row_fixed_cols >= packed_fixed_cols > 0 else None
+
+                values = []
+                for kind, place, fixed_offset, mask_byte, mask_bit, decoder, slot, convert in wanted:
+                    present = mask_byte < mask_size and row_page[mask + mask_byte] & mask_bit
+                    if kind == 'bool':
+                        values.append(bool(present))
+                    elif not present:
+                        values.append(None)
+                    elif kind == 'fixed':
+                        if place >= row_fixed_cols:
+                            values.append(None)
+                        elif fixed is not None and slot is not None:
+                            values.append(fixed[slot] if convert is None else convert(fixed[slot]))
+                        else:
+                            values.append(decoder(row_page, start + fixed_offset))
+                    elif place < row_var_cols:
+                        values.append(decoder(row_page[start + var_offsets[place]:start + var_offsets[place + 1]]))
+                    else:
+                        values.append(None)
+                yield tuple(values)
+
+    @staticmethod
+    def jet3_offsets(page, start, end, mask_size, row_var_cols):
+        """ Jet 3 keeps one byte per offset, with a table of the columns where the offsets pass 256 bytes """
+        row_end = end - 1
+        jumps = (end - start - 1) // 256
+        pointer = row_end - mask_size - jumps - 1
+        if (pointer - start - row_var_cols) // 256 < jumps:
+            jumps -= 1
+        offsets, used = [], 0
+        for i in range(row_var_cols + 1):
+            while used < jumps and i == page[row_end - mask_size - used - 1]:
+                used += 1
+            offsets.append(page[pointer - i] + used * 256)
+        return offsets
+
+
+class Row(tuple):
+    """ A result row of a catalog function, with its values also available by column name """
+
+    def __new__(cls, names, values):
+        row = tuple.__new__(cls, values)
+        row.names = names
+        return row
+
+    def __getattr__(self, name):
+        try:
+            return self[self.names.index(name)]
+        except ValueError:
+            raise AttributeError(name)
+
+
+_TABLE_NAMES = ('table_cat', 'table_schem', 'table_name', 'table_type', 'remarks')
+_STATISTICS_NAMES = ('table_cat', 'table_schem', 'table_name', 'non_unique', 'index_qualifier', 'index_name', 'type',
+                     'ordinal_position', 'column_name', 'asc_or_desc', 'cardinality', 'pages', 'filter_condition')
+
+_quoted_name = r'\[(?:[^\]]|\]\])*\]|[^\s,\[\]]+'
+_select = re.compile(r'^\s*SELECT\s+(?:TOP\s+(?P<top>\d+)\s+)?(?P<columns>.+?)\s+FROM\s+(?P<table>' + _quoted_name +
+                     r')\s*(?P<nothing>WHERE\s+1\s*=\s*0\s*)?$', re.IGNORECASE | re.DOTALL)
+
+
+def _unquote(name):
+    name = name.strip()
+    return name[1:-1].replace(']]', ']') if name.startswith('[') else name
+
+
+class JetConnection:
+    """ A read-only connection with the pyodbc interface, see the module docstring for what it runs """
+
+    def __init__(self, database):
+        self.database = database
+
+    def cursor(self):
+        self.database.reopen_if_changed()
+        return JetCursor(self.database)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.database.close()
+
+
+class JetCursor:
+
+    def __init__(self, database):
+        self.database = database
+        self.description = None
+        self.rowcount = -1
+        self.rows = iter(())
+
+    def execute(self, sql, *params):
+        match = _select.match(sql)
+        if match is None:
+            raise JetError("The file reader only runs SELECT <columns> FROM <table>, open the database with ODBC "
+                           "for: {}".format(sql))
+        table = self.database.table(_unquote(match.group('table')))
+        names = [column.name for column in table.columns]
+        selected = match.group('columns').strip()
+        if selected.upper().replace(' ', '') == 'COUNT(*)':
+            self.description = [('COUNT(*)', int, None, 10, 10, 0, False)]
+            self.rows = iter([(table.row_count,)])
+            return self
+        if selected == '*':
+            columns = list(range(len(names)))
+        else:
+            lower = [name.lower() for name in names]
+            columns = []
+            for name in re.findall(_quoted_name, selected):
+                if _unquote(name).lower() not in lower:
+                    raise JetError("Column {} is not in table {}".format(_unquote(name), table.name))
+                columns.append(lower.index(_unquote(name).lower()))
+        self.description = table.description(columns)
+        if match.group('nothing'):
+            self.rows = iter(())
+        else:
+            self.rows = table.rows(columns)
+            if match.group('top'):
+                self.rows = islice(self.rows, int(match.group('top')))
+        return self
+
+    def executemany(self, sql, params):
+        raise JetError("The file reader can't write, open the database with ODBC to save changes")
+
+    def fetchone(self):
+        return next(self.rows, None)
+
+    def fetchmany(self, size=1):
+        return list(islice(self.rows, size))
+
+    def fetchall(self):
+        return list(self.rows)
+
+    def __iter__(self):
+        return self.rows
+
+    def tables(self, table=None, tableType=None):
+        """ The tables of the database; queries are views in Access and need ODBC, so there are none """
+        types = [name.strip() for name in tableType.split(',')] if tableType else ['TABLE']
+        names = sorted(self.database.table_names())
+        self.rows = iter([Row(_TABLE_NAMES, (self.database.mdb_path, None, name, 'TABLE', None)) for name in names
+                          if 'TABLE' in types and (table is None or name.lower() == table.lower())])
+        return self
+
+    def statistics(self, table):
+        """ The number of rows of the table and the columns of its indexes """
+        jet_table = self.database.table(table)
+        rows = [Row(_STATISTICS_NAMES, (self.database.mdb_path, None, jet_table.name, None, None, None, 0, None, None,
+                                        None, jet_table.row_count, None, None))]
+        for name, index_type, columns, unique in jet_table.indexes:
+            rows.extend(Row(_STATISTICS_NAMES, (self.database.mdb_path, None, jet_table.name, not unique, None, name,
+                                                3, position + 1, column, 'A', None, None, None))
+                        for position, column in enumerate(columns))
+        self.rows = iter(rows)
+        return self
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.rows = iter(())
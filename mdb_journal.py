@@ -0,0 +1,399 @@
+import os, json, time, base64, decimal, sqlite3, datetime, threading
+from contextlib import closing
+from PyQt4.QtCore import QObject, pyqtSignal
+from qgis.core import QgsApplication, QgsMessageLog
+from mdb_connection import get_pool
+from mdb_writeback import ChangeSet, MdbWriter
+from mdb_worker import start_worker
+from mdb_types import parse_datetime, parse_date, parse_time
+
+
+logger = lambda msg: QgsMessageLog.logMessage(msg, 'Mdb Journal', 1)
+
+RETRY_DELAYS = [5, 30, 120, 600]            # seconds to wait before trying a commit again
+MAX_ATTEMPTS = len(RETRY_DELAYS) + 1        # a commit that failed this often is marked failed
+STOP_TIMEOUT = 10                           # seconds to wait for a commit being written when QGIS closes
+
+PENDING = 'pending'
+APPLYING = 'applying'       # being written; still applying after a crash means it may be written already
+FAILED = 'failed'           # gave up retrying, waits for retry_failed()
+
+
+def journal_path():
+    """ Default location of the journal: a file in the QGIS settings directory """
+    return os.path.join(QgsApplication.qgisSettingsDirPath(), 'mdb_loader', 'journal.sqlite')
+
+
+# values that JSON can't hold are stored as {type name: text}
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return {'datetime': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'date': value.isoformat()}
+    if isinstance(value, datetime.time):
+        return {'time': value.isoformat()}
+    if isinstance(value, (bytearray, buffer)):
+        return {'bytes': base64.b64encode(bytes(value))}
+    if isinstance(value, decimal.Decimal):
+        return {'decimal': str(value)}
+    return value
+
+
+_decoders = {'datetime': parse_datetime,
+             'date': parse_date,
+             'time': parse_time,
+             'bytes': lambda value: bytearray(base64.b64decode(value)),
+             'decimal': decimal.Decimal}
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        (name, text), = value.items()
+        return _decoders[name](text)
+    return value
+
+
+def dump_changes(changes):
+    """ Return a ChangeSet as JSON text """
+    key = lambda pk_values: [_encode(value) for value in pk_values]
+    row = lambda values: dict((column, _encode(value)) for column, value in values.items())
+    return json.dumps({'updates': [[key(pk_values), row(values)] for pk_values, values in changes.updates],
+                       'deletes': [key(pk_values) for pk_values in changes.deletes],
+                       'inserts': [row(values) for values in changes.inserts],
+                       'originals': [[key(pk_values), row(values)] for pk_values, values in changes.originals.items()]})
+
+
+def load_changes(text):
+    """ Return the ChangeSet stored with dump_changes """
+    data = json.loads(text)
+    key = lambda pk_values: tuple(_decode(value) for value in pk_values)
+    row = lambda values: dict((column, _decode(value)) for column, value in values.items())
+    changes = ChangeSet()
+    changes.updates = [(key(pk_values), row(values)) for pk_values, values in data['updates']]
+    changes.deletes = [key(pk_values) for pk_values in data['deletes']]
+    changes.inserts = [row(values) for values in data['inserts']]
+    changes.originals = dict((key(pk_values), row(values)) for pk_values, values in data['originals'])
+    return changes
+
+
+class JournalEntry:
+    """ One commit in the journal: the changes of one table of one database """
+
+    def __init__(self, entry_id, mdb_path, table, pk_cols, columns, changes, state, attempts, error):
+        self.id = entry_id
+        self.mdb_path = mdb_path
+        self.table = table
+        self.pk_cols = pk_cols
+        self.columns = columns      # columns of the layer, the current values of conflicting rows are read for
+        self.changes = changes
+        self.state = state
+        self.attempts = attempts
+        self.error = error
+
+
+class MdbJournal:
+    """ Durable queue of commits that still have to be written to their database
+
+    The journal is a SQLite file with one row per commit, written with synchronous = FULL so a commit that
+    was added survives a crash of QGIS or the computer. Commits are taken out oldest first and only removed
+    once they are written; whatever is left is written the next time the plugin starts.
+    Every operation opens its own connection, so the journal can be used from any thread.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or journal_path()
+        if not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        with self.connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS commits (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                         "mdb_path TEXT, mdb_table TEXT, pk_cols TEXT, columns TEXT, changes TEXT, "
+                         "state TEXT, attempts INTEGER, error TEXT, created TEXT)")
+
+    def connection(self):
+        """ Return a connection in a context manager that commits and closes it """
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA synchronous = FULL")
+        return _Transaction(conn)
+
+    def add(self, mdb_path, table, pk_cols, columns, changes):
+        """ Add a commit and return its id
+
+        :param columns: Columns of the layer the changes come from.
+        :type columns: list
+
+        :param changes: The changes to write.
+        :type changes: ChangeSet
+        """
+        with self.connection() as conn:
+            cur = conn.execute("INSERT INTO commits (mdb_path, mdb_table, pk_cols, columns, changes, state, "
+                               "attempts, created) VALUES (?, ?, ?, ?, ?, ?, 0, ?)",
+                               (mdb_path, table, json.dumps(list(pk_cols)), json.dumps(list(columns)),
+                                dump_changes(changes), PENDING, datetime.datetime.now().isoformat()))
+            return cur.lastrowid
+
+    def entries(self, states=(PENDING, APPLYING)):
+        """ Return the JournalEntry of the commits in these states, oldest first """
+        with self.connection() as conn:
+            rows = conn.execute("SELECT id, mdb_path, mdb_table, pk_cols, columns, changes, state, attempts, error "
+                                "FROM commits WHERE state IN ({}) ORDER BY id".format(", ".join("?" * len(states))),
+                                states).fetchall()
+        return [JournalEntry(row[0], row[1], row[2], json.loads(row[3]), json.loads(row[4]), load_changes(row[5]),
+                             row[6], row[7], row[8]) for row in rows]
+
+    def writable(self):
+        """ Return the entries that can be written now: pending commits of tables without a failed commit """
+        blocked = set((entry.mdb_path, entry.table) for entry in self.entries((FAILED,)))
+        return [entry for entry in self.entries() if (entry.mdb_path, entry.table) not in blocked]
+
+    def set_state(self, entry_id, state, attempts=None, error=None):
+        with self.connection() as conn:
+            conn.execute("UPDATE commits SET state = ?, attempts = COALESCE(?, attempts), error = ? WHERE id = ?",
+                         (state, attempts, error, entry_id))
+
+    def remove(self, entry_id):
+        with self.connection() as conn:
+            conn.execute("DELETE FROM commits WHERE id = ?", (entry_id,))
+
+    def retry_failed(self):
+        """ Put the failed commits back in the queue; returns how many there were """
+        with self.connection() as conn:
+            return conn.execute("UPDATE commits SET state = ?, attempts = 0 WHERE state = ?",
+                                (PENDING, FAILED)).rowcount
+
+    def counts(self):
+        """ Return {state: number of commits} """
+        with self.connection() as conn:
+            return dict(conn.execute("SELECT state, COUNT(*) FROM commits GROUP BY state").fetchall())
+
+
+class _Transaction:
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with closing(self.conn):
+            if exc_type is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+
+
+class MdbJournalWorker(QObject):
+    """ Write the commits in the journal to their databases on a separate thread, oldest first
+
+    Every commit is written in one transaction. When that fails (the database is locked, the network share is
+    gone) the commit is tried again after RETRY_DELAYS; after MAX_ATTEMPTS it's marked failed. Later commits
+    of the same table wait for it, so edits are never written out of order, while the commits of other tables
+    go ahead. Rows that were changed by someone
+    else since they were read are left alone and reported with their current values.
+    The worker stops when there is nothing left to write.
+    """
+
+    progress = pyqtSignal(int, int)                 # commits written, commits written and still to write
+    written = pyqtSignal(int, str, str, object)     # entry id, database, table, {pk values: current values or None}
+    failed = pyqtSignal(int, str, str, str)         # entry id, database, table, error
+    finished = pyqtSignal(int, bool)
+    error = pyqtSignal(str)
+
+    def __init__(self, journal):
+        """
+        :param journal: The journal to write.
+        :type journal: MdbJournal
+        """
+        QObject.__init__(self)
+        self.journal = journal
+        self.killed = False
+        self.wake = threading.Event()
+        self.retry_at = {}      # entry id: time.time() at which a commit that failed is tried again
+
+    def run(self):
+        written = 0
+        try:
+            while not self.killed:
+                entries = self.journal.writable()
+                if not entries:
+                    break
+                self.progress.emit(written, written + len(entries))
+                entry, delay = self.next_entry(entries)
+                if entry is None:
+                    self.wake.wait(delay)
+                    self.wake.clear()
+                    continue
+                try:
+                    conflicts = self.write(entry)
+                except Exception as e:
+                    attempts = entry.attempts + 1
+                    if attempts >= MAX_ATTEMPTS:
+                        self.journal.set_state(entry.id, FAILED, attempts, "{}".format(e))
+                        logger("Gave up writing commit {} to {} after {} attempts. Error: {}".format(
+                            entry.id, entry.table, attempts, e))
+                        self.failed.emit(entry.id, entry.mdb_path, entry.table, "{}".format(e))
+                    else:
+                        self.journal.set_state(entry.id, PENDING, attempts, "{}".format(e))
+                        logger("Writing commit {} to {} failed, trying again in {} seconds. Error: {}".format(
+                            entry.id, entry.table, RETRY_DELAYS[attempts - 1], e))
+                        self.retry_at[entry.id] = time.time() + RETRY_DELAYS[attempts - 1]
+                    continue
+                self.retry_at.pop(entry.id, None)
+                self.journal.remove(entry.id)
+                written += 1
+                self.written.emit(entry.id, entry.mdb_path, entry.table, conflicts)
+        except Exception as e:
+            self.error.emit("{}".format(e))
+        self.finished.emit(written, self.killed)
+
+    def next_entry(self, entries):
+        """ Return the oldest commit that can be written now, the first of its table that isn't waiting to be
+        tried again, and None with the seconds until the next retry if they are all waiting """
+        now = time.time()
+        tables = set()
+        retries = []
+        for entry in entries:
+            if (entry.mdb_path, entry.table) in tables:
+                continue
+            tables.add((entry.mdb_path, entry.table))
+            retry_at = self.retry_at.get(entry.id, now)
+            if retry_at <= now:
+                return entry, 0
+            retries.append(retry_at - now)
+        return None, min(retries)
+
+    def write(self, entry):
+        """ Write one commit; returns the conflicting rows that were left alone """
+        changes = entry.changes
+        writer = MdbWriter(entry.table, entry.pk_cols)
+        interrupted = entry.state == APPLYING
+        self.journal.set_state(entry.id, APPLYING, error=entry.error)
+        conflicts = {}
+        with get_pool(entry.mdb_path, 'odbc').connection() as conn:
+            cur = conn.cursor()
+            if changes.originals:
+                conflicts = writer.find_conflicts(cur, changes, entry.columns)
+                applied = writer.applied(changes, conflicts)
+                changes = changes.without(set(conflicts))
+                conflicts = dict((pk_values, values) for pk_values, values in conflicts.items()
+                                 if pk_values not in applied)
+            if interrupted:
+                changes.inserts = self.missing_inserts(cur, writer, changes.inserts)
+            if len(changes):
+                writer.apply(cur, changes, conflicts, entry.columns)
+        return conflicts
+
+    @staticmethod
+    def missing_inserts(cur, writer, inserts):
+        """ Return the inserts of a commit that was interrupted that aren't in the database yet. Only inserts with
+        their primary key can be recognized, others (autonumber keys) are written again """
+        key = lambda values: tuple(values[pk] for pk in writer.pk_cols)
+        keyed = [values for values in inserts if all(pk in values for pk in writer.pk_cols)]
+        if not keyed:
+            return inserts
+        lookup = ChangeSet()
+        lookup.originals = dict((key(values), {}) for values in keyed)
+        missing = writer.find_conflicts(cur, lookup, [])
+        return [values for values in inserts if not all(pk in values for pk in writer.pk_cols) or key(values) in missing]
+
+    def kill(self):
+        self.killed = True
+        self.wake.set()
+
+
+class MdbWriteBehind(QObject):
+    """ The journal and the worker writing it, shared by all layers: get it with write_behind()
+
+    Layers add their commits with add() and return right away. The worker is started whenever there is
+    something to write; state_changed tells how many commits are pending and failed.
+    """
+
+    state_changed = pyqtSignal(int, int)            # pending commits, failed commits
+    progress = pyqtSignal(int, int)
+    written = pyqtSignal(int, str, str, object)
+    failed = pyqtSignal(int, str, str, str)
+
+    def __init__(self, journal=None):
+        QObject.__init__(self)
+        self.journal = journal or MdbJournal()
+        self.worker = None
+        self.thread = None
+        self.stopped = False
+
+    def add(self, mdb_path, table, pk_cols, columns, changes):
+        """ Add a commit to the journal and have it written; returns its id """
+        entry_id = self.journal.add(mdb_path, table, pk_cols, columns, changes)
+        self.start()
+        return entry_id
+
+    def start(self):
+        """ Start writing the journal, if there is anything to write and it isn't being written already """
+        self.stopped = False
+        self.emit_state()
+        if self.worker is not None:
+            self.worker.wake.set()      # a worker waiting to retry a commit writes the new one first
+            return
+        if not self.journal.writable():
+            return
+        self.worker = MdbJournalWorker(self.journal)
+        self.worker.progress.connect(self.progress.emit)
+        self.worker.written.connect(self.entry_written)
+        self.worker.failed.connect(self.entry_failed)
+        self.worker.error.connect(self.worker_error)
+        self.worker.finished.connect(self.worker_finished)
+        self.thread = start_worker(self.worker)
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """ Stop the worker and wait for it, at most timeout seconds; whatever isn't written stays in the journal
+
+        The thread is quit here: finished, which quits it otherwise, is handled by this (GUI) thread, which is
+        blocked while waiting.
+        """
+        self.stopped = True
+        if self.worker is not None:
+            self.worker.kill()
+            self.thread.quit()
+            if not self.thread.wait(timeout * 1000):
+                logger("Still writing a commit after {} seconds, stopped waiting for it".format(timeout))
+
+    def retry_failed(self):
+        count = self.journal.retry_failed()
+        logger("Retrying {} failed commits".format(count))
+        self.start()
+
+    def counts(self):
+        """ Return (pending commits, failed commits) """
+        counts = self.journal.counts()
+        return counts.get(PENDING, 0) + counts.get(APPLYING, 0), counts.get(FAILED, 0)
+
+    def emit_state(self):
+        self.state_changed.emit(*self.counts())
+
+    def entry_written(self, entry_id, mdb_path, table, conflicts):
+        self.written.emit(entry_id, mdb_path, table, conflicts)
+        self.emit_state()
+
+    def entry_failed(self, entry_id, mdb_path, table, message):
+        self.failed.emit(entry_id, mdb_path, table, message)
+        self.emit_state()
+
+    def worker_error(self, message):
+        logger("Writing the journal stopped. Error: {}".format(message))
+
+    def worker_finished(self, count, killed):
+        self.worker = None
+        self.thread = None
+        # a commit added while the worker was finishing is written by a new one
+        if not self.stopped:
+            self.start()
+        self.emit_state()
+
+
+_write_behind = []
+
+
+def write_behind():
+    """ Return the MdbWriteBehind of this QGIS session """
+    if not _write_behind:
+        _write_behind.append(MdbWriteBehind())
+    return _write_behind[0]
@@ -1,15 +1,43 @@
-import pyodbc, datetime
-from PyQt4.QtGui import QProgressBar
-from PyQt4.QtCore import QVariant, Qt
-from qgis.utils import iface, QgsMessageBar
-from qgis.core import (QgsVectorLayer, QgsFeature, QgsGeometry, QgsPoint, QgsField,
-                       QgsMapLayerRegistry, QgsFeatureRequest, QgsMessageLog)
+from collections import OrderedDict
+from PyQt4.QtCore import QVariant, Qt, QPyNullVariant, QTimer
+from qgis.core import (QgsVectorLayer, QgsFeature, QgsGeometry, QgsFields,
+                       QgsMapLayerRegistry, QgsFeatureRequest, QgsMessageLog, qgsfunction)
+from mdb_worker import MdbLoadWorker, start_worker
+from mdb_cache import MdbCache
+from mdb_connection import get_pool, quote, column_names, SQL_TABLE_STAT
+from mdb_writeback import ChangeSet, MdbWriter
+from mdb_types import row_converter, to_db, to_attribute, is_binary_field
+from mdb_timing import Timings, Profiler, estimated_size
+from mdb_index import MdbIndexes
+from mdb_journal import write_behind
+from mdb_lob import MdbLargeObjects, is_large_object
+from mdb_catalog import store_row_count
+from mdb_reader import (BATCH_SIZE, DEFAULT_CRS, select_list, select_sql, fields_from_description,
+                        coordinate_indexes, point_geometry, features_from_rows)
 
 
 logger = lambda msg: QgsMessageLog.logMessage(msg, 'Mdb Layer', 1)
 
 SHOW_PROGRESSBAR = True
 READ_ONLY = True
+LOAD_IN_BACKGROUND = True
+USE_CACHE = True
+PROFILE_LOAD = False
+MAX_PAGES = 10              # pages of a paged layer kept on the layer
+CHECK_CONFLICTS = True      # only write rows that weren't changed by someone else since they were loaded
+MAX_CONFLICTS_SHOWN = 10    # primary keys of conflicting records listed in the message bar
+WRITE_BEHIND = False        # save edits to the journal and write them to the database in the background
+LAZY_LARGE_OBJECTS = True   # memo and OLE object columns are read when asked for, not with the layer
+
+# MdbLayers by layer id, keeping them (and their signal connections) alive while their layer is loaded
+open_layers = {}
+
+
+def message_bar():
+    """ Return the message bar of the QGIS window, None without one. The GUI modules are only imported when
+    there is something to show, so layers can be loaded where there is no QGIS window """
+    from qgis.utils import iface
+    return iface.messageBar() if iface is not None else None
 
 
 class MdbLayer:
@@ -18,7 +46,12 @@ class MdbLayer:
     dirty = False
     doing_attr_update = False
 
-    def __init__(self, mdb_path, mdb_table, mdb_columns='*', mdb_hide_columns = ''):
+    def __init__(self, mdb_path, mdb_table, mdb_columns='*', mdb_hide_columns = '', mdb_subset='',
+                 batch_size=BATCH_SIZE, background=LOAD_IN_BACKGROUND, use_cache=USE_CACHE,
+                 show_progress=SHOW_PROGRESSBAR, on_loaded=None, x_column=None, y_column=None, crs=DEFAULT_CRS,
+                 profile=PROFILE_LOAD, add_to_map=True, page_size=None, max_pages=MAX_PAGES,
+                 check_conflicts=CHECK_CONFLICTS, index_columns=(), backend=None, write_behind=WRITE_BEHIND,
+                 lazy_large_objects=LAZY_LARGE_OBJECTS):
         """ Initialize the layer by reading a Access mdb file, creating a memory layer, and adding records to it
 
         :param mdb_path: Path to the database you wish to access.
@@ -33,175 +66,1161 @@ class MdbLayer:
         :param mdb_hide_columns: Comma separated list of columns to hide for this layer.
             Use in combination with mdb_columns='*'
         :type mdb_hide_columns: str
+
+        :param mdb_subset: Access SQL condition (without WHERE) limiting the records of this layer.
+        :type mdb_subset: str
+
+        :param batch_size: Number of rows fetched from the database and added to the layer at once.
+        :type batch_size: int
+
+        :param background: Fetch the records on a separate thread. The layer is added to the map right away
+            and filled while the records come in.
+        :type background: bool
+
+        :param use_cache: Load the records from the on-disk cache if the database didn't change since the last
+            time this table was loaded, and store them there otherwise.
+        :type use_cache: bool
+
+        :param show_progress: Show the loading progress and result in the message bar.
+        :type show_progress: bool
+
+        :param on_loaded: Called with this MdbLayer when loading is done, failed or was cancelled.
+            Check loaded_count and error for the result.
+        :type on_loaded: function
+
+        :param x_column: Column with the x coordinate (or longitude). Together with y_column this makes the
+            layer a point layer, with a spatial index.
+        :type x_column: str
+
+        :param y_column: Column with the y coordinate (or latitude).
+        :type y_column: str
+
+        :param crs: Coordinate reference system of the coordinates, as authority id.
+        :type crs: str
+
+        :param profile: Capture a cProfile of the load. The statistics are written to a .prof file in the temp
+            folder, its path is in timings['profile'].
+        :type profile: bool
+
+        :param add_to_map: Add the layer to the map. Without it the layer is only available as the lyr attribute;
+            together with show_progress=False nothing touches the GUI, so layers can be loaded from scripts and
+            Processing. Keep a reference to this MdbLayer while it loads in the background.
+        :type add_to_map: bool
+
+        :param page_size: Load the records in pages of this many records, ordered by primary key, starting with
+            only the first page. More pages are loaded with load_more() and load_page(). Tables without primary
+            key are loaded completely.
+        :type page_size: int
+
+        :param max_pages: Number of pages kept on a paged layer; the least recently used page is removed from
+            the layer when another one is loaded.
+        :type max_pages: int
+
+        :param check_conflicts: When saving edits, only update and delete records that still have the values
+            they had when they were loaded. Records changed by someone else in the meantime are reported
+            together and get their current values from the database instead of being overwritten.
+        :type check_conflicts: bool
+
+        :param index_columns: Columns to index besides the primary key, for fast lookups with lookup() and the
+            mdb_lookup expression function (joins, labels and identify from other layers).
+        :type index_columns: list
+
+        :param backend: How the database is read: 'odbc', 'jet' (straight from the file, read only, without
+            filters or paging) or 'auto'. Defaults to mdb_connection.DEFAULT_BACKEND.
+        :type backend: str
+
+        :param write_behind: Saving edits only puts them in the journal (see mdb_journal) and returns right away;
+            they are written to the database in the background, also after a crash. Conflicts are reported
+            and put on the layer once they are known.
+        :type write_behind: bool
+
+        :param lazy_large_objects: Leave memo and OLE object columns out of the layer when all columns are loaded
+            (mdb_columns '*'). Their values are read by primary key when asked for, with large_value() and the
+            mdb_large_value expression function, and kept in a cache of limited size. Columns that were picked
+            in mdb_columns and tables without primary key are loaded with them.
+        :type lazy_large_objects: bool
         """
 
         self.mdb_path = mdb_path
         self.mdb_table = mdb_table
         self.mdb_columns = mdb_columns
         self.mdb_hide_columns = [x.strip() for x in mdb_hide_columns.split(",")]
+        self.mdb_subset = mdb_subset
         self.record_count = 0
         self.progress = object
         self.old_pk_values = {}
         self.read_only = READ_ONLY
+        self.batch_size = batch_size
+        self.background = background
+        self.loading = False
+        self.worker = None
+        self.thread = None
+        self.cache = MdbCache() if use_cache else None
+        self.cache_writer = None
+        self.writer = None
+        self.show_progress = show_progress
+        self.add_to_map = add_to_map
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.check_conflicts = check_conflicts
+        self.checked_columns = []       # columns compared with their loaded values when saving edits
+        self.conflicts = []             # (feature id, current values or None) to apply once the commit is done
+        self.commit_pks = {}            # feature id: primary key of the records being saved
+        self.keyless_edits = []         # feature ids of edited records that have no primary key values
+        self.inserted_keys = []         # primary key values of the added records being saved, in order
+        self.kept_edits = None          # edits of a commit that failed, to put back once it's done
+        self.write_behind = write_behind
+        self.lazy_large_objects = lazy_large_objects
+        self.large_objects = None       # MdbLargeObjects, if large object columns were left out
+        self.index_columns = list(index_columns or [])
+        self.indexes = MdbIndexes([], [])
+        self.paged = False
+        self.pages = OrderedDict()      # page number: feature ids, least recently used first
+        self.page_starts = [None]       # per page the primary key of the last record before it
+        self.last_page = None           # number of the last page, once it's known
+        self.on_loaded = on_loaded
+        self.loaded_count = 0
+        self.error = None
+        self.cancelled = False
+        self.x_column = x_column
+        self.y_column = y_column
+        self.crs = crs
+        self.xy_indexes = None
+        self.timings = {}           # 'load' and 'commit': total seconds, seconds per phase and counters
+        self.load_timings = Timings()
+        self.profiler = Profiler(profile)
 
-        # connect to the database
-        constr = "DRIVER={Microsoft Access Driver (*.mdb, *.accdb)};FIL={MS Access};DBQ=" + self.mdb_path
+        # connect to the database, the connection goes back to the pool once the layer is set up
+        self.pool = get_pool(self.mdb_path, backend)
+        if self.pool.backend == 'jet':
+            self.read_only = True       # the file reader can't write
         try:
-            conn = pyodbc.connect(constr, timeout=3)
-            self.cur = conn.cursor()
+            with self.load_timings.phase('connect'):
+                conn = self.pool.acquire()
         except Exception as e:
-            logger("Couldn't connect. Error: {}".format(e))
+            self.fail("Couldn't connect. Error: {}".format(e))
+            self.notify_loaded()
             return
 
+        self.cur = conn.cursor()
+        try:
+            with self.profiler.running():
+                self.setup_layer()
+        finally:
+            self.cur.close()
+            self.cur = None
+            self.pool.release(conn)
+
+        # a background load reports when its worker is done
+        if not self.loading:
+            self.notify_loaded()
+
+    def setup_layer(self):
+        """ Read the table definition, create the memory layer and start adding records to it """
+
+        timings = self.load_timings
+
         # determine primary key(s) if table
-        table = self.cur.tables(table=self.mdb_table).fetchone()
+        with timings.phase('catalog'):
+            table = self.cur.tables(table=self.mdb_table).fetchone()
+        cardinality = None
         if table.table_type == 'TABLE':
-            self.pk_cols = [row[8] for row in self.cur.statistics(self.mdb_table) if row[5] == 'PrimaryKey']
+            with timings.phase('catalog'):
+                statistics = self.cur.statistics(self.mdb_table).fetchall()
+            self.pk_cols = [row[8] for row in statistics if row[5] == 'PrimaryKey']
+            cardinality = next((row[10] for row in statistics if row[6] == SQL_TABLE_STAT), None)
         elif table.table_type == 'VIEW':
             self.pk_cols = []
         else:
-            logger("Database object type '{}' not supported".format(table.table_type))
+            self.fail("Database object type '{}' not supported".format(table.table_type))
+            return
+
+        # paging goes by primary key with keyset queries; tables without one, or read from the file, are
+        # loaded completely
+        self.paged = bool(self.page_size and self.pk_cols) and self.pool.backend != 'jet'
+        if self.page_size and not self.pk_cols:
+            logger("{}: paging needs a primary key, loading all records".format(self.mdb_table))
+
+        # only the wanted columns and records are fetched, hidden columns are never transferred
+        self.select_list = self.get_select_list()
+        if (self.lazy_large_objects and self.pk_cols and self.pool.backend != 'jet' and
+                self.mdb_columns.strip() == '*'):
+            try:
+                with timings.phase('select'):
+                    self.leave_out_large_objects()
+            except Exception as e:
+                self.fail("There's a problem with this table or query. Error: {}".format(e))
+                return
+        self.sql = select_sql(self.mdb_table, self.select_list, [self.mdb_subset])
+
+        # use the cached copy of the table if the database didn't change since it was stored
+        # the cache holds complete tables, not pages
+        with timings.phase('cache_open'):
+            cache_entry = (self.cache.load(self.mdb_path, self.mdb_table, self.cache_query())
+                           if self.cache and not self.paged else None)
+        if cache_entry is not None:
+            self.record_count = cache_entry.record_count
+            field_name_types = cache_entry.fields
+            if cache_entry.read_only:
+                self.read_only = True
+        else:
+            # the record count only sizes the progress bar, so it is estimated instead of running the query twice
+            self.record_count = self.estimate_record_count(cardinality)
+
+            # get records from the table; when loading in the background or by page only the column
+            # description is needed
+            try:
+                with timings.phase('select'):
+                    if self.background or self.paged:
+                        self.cur.execute(select_sql(self.mdb_table, self.select_list, ["1 = 0"]))
+                    else:
+                        self.cur.execute(self.sql)
+            except Exception as e:
+                self.fail("There's a problem with this table or query. Error: {}".format(e))
+                return
+            field_name_types, unsupported_types = fields_from_description(self.cur.description)
+            if unsupported_types:
+                self.read_only = True        # no reliably editing for other data types
+            self.convert_rows = row_converter(self.cur.description)
+
+        # point geometries are made from the coordinate columns while loading
+        field_names = [field.name() for field in field_name_types]
+        self.xy_indexes = coordinate_indexes(field_names, self.x_column, self.y_column, self.mdb_table)
+
+        # create the layer, add columns
+        uri = "Point?crs={}&index=yes".format(self.crs) if self.xy_indexes else "None"
+        with timings.phase('create_layer'):
+            self.lyr = QgsVectorLayer(uri, 'mdb_' + self.mdb_table, 'memory')
+            provider = self.lyr.dataProvider()
+            provider.addAttributes(field_name_types)
+            self.lyr.updateFields()
+        self.indexes = MdbIndexes(field_names, self.pk_cols, self.index_columns)
+        if self.add_to_map:
+            open_layers[self.lyr.id()] = self
+            QgsMapLayerRegistry.instance().layerWillBeRemoved.connect(self.layer_removed)
+
+        if self.cache and cache_entry is None and not self.paged:
+            try:
+                self.cache_writer = self.cache.writer(self.mdb_path, self.mdb_table, self.cache_query(),
+                                                      field_name_types, self.pk_cols, unsupported_types)
+            except Exception as e:
+                logger("Couldn't create cache file. Error: {}".format(e))
+
+        # add the records, either right away or while the layer is already on the map
+        if self.paged:
+            self.load_page(0)
+            self.setup_editing()
+            self.add_layer_to_map()
+        elif cache_entry is not None:
+            self.add_cached_records(cache_entry)
+            self.setup_editing()
+            self.add_layer_to_map()
+        elif self.background:
+            self.add_layer_to_map()
+            self.load_in_background()
+        else:
+            self.add_records()
+            self.setup_editing()
+            self.add_layer_to_map()
+
+    def add_layer_to_map(self):
+        if self.add_to_map:
+            QgsMapLayerRegistry.instance().addMapLayer(self.lyr)
+
+    def estimate_record_count(self, cardinality=None):
+        """ Return the expected number of records without counting them: the number loaded last time,
+        or the table size from the statistics if there's no subset. 0 if unknown
+
+        :param cardinality: Number of rows in the table according to cursor.statistics, if any.
+        :type cardinality: int
+        """
+        if self.cache:
+            count = self.cache.last_count(self.mdb_path, self.mdb_table, self.cache_query())
+            if count is not None:
+                return count
+        if cardinality is not None and not self.mdb_subset:
+            return cardinality
+        return 0
+
+    def store_record_count(self):
+        """ Remember the number of records of a completed load, to size the progress bar of the next one """
+        self.record_count = self.loaded_count
+        if self.cache:
+            try:
+                self.cache.store_count(self.mdb_path, self.mdb_table, self.cache_query(), self.loaded_count)
+            except Exception as e:
+                logger("Couldn't store record count. Error: {}".format(e))
+        # the table dialog shows the row counts of the catalog; a subset isn't the whole table
+        if not self.mdb_subset:
+            try:
+                store_row_count(self.mdb_path, self.mdb_table, self.loaded_count)
+            except Exception as e:
+                logger("Couldn't store row count in the catalog. Error: {}".format(e))
+
+    def loading_message(self):
+        if not self.record_count:
+            return "Loading records from table {}...".format(self.lyr.name())
+        return "Loading about {} records from table {}...".format(self.record_count, self.lyr.name())
+
+    def get_select_list(self):
+        """ Return the columns for the SELECT: mdb_columns, or all columns except the hidden ones """
+        columns = [column.strip() for column in self.mdb_columns.split(",")]
+        hidden = [column for column in self.mdb_hide_columns if column]
+        if columns == ['*']:
+            if not hidden:
+                return '*'
+            columns = column_names(self.cur, self.mdb_table)
+        columns = [column for column in columns if column not in hidden]
+        if self.paged:
+            columns.extend(pk for pk in self.pk_cols if pk not in columns and quote(pk) not in columns)
+        return select_list(columns)
+
+    def leave_out_large_objects(self):
+        """ Take memo and OLE object columns out of the select list; they are read with self.large_objects """
+        self.cur.execute(select_sql(self.mdb_table, self.select_list, ["1 = 0"]))
+        large = [column[0] for column in self.cur.description if is_large_object(column)]
+        if not large:
             return
+        binary = [column[0] for column in self.cur.description
+                  if column[0] in large and column[1] not in (str, unicode)]
+        self.large_objects = MdbLargeObjects(self.pool, self.mdb_table, self.pk_cols, large, binary_columns=binary)
+        self.select_list = select_list([column[0] for column in self.cur.description if column[0] not in large])
+        logger("{}: {} are read when asked for".format(self.mdb_table, ", ".join(large)))
+
+    def large_value(self, fid, column):
+        """ Return the value of a memo or OLE object column that was left out of the layer, for one feature.
+        None if the feature or its record isn't there """
+        return self.large_values([fid], column).get(fid)
+
+    def large_values(self, fids, column):
+        """ Return {feature id: value} of a memo or OLE object column that was left out of the layer. Values
+        that aren't cached are read in chunks, so ask for the values of many features at once """
+        if self.large_objects is None or column not in self.large_objects.columns:
+            raise KeyError("{} is not a large object column of {}".format(column, self.mdb_table))
+        keys = dict((fid, self.indexes.pk_values(fid)) for fid in fids)
+        keys = dict((fid, key) for fid, key in keys.items() if key is not None)
+        values = self.large_objects.get_many(keys.values(), column)
+        return dict((fid, to_attribute(values.get(key))) for fid, key in keys.items())
+
+    def save_large_value(self, fid, column, path):
+        """ Write the value of a memo or OLE object column that was left out of the layer to a file, for one
+        feature, reading it in chunks so a large value is never in memory as a whole. Memos are written as UTF-8.
+        Returns the number of characters or bytes written, None if the feature isn't on the layer """
+        if self.large_objects is None or column not in self.large_objects.columns:
+            raise KeyError("{} is not a large object column of {}".format(column, self.mdb_table))
+        key = self.indexes.pk_values(fid)
+        if key is None:
+            return None
+        size = 0
+        with open(path, 'wb') as f:
+            for chunk in self.large_objects.chunks(key, column):
+                f.write(chunk.encode('utf-8') if isinstance(chunk, unicode) else bytes(chunk))
+                size += len(chunk)
+        return size
+
+    def load_page(self, number):
+        """ Add a page of records to a paged layer, fetched by primary key (keyset pagination)
+
+        A page can be loaded once the page before it has been loaded. When more than max_pages are on the
+        layer, the least recently used page is removed, unless the layer is being edited.
+
+        :param number: Page number, the first page is 0.
+        :type number: int
+
+        :returns: Number of records on the page, 0 if the page doesn't exist (yet), None if it couldn't be read.
+        :rtype: int
+        """
+        if number in self.pages:
+            self.pages[number] = self.pages.pop(number)         # most recently used
+            return len(self.pages[number])
+        if not self.paged or number >= len(self.page_starts):
+            return 0
 
-        # get record count
+        conditions = [self.mdb_subset]
+        params = []
+        start = self.page_starts[number]
+        if start is not None:
+            conditions.append(keyset_condition(self.pk_cols))
+            params = keyset_params(start)
+        sql = select_sql(self.mdb_table, self.select_list, conditions, top=self.page_size, order_by=self.pk_cols)
+
+        self.setup_progressbar("Loading page {} of table {}...".format(number + 1, self.lyr.name()), 0)
         try:
-            self.cur.execute("SELECT COUNT(*) FROM {}".format(self.mdb_table))
-            self.record_count = self.cur.fetchone()[0]
+            with self.load_timings.phase('select'), self.pool.connection() as conn:
+                cur = conn.cursor()
+                rows = cur.execute(sql, params).fetchall()
+                cur.close()
         except Exception as e:
-            self.iface.messageBar().pushWarning("MDB Layer",
-                "There's a problem with this table or query. Error: {}".format(e))
-            return
+            if self.show_progress:
+                message_bar().clearWidgets()
+            self.fail("Couldn't load page {}. Error: {}".format(number + 1, e))
+            return None
+
+        field_names = [field.name() for field in self.lyr.dataProvider().fields()]
+        pk_indexes = [field_names.index(pk) for pk in self.pk_cols]
+        if len(rows) == self.page_size:
+            if number + 1 == len(self.page_starts):
+                self.page_starts.append(tuple(rows[-1][i] for i in pk_indexes))
+        else:
+            self.last_page = number
 
-        # get records from the table
-        sql = "SELECT {} FROM {}".format(self.mdb_columns, self.mdb_table)
-        self.cur.execute(sql)
-
-        # create a dictionary with fieldname:type
-        # QgsField only supports: String / Int / Double
-        # falling back to string for: bytearray, bool, datetime.datetime, datetime.date, datetime.time, ?
-        field_name_types = []
-        field_type_map = {str: QVariant.String, unicode: QVariant.String,
-                          int: QVariant.Int, float: QVariant.Double}
-
-        # create a list with a QgsFields for every db column
-        for column in self.cur.description:
-            if column[0] not in self.mdb_hide_columns:
-                if column[1] in field_type_map:
-                    field_name_types.append(QgsField(column[0], field_type_map[column[1]]))
-                else:
-                    field_name_types.append(QgsField(column[0], QVariant.String))
-                    self.read_only = True        # no reliably editing for other data types
+        added = self.add_rows(rows) if rows else []
+        self.pages[number] = [feature.id() for feature in added]
+        self.evict_pages()
+        self.lyr.triggerRepaint()
+        self.finish_progressbar("{} records of page {} added to {}".format(len(rows), number + 1, self.lyr.name()))
+        return len(rows)
 
-        # create the layer, add columns
-        self.lyr = QgsVectorLayer("None", 'mdb_' + mdb_table, 'memory')
+    def load_more(self):
+        """ Load the page after the furthest page reached so far. Returns the number of records added,
+        None if the page couldn't be read """
+        if not self.paged:
+            return 0
+        next_page = len(self.page_starts) - 1
+        if next_page in self.pages or (self.last_page is not None and next_page > self.last_page):
+            return 0
+        return self.load_page(next_page)
+
+    def evict_pages(self):
         provider = self.lyr.dataProvider()
-        provider.addAttributes(field_name_types)
-        self.lyr.updateFields()
+        while len(self.pages) > self.max_pages and not self.lyr.isEditable():
+            number, fids = self.pages.popitem(last=False)
+            provider.deleteFeatures(fids)
+            self.indexes.removed(fids)
+            self.loaded_count -= len(fids)
 
-        # add the records
-        self.add_records()
+    def fail(self, message):
+        """ Report a problem that stops the layer from loading """
+        self.error = message
+        logger("{}: {}".format(self.mdb_table, message))
+        if self.show_progress:
+            message_bar().pushWarning("MDB Layer", message)
 
-        # set read only or make connections/triggers
-        # if there are no primary keys there is no way to edit
+    def notify_loaded(self):
+        self.finish_timings()
+        if self.on_loaded is not None:
+            self.on_loaded(self)
+
+    def finish_timings(self):
+        """ Log where the time of the load went and make it available in timings['load'] """
+        self.timings['load'] = self.load_timings.as_dict()
+        logger("{}: load {}".format(self.mdb_table, self.load_timings.report()))
+        if self.profiler.enabled:
+            try:
+                path, stats = self.profiler.save(self.mdb_table)
+            except Exception as e:
+                logger("Couldn't save profile. Error: {}".format(e))
+            else:
+                self.timings['profile'] = path
+                logger("{}: profile saved to {}\n{}".format(self.mdb_table, path, stats))
+
+    def cache_query(self):
+        """ Return what, besides the database and table, identifies the cached records of this layer """
+        return self.sql
+
+    def invalidate_cache(self):
+        """ Remove the cached records of this layer, the next load reads the database again """
+        if self.cache:
+            self.cache.invalidate(self.mdb_path, self.mdb_table, self.cache_query())
+
+    def setup_editing(self):
+        """ Set read only or make connections/triggers.
+        If there are no primary keys there is no way to edit """
         if self.read_only or not self.pk_cols:
             self.lyr.setReadOnly()
-        else:
+        elif self.writer is None:
+            self.writer = MdbWriter(self.mdb_table, self.pk_cols)
+            self.lyr.setReadOnly(False)
             self.lyr.beforeCommitChanges.connect(self.before_commit)
-
-        # add the layer the map
-        QgsMapLayerRegistry.instance().addMapLayer(self.lyr)
+            self.lyr.editingStopped.connect(self.apply_conflicts)
+            self.lyr.committedFeaturesAdded.connect(self.committed_features_added)
+            self.lyr.committedFeaturesRemoved.connect(self.committed_features_removed)
+            self.lyr.committedAttributeValuesChanges.connect(self.committed_attribute_values)
+            if self.write_behind:
+                write_behind().written.connect(self.written_behind)
+                write_behind().failed.connect(self.write_behind_failed)
+            # binary values are on the layer as hexadecimal text, they aren't written back
+            fields = self.lyr.dataProvider().fields()
+            for i in range(fields.count()):
+                if is_binary_field(fields[i]):
+                    self.lyr.editFormConfig().setReadOnly(i, True)
+            # memo and binary values can't be compared in a WHERE clause
+            self.checked_columns = [field.name() for field in fields if not is_binary_field(field) and
+                                    not (field.type() == QVariant.String and not 0 < field.length() <= 255)]
 
     def add_records(self):
-        """ Add records to the memory layer by stepping through the query result """
+        """ Add records to the memory layer by fetching the query result in batches of self.batch_size """
+
+        self.setup_progressbar(self.loading_message(), self.record_count)
+
+        while True:
+            with self.load_timings.phase('fetch'):
+                rows = self.cur.fetchmany(self.batch_size)
+            if not rows:
+                break
+            self.add_rows(rows)
 
-        self.setup_progressbar("Loading {} records from table {}..."
+        self.finish_cache(self.loaded_count, completed=True)
+        self.store_record_count()
+        self.finish_progressbar("{} records added to {}".format(self.loaded_count, self.lyr.name()))
+
+    def add_cached_records(self, cache_entry):
+        """ Add records to the memory layer from the on-disk cache """
+
+        self.setup_progressbar("Loading {} records from cache for table {}..."
                                .format(self.record_count, self.lyr.name()),
                                self.record_count)
 
+        batches = cache_entry.batches(self.batch_size)
+        while True:
+            with self.load_timings.phase('cache_read'):
+                rows = next(batches, None)
+            if rows is None:
+                break
+            self.add_rows(rows, converted=True)
+
+        self.finish_progressbar("{} records added to {} from cache".format(self.loaded_count, self.lyr.name()))
+
+    def add_rows(self, rows, converted=False):
+        """ Add a batch of rows to the layer and the cache, timing every step. Returns the added features
+
+        :param converted: The rows already hold attribute values, as they do when read from the cache.
+        :type converted: bool
+        """
+        timings = self.load_timings
+        with timings.phase('convert'):
+            values = rows if converted else self.convert_rows(rows)
+        with timings.phase('features'):
+            features = features_from_rows(values, self.xy_indexes)
+        with timings.phase('add_features'):
+            added = self.lyr.dataProvider().addFeatures(features)[1]
+        if self.indexes:
+            with timings.phase('index'):
+                self.indexes.added([feature.id() for feature in added], values)
+        with timings.phase('cache'):
+            self.cache_rows(rows)
+        timings.count('rows', len(rows))
+        timings.count('batches')
+        timings.count('bytes', estimated_size(rows))
+
+        self.loaded_count += len(rows)
+        with timings.phase('progress'):
+            self.update_progressbar(self.loaded_count)
+        return added
+
+    def cache_rows(self, rows):
+        """ Store loaded rows in the cache. Caching problems never stop loading, the cache is just dropped """
+        if self.cache_writer is None:
+            return
+        try:
+            self.cache_writer.add_rows(rows)
+        except Exception as e:
+            logger("Couldn't write cache. Error: {}".format(e))
+            self.finish_cache(0, completed=False)
+
+    def finish_cache(self, record_count, completed):
+        """ Make the cached records available for the next load, or throw them away if loading didn't complete """
+        if self.cache_writer is None:
+            return
+        try:
+            if completed:
+                self.cache_writer.commit(record_count)
+            else:
+                self.cache_writer.discard()
+        except Exception as e:
+            logger("Couldn't write cache. Error: {}".format(e))
+        self.cache_writer = None
+
+    def load_in_background(self):
+        """ Start a worker thread fetching the records; batches are added to the layer as they arrive """
+        self.loading = True
+        self.load_failed = False
+        self.lyr.setReadOnly()   # no editing on a layer that is still being filled
+
+        self.setup_progressbar(self.loading_message(), self.record_count, self.cancel_loading)
+
+        self.worker = MdbLoadWorker(self.pool, self.sql, self.batch_size)
+        self.worker.rows_fetched.connect(self.add_batch)
+        self.worker.finished.connect(self.loading_finished)
+        self.worker.error.connect(self.loading_error)
+        self.worker.timings.connect(self.worker_timings)
+        self.thread = start_worker(self.worker)
+
+    def add_batch(self, batch):
+        """ Add a batch of rows fetched by the worker to the layer
+
+        :param batch: The rows, as staged by the worker.
+        :type batch: ColumnBatch
+        """
+        try:
+            if not self.loading:
+                return
+            with self.profiler.running():
+                with self.load_timings.phase('unstage'):
+                    rows = batch.rows()
+                self.load_timings.count('staged bytes', batch.nbytes())
+                self.add_rows(rows)
+                with self.load_timings.phase('progress'):
+                    self.lyr.triggerRepaint()
+        finally:
+            if self.worker is not None:
+                self.worker.batch_done()
+
+    def worker_timings(self, phases):
+        """ Add the time the worker spent in the database. It overlaps with the time spent on this thread """
+        for name, seconds in phases.items():
+            self.load_timings.add_time(name, seconds)
+
+    def loading_finished(self, count, cancelled):
+        self.worker = None
+        self.thread = None
+        if not self.loading:
+            self.finish_cache(count, completed=False)
+            self.notify_loaded()
+            return                     # layer was removed while loading
+        self.loading = False
+        self.cancelled = cancelled
+        self.finish_cache(self.loaded_count, completed=not cancelled and not self.load_failed)
+        if not cancelled and not self.load_failed:
+            self.store_record_count()
+
+        if cancelled:
+            self.finish_progressbar("Loading cancelled, {} records added to {}"
+                                    .format(self.loaded_count, self.lyr.name()))
+        else:
+            self.finish_progressbar("{} records added to {}".format(self.loaded_count, self.lyr.name()))
+        self.setup_editing()
+        self.notify_loaded()
+
+    def loading_error(self, message):
+        self.load_failed = True
+        self.fail("There's a problem with this table or query. Error: {}".format(message))
+
+    def cancel_loading(self):
+        """ Stop the worker; the records that were already added stay on the layer """
+        if self.worker is not None:
+            self.worker.kill()
+
+    def layer_removed(self, layer_id):
+        if layer_id != self.lyr.id():
+            return
+        open_layers.pop(layer_id, None)
+        QgsMapLayerRegistry.instance().layerWillBeRemoved.disconnect(self.layer_removed)
+        if self.write_behind and self.writer is not None:
+            write_behind().written.disconnect(self.written_behind)
+            write_behind().failed.disconnect(self.write_behind_failed)
+        if self.loading:
+            self.loading = False
+            self.cancelled = True
+            self.cancel_loading()
+
+    def refresh(self, timestamp_column=None):
+        """ Bring the loaded records up to date with the database, keeping feature ids and styling
+
+        Only the differences are applied to the layer: new records are added, changed attribute values are
+        updated and records that are gone from the database are deleted. Records are matched on primary key.
+
+        Without timestamp_column every record is fetched and compared. With it, only records with a newer
+        timestamp than the newest one on the layer are fetched, plus the primary keys to find deleted records.
+
+        :param timestamp_column: Name of a column that is set to the time of the last change of a record.
+        :type timestamp_column: str
+
+        :returns: Number of added, changed and deleted records, or None if the layer can't be refreshed.
+        :rtype: tuple
+        """
         provider = self.lyr.dataProvider()
-        for i, row in enumerate(self.cur):
-            feature = QgsFeature()
-            feature.setGeometry(QgsGeometry())
-            feature.setAttributes([flds for flds in row])
-            provider.addFeatures([feature])
-            self.update_progressbar(i)
+        field_names = [field.name() for field in provider.fields()]
+        if self.paged:
+            self.fail("A paged layer can't be refreshed, load its pages again instead")
+            return None
+        if self.loading or not self.pk_cols or not set(self.pk_cols) <= set(field_names):
+            self.fail("Refresh needs a completely loaded table with its primary key columns")
+            return None
+        if self.lyr.isModified():
+            self.fail("Save or discard the edits before refreshing")
+            return None
+        if self.pool.backend == 'jet':
+            timestamp_column = None     # the file reader has no WHERE, it compares every record
+        if self.large_objects is not None:
+            self.large_objects.clear()
+        if timestamp_column and timestamp_column not in field_names:
+            self.fail("Timestamp column '{}' is not on the layer".format(timestamp_column))
+            return None
+
+        get_pk = self.indexes.pk.key
+
+        # primary key to feature id of the records on the layer
+        local_fids = self.indexes.pk.fids
+
+        conditions = [self.mdb_subset]
+        params = []
+        if timestamp_column:
+            ts_index = field_names.index(timestamp_column)
+            newest = provider.maximumValue(ts_index)
+            if newest is not None and not isinstance(newest, QPyNullVariant):
+                conditions.append("{} > ?".format(quote(timestamp_column)))
+                params.append(to_db(newest))
+        sql = select_sql(self.mdb_table, self.select_list, conditions)
+
+        added, changed, moved, seen = [], {}, {}, set()
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(sql, params)
+            convert_rows = row_converter(cur.description)
+            while True:
+                rows = cur.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                features = features_from_rows(convert_rows(rows), self.xy_indexes)
+                by_fid = {}
+                for feature in features:
+                    pk = get_pk(feature.attributes())
+                    seen.add(pk)
+                    if pk in local_fids:
+                        by_fid[local_fids[pk]] = feature
+                    else:
+                        added.append(feature)
 
-        iface.messageBar().clearWidgets()
-        iface.messageBar().pushMessage("Ready", "{} records added to {}".format(str(self.record_count), self.lyr.name())
-                                       , level=QgsMessageBar.INFO)
+                # compare with the records on the layer, a batch at a time
+                request = QgsFeatureRequest().setFilterFids(list(by_fid)).setFlags(QgsFeatureRequest.NoGeometry)
+                for local in provider.getFeatures(request) if by_fid else []:
+                    new_attributes = by_fid[local.id()].attributes()
+                    differences = dict((i, value) for i, (old, value) in
+                                       enumerate(zip(local.attributes(), new_attributes))
+                                       if to_db(old) != to_db(value))
+                    if differences:
+                        changed[local.id()] = differences
+                        if self.xy_indexes and set(self.xy_indexes) & set(differences):
+                            moved[local.id()] = QgsGeometry(by_fid[local.id()].geometry() or QgsGeometry())
+
+            # with a timestamp column only changed records were fetched: get all keys to find deleted ones
+            if timestamp_column:
+                cur.execute(select_sql(self.mdb_table, select_list(self.pk_cols), [self.mdb_subset]))
+                seen = set(tuple(row) for row in cur.fetchall())
+            cur.close()
+
+        # records added without reading back their key are on the layer twice now, once with their key
+        deleted = [fid for pk, fid in local_fids.items() if pk not in seen] + list(self.indexes.pk.keyless)
+
+        if changed:
+            provider.changeAttributeValues(changed)
+            self.indexes.changed(changed)
+        if moved:
+            provider.changeGeometryValues(moved)
+        if deleted:
+            provider.deleteFeatures(deleted)
+            self.indexes.removed(deleted)
+        if added:
+            self.index_added(provider.addFeatures(added)[1])
+        self.lyr.triggerRepaint()
+
+        message = "{}: {} records added, {} changed, {} deleted".format(self.lyr.name(), len(added),
+                                                                        len(changed), len(deleted))
+        logger(message)
+        if self.show_progress:
+            message_bar().pushInfo("Refreshed", message)
+        return len(added), len(changed), len(deleted)
 
     def before_commit(self):
         """" Just before a definitive commit (update to the memory layer) try
-         updating the database"""
-        # fixme: implement rollback on db fail
-
-        # Update attribute values
-        # ---------------------------------------------------------------------
-        # changes: { fid: {pk1: value, pk2: value, etc}}
-        changes = self.lyr.editBuffer().changedAttributeValues()
-        field_names = [field.name() for field in self.lyr.pendingFields()]
-        row_count = 0
-
-        for fid, attributes in changes.iteritems():
-            feature = self.lyr.dataProvider().getFeatures(QgsFeatureRequest(fid)).next()
-            fields = [field_names[att_id] + " = (?)" for att_id in attributes]
-            params = tuple(attributes.values())
-
-            # assemble SQL query
-            where_clause, params = self.get_where_clause(feature, params)
-            sql = "UPDATE {} SET {}".format(self.mdb_table, ", ".join(fields))
-            sql += where_clause
-
-            logger(sql + " : " + str(params))
-            self.cur.execute(sql, params)
-            row_count += self.cur.rowcount
-
-        self.cur.commit()
-        logger("changed:  " + str(row_count))
-
-        # Delete features: 'DELETE * FROM spoor WHERE pk = id
-        # ---------------------------------------------------------------------
-        row_count = 0
-        fids = self.lyr.editBuffer().deletedFeatureIds()
-        for feature in self.lyr.dataProvider().getFeatures(QgsFeatureRequest().setFilterFids(fids)):
-
-            where_clause, params = self.get_where_clause(feature)
-
-            # assemble SQL query
-            sql = "DELETE * FROM {}".format(self.mdb_table)
-            sql += where_clause
-
-            logger(sql + " : " + str(params))
-            self.cur.execute(sql, params)
-            row_count += self.cur.rowcount
-
-        self.cur.commit()
-        logger("deleted:  " + str(row_count))
-
-        # Add features
-        # ---------------------------------------------------------------------
-        # fixme: implement
-
-    def get_where_clause(self, feature, params=()):
-        """ Return where_clause with pk fields and updated params"""
-        where_clause = []
-        for pk in self.pk_cols:
-            params += (feature[pk],)
-            where_clause.append(pk + " = (?)")
-
-        where_clause = " WHERE " + " AND ".join(where_clause)
-        return where_clause, params
-
-    def setup_progressbar(self, message, maximum):
-        if not SHOW_PROGRESSBAR: return
-
-        progress_message_bar = iface.messageBar().createMessage(message)
+         updating the database. All changes are written in one transaction: if one fails, none are written"""
+        timings = Timings()
+        with timings.phase('collect'):
+            changes = self.collect_changes()
+        if self.keyless_edits:
+            self.keep_edits("{} edited records were added without reading back their primary key. Save the other "
+                            "edits and refresh the layer to edit them".format(len(self.keyless_edits)))
+            return
+        if not len(changes):
+            return
+        timings.count('updates', len(changes.updates))
+        timings.count('deletes', len(changes.deletes))
+        timings.count('inserts', len(changes.inserts))
+
+        if self.write_behind:
+            field_names = [field.name() for field in self.lyr.dataProvider().fields()]
+            try:
+                with timings.phase('journal'):
+                    entry_id = write_behind().add(self.mdb_path, self.mdb_table, self.pk_cols, field_names, changes)
+            except Exception as e:
+                logger("Adding changes to the journal failed, nothing was saved. Error: {}".format(e))
+                self.keep_edits("Changes were not saved to the database. Error: {}".format(e))
+                return
+            self.timings['commit'] = timings.as_dict()
+            logger("{}: commit {} in the journal {}".format(self.mdb_table, entry_id, timings.report()))
+            return
+
+        conflicts = {}
+        inserted = []
+        field_names = [field.name() for field in self.lyr.dataProvider().fields()]
+        try:
+            with timings.phase('connect'):
+                conn = self.pool.acquire()
+            try:
+                cur = conn.cursor()
+                if changes.originals:
+                    with timings.phase('check'):
+                        conflicts = self.writer.find_conflicts(cur, changes, field_names)
+                    changes = changes.without(conflicts)
+                with timings.phase('write'):
+                    # rows changed after the check aren't written either, apply adds them to the conflicts
+                    counts = self.writer.apply(cur, changes, conflicts, field_names, inserted) if len(changes) else {}
+            finally:
+                self.pool.release(conn)
+        except Exception as e:
+            logger("Writing changes failed, nothing was written to the database. Error: {}".format(e))
+            self.keep_edits("Changes were not saved to the database. Error: {}".format(e))
+            return
+
+        self.inserted_keys = inserted
+        for sql, count in counts.items():
+            logger("{} : {} rows".format(sql, count))
+        timings.count('statements', len(counts))
+        timings.count('rows', sum(counts.values()))
+        timings.count('conflicts', len(conflicts))
+        self.timings['commit'] = timings.as_dict()
+        logger("{}: commit {}".format(self.mdb_table, timings.report()))
+        if conflicts:
+            self.report_conflicts(conflicts)
+
+    def keep_edits(self, message):
+        """ Stop a commit that couldn't be saved to the database from changing the memory layer, and keep the edits
+
+        A beforeCommitChanges slot can't cancel the commit, so the edit buffer is emptied: the memory layer commit
+        then has nothing to save. Once it's done, the edits are put in the edit buffer again, to save or discard.
+        """
+        edit_buffer = self.lyr.editBuffer()
+        self.kept_edits = (dict((fid, dict(attributes)) for fid, attributes in
+                                edit_buffer.changedAttributeValues().iteritems()),
+                           dict((fid, QgsGeometry(geometry)) for fid, geometry in
+                                edit_buffer.changedGeometries().iteritems()),
+                           [QgsFeature(feature) for feature in edit_buffer.addedFeatures().itervalues()],
+                           list(edit_buffer.deletedFeatureIds()))
+        edit_buffer.rollBack()
+        self.commit_pks = {}
+        self.inserted_keys = []
+        self.error = message + ". The edits are kept on the layer"
+        if message_bar() is not None:
+            message_bar().pushCritical("MDB Layer", self.error)
+        QTimer.singleShot(0, self.restore_edits)
+
+    def restore_edits(self):
+        """ Put the edits kept by keep_edits back in the edit buffer, after the commit is done """
+        if self.kept_edits is None:
+            return
+        changed, moved, added, deleted = self.kept_edits
+        self.kept_edits = None
+        if not self.lyr.isEditable():
+            self.lyr.startEditing()
+        self.lyr.beginEditCommand("Edits that were not saved")
+        for fid in deleted:
+            self.lyr.deleteFeature(fid)
+        for fid, attributes in changed.items():
+            for i, value in attributes.items():
+                self.lyr.changeAttributeValue(fid, i, value)
+        for fid, geometry in moved.items():
+            self.lyr.changeGeometry(fid, geometry)
+        self.lyr.addFeatures(added, False)
+        self.lyr.endEditCommand()
+        self.lyr.triggerRepaint()
+
+    def report_conflicts(self, conflicts):
+        """ Tell about all records that weren't saved because they were changed by someone else, and keep
+        their current values to put on the layer once the commit is done
+
+        :param conflicts: {pk values: {column: current value}, or None if the record was deleted}.
+        :type conflicts: dict
+        """
+        fids = dict((pk, fid) for fid, pk in self.commit_pks.items())
+        for pk in conflicts:
+            fid = self.indexes.fid(pk)
+            if fid is not None:
+                fids[pk] = fid
+        self.conflicts = [(fids[pk], values) for pk, values in conflicts.items() if pk in fids]
+        for pk, values in conflicts.items():
+            logger("{}: record {} was {} by someone else, its edits were not saved".format(
+                self.mdb_table, pk, "deleted" if values is None else "changed"))
+        keys = ", ".join("/".join("{}".format(value) for value in pk) for pk in sorted(conflicts)[:MAX_CONFLICTS_SHOWN])
+        if len(conflicts) > MAX_CONFLICTS_SHOWN:
+            keys += ", ..."
+        self.error = ("{} records were changed by someone else since they were loaded. Their edits were not saved, "
+                      "the layer shows their current values: {}".format(len(conflicts), keys))
+        if message_bar() is not None:
+            message_bar().pushWarning("MDB Layer", self.error)
+
+    def apply_conflicts(self):
+        """ Put the current database values of conflicting records on the layer, replacing the edits that
+        were committed to the memory layer but not to the database """
+        if not self.conflicts:
+            return
+        provider = self.lyr.dataProvider()
+        field_names = [field.name() for field in provider.fields()]
+        existing = set(feature.id() for feature in provider.getFeatures(
+            QgsFeatureRequest().setFilterFids([fid for fid, _ in self.conflicts])
+            .setFlags(QgsFeatureRequest.NoGeometry).setSubsetOfAttributes([])))
+
+        changed, deleted, added = {}, [], []
+        for fid, values in self.conflicts:
+            row = None if values is None else [to_attribute(values.get(name)) for name in field_names]
+            if row is None:
+                if fid in existing:
+                    deleted.append(fid)
+            elif fid in existing:
+                changed[fid] = dict(enumerate(row))
+            else:
+                added.append(row)
+        self.conflicts = []
+
+        if changed:
+            provider.changeAttributeValues(changed)
+            self.indexes.changed(changed)
+            if self.xy_indexes:
+                x_index, y_index = self.xy_indexes
+                provider.changeGeometryValues(dict(
+                    (fid, point_geometry(row[x_index], row[y_index]) or QgsGeometry())
+                    for fid, row in changed.items()))
+        if deleted:
+            provider.deleteFeatures(deleted)
+            self.indexes.removed(deleted)
+        if added:
+            self.index_added(provider.addFeatures(features_from_rows(added, self.xy_indexes))[1])
+        self.lyr.triggerRepaint()
+
+    def written_behind(self, entry_id, mdb_path, table, conflicts):
+        """ A commit in the journal was written to the database; put conflicting records back as they are there,
+        right away or, during an edit session, when it stops """
+        if (mdb_path, table) != (self.mdb_path, self.mdb_table):
+            return
+        logger("{}: commit {} written to the database".format(self.mdb_table, entry_id))
+        if conflicts:
+            self.report_conflicts(conflicts)
+            if not self.lyr.isEditable():
+                self.apply_conflicts()
+
+    def write_behind_failed(self, entry_id, mdb_path, table, message):
+        if (mdb_path, table) == (self.mdb_path, self.mdb_table):
+            self.error = "Changes could not be written to the database, they stay in the journal. Error: {}".format(
+                message)
+
+    def index_added(self, features):
+        self.indexes.added([feature.id() for feature in features], [feature.attributes() for feature in features])
+
+    def committed_features_added(self, layer_id, features):
+        # the features come in the order of the inserts, see collect_changes; give them the keys they got
+        keys, self.inserted_keys = self.inserted_keys, []
+        if len(keys) == len(features):
+            provider = self.lyr.dataProvider()
+            positions = [provider.fieldNameIndex(pk) for pk in self.pk_cols]
+            generated = {}
+            for feature, key in zip(features, keys):
+                values = dict((i, value) for i, value in zip(positions, key or ())
+                              if value is not None and to_db(feature.attributes()[i]) is None)
+                for i, value in values.items():
+                    feature.setAttribute(i, value)
+                if values:
+                    generated[feature.id()] = values
+            if generated:
+                provider.changeAttributeValues(generated)
+        self.index_added(features)
+
+    def committed_features_removed(self, layer_id, fids):
+        self.indexes.removed(fids)
+
+    def committed_attribute_values(self, layer_id, changes):
+        self.indexes.changed(changes)
+
+    def feature_id(self, pk_values):
+        """ Return the feature id of the record with these primary key values, None if it's not on the layer
+
+        :param pk_values: Values of the primary key columns, in the order of pk_cols.
+        :type pk_values: tuple
+        """
+        return self.indexes.fid(pk_values)
+
+    def lookup(self, column, value):
+        """ Return the ids of the features with a value in a column. Indexed columns and a primary key of one
+        column are looked up in their index, other columns are scanned """
+        fids = self.indexes.lookup(column, value)
+        if fids is not None:
+            return fids
+        provider = self.lyr.dataProvider()
+        index = provider.fieldNameIndex(column)
+        if index < 0:
+            return []
+        request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry).setSubsetOfAttributes([index])
+        return [feature.id() for feature in provider.getFeatures(request) if to_db(feature.attributes()[index]) == value]
+
+    def collect_changes(self):
+        """ Return a ChangeSet with the updated, deleted and added features in the edit buffer """
+        edit_buffer = self.lyr.editBuffer()
+        fields = self.lyr.pendingFields()
+        field_names = dict((i, fields[i].name()) for i in range(fields.count())
+                           if fields.fieldOrigin(i) == QgsFields.OriginProvider and not is_binary_field(fields[i]))
+        changed = edit_buffer.changedAttributeValues()
+        deleted = edit_buffer.deletedFeatureIds()
+        moved = dict((fid, geometry) for fid, geometry in edit_buffer.changedGeometries().iteritems()
+                     if fid not in deleted) if self.xy_indexes else {}
+
+        # the primary keys of changed and deleted features come from the index, their loaded values from the
+        # memory layer itself, which still has them until the commit is done
+        fids = set(changed) | set(deleted) | set(moved)
+        originals = self.original_values(fids) if self.check_conflicts or self.indexes.pk is None else {}
+        if self.indexes.pk is not None:
+            pk_values = dict((fid, self.indexes.pk_values(fid)) for fid in fids if fid in self.indexes.pk.keys)
+        else:
+            pk_values = dict((fid, tuple(values.get(pk) for pk in self.pk_cols)) for fid, values in originals.items()
+                             if None not in [values.get(pk) for pk in self.pk_cols])
+        self.commit_pks = pk_values
+        # records added while writing behind have no key until the layer is refreshed, their edits can't be saved
+        self.keyless_edits = sorted(fid for fid in fids if fid not in pk_values)
+
+        changes = ChangeSet()
+        for fid, attributes in changed.iteritems():
+            if fid in pk_values and fid not in deleted:
+                changes.updates.append((pk_values[fid], dict((field_names[i], to_db(value))
+                                                             for i, value in attributes.iteritems()
+                                                             if i in field_names)))
+        changes.deletes = [pk_values[fid] for fid in deleted if fid in pk_values]
+
+        # moved points are written to the coordinate columns
+        if self.xy_indexes:
+            updates = dict((pk, values) for pk, values in changes.updates)
+            for fid, pk in pk_values.items():
+                if fid not in moved:
+                    continue
+                if pk not in updates:
+                    updates[pk] = {}
+                    changes.updates.append((pk, updates[pk]))
+                updates[pk].update(self.coordinate_values(moved[fid]))
+
+        # updated records are checked on the columns they change, deleted records on all columns
+        if self.check_conflicts:
+            checked = set(self.checked_columns)
+            by_pk = dict((pk, originals[fid]) for fid, pk in pk_values.items() if fid in originals)
+            for pk, values in changes.updates:
+                changes.originals[pk] = dict((column, by_pk[pk][column]) for column in values if column in checked)
+            for pk in changes.deletes:
+                changes.originals[pk] = dict((column, by_pk[pk][column]) for column in self.checked_columns)
+
+        # added features, in the order the memory layer adds them; columns left empty get their default value (or
+        # autonumber) in the database
+        for fid, feature in sorted(edit_buffer.addedFeatures().items()):
+            values = dict((field_names[i], to_db(value)) for i, value in enumerate(feature.attributes())
+                          if i in field_names)
+            if self.xy_indexes and feature.geometry() is not None:
+                values.update(self.coordinate_values(feature.geometry()))
+            changes.inserts.append(dict((name, value) for name, value in values.items() if value is not None))
+        return changes
+
+    def coordinate_values(self, geometry):
+        """ Return {x column: x, y column: y} for a point geometry, or NULLs for an empty geometry """
+        if geometry is None or geometry.isEmpty():
+            return {self.x_column: None, self.y_column: None}
+        point = geometry.asPoint()
+        return {self.x_column: point.x(), self.y_column: point.y()}
+
+    def original_values(self, fids):
+        """ Return {fid: {column: database value}} for the features as they are stored in the memory layer """
+        if not fids:
+            return {}
+        provider = self.lyr.dataProvider()
+        field_names = [field.name() for field in provider.fields()]
+        request = QgsFeatureRequest().setFilterFids(list(fids)).setFlags(QgsFeatureRequest.NoGeometry)
+        return dict((feature.id(), dict(zip(field_names, [to_db(value) for value in feature.attributes()])))
+                    for feature in provider.getFeatures(request))
+
+    def setup_progressbar(self, message, maximum, cancel_callback=None):
+        if not self.show_progress: return
+
+        from PyQt4.QtGui import QProgressBar, QPushButton
+        progress_message_bar = message_bar().createMessage(message)
         self.progress = QProgressBar()
         self.progress.setMaximum(maximum)
         self.progress.setAlignment(Qt.AlignLeft | Qt.AlignVCenter)
         progress_message_bar.layout().addWidget(self.progress)
-        iface.messageBar().pushWidget(progress_message_bar, iface.messageBar().INFO)
+        if cancel_callback is not None:
+            cancel_button = QPushButton("Cancel")
+            cancel_button.clicked.connect(cancel_callback)
+            progress_message_bar.layout().addWidget(cancel_button)
+        message_bar().pushWidget(progress_message_bar, message_bar().INFO)
 
     def update_progressbar(self, progress):
-        if SHOW_PROGRESSBAR:
-            self.progress.setValue(progress)
\ No newline at end of file
+        if not self.show_progress: return
+
+        # an estimated count can be too low, the bar then just shows activity
+        if progress > self.progress.maximum() > 0:
+            self.progress.setMaximum(0)
+        self.progress.setValue(progress)
+
+    def finish_progressbar(self, message):
+        if not self.show_progress: return
+
+        message_bar().clearWidgets()
+        message_bar().pushInfo("Ready", message)
+
+
+def keyset_condition(pk_cols):
+    """ Return the condition selecting the rows after a primary key value, for keyset pagination.
+    For pk columns a, b that is (a > ?) OR (a = ? AND b > ?), see keyset_params """
+    conditions = []
+    for i in range(len(pk_cols)):
+        parts = ["{} = ?".format(quote(pk)) for pk in pk_cols[:i]] + ["{} > ?".format(quote(pk_cols[i]))]
+        conditions.append("(" + " AND ".join(parts) + ")")
+    return " OR ".join(conditions)
+
+
+def keyset_params(key):
+    """ Return the parameters of keyset_condition for the primary key values of the last row before a page """
+    params = []
+    for i in range(len(key)):
+        params.extend(key[:i + 1])
+    return params
+
+
+def find_layer(name):
+    """ Return the MdbLayer of an open layer by layer name or id, None if there is none """
+    return next((layer for layer in open_layers.values() if name in (layer.lyr.id(), layer.lyr.name())), None)
+
+
+@qgsfunction(4, 'MS Access')
+def mdb_lookup(values, feature, parent):
+    """ <h4>mdb_lookup(layer, column, value, result column)</h4>
+    Returns the value of result column of the first record with value in column, on an MS Access layer
+    (by layer name or id). Uses the primary key and column indexes of the layer, so it stays fast on big tables.
+    <p>mdb_lookup('mdb_Parcels', 'ParcelId', "parcel_id", 'Owner')</p> """
+    name, column, value, result_column = values
+    layer = find_layer(name)
+    if layer is None:
+        parent.setEvalErrorString("No MS Access layer '{}'".format(name))
+        return None
+    fids = layer.lookup(column, to_db(value))
+    if not fids:
+        return None
+    provider = layer.lyr.dataProvider()
+    index = provider.fieldNameIndex(result_column)
+    if index < 0:
+        parent.setEvalErrorString("Column '{}' is not on layer '{}'".format(result_column, name))
+        return None
+    request = QgsFeatureRequest(min(fids)).setFlags(QgsFeatureRequest.NoGeometry).setSubsetOfAttributes([index])
+    for found in provider.getFeatures(request):
+        return found.attributes()[index]
+    return None
+
+
+@qgsfunction(2, 'MS Access')
+def mdb_large_value(values, feature, parent):
+    """ <h4>mdb_large_value(layer, column)</h4>
+    Returns the value of a memo or OLE object column of the feature on an MS Access layer (by layer name or id).
+    These columns aren't loaded with the layer; their values are read from the database when asked for.
+    <p>mdb_large_value('mdb_Parcels', 'Remarks')</p> """
+    name, column = values
+    layer = find_layer(name)
+    if layer is None:
+        parent.setEvalErrorString("No MS Access layer '{}'".format(name))
+        return None
+    try:
+        return layer.large_value(feature.id(), column)
+    except Exception as e:
+        parent.setEvalErrorString("{}".format(e))
+        return None
@@ -21,19 +21,31 @@
  ***************************************************************************/
 """
 from contextlib import contextmanager
-from mdb_layer import MdbLayer
+from mdb_layer import MdbLayer, open_layers
+from mdb_batch import MdbBatchImport
+from mdb_federated import MdbFederatedLayer
+from mdb_cache import MdbCache
+from mdb_connection import get_pool, close_all, column_names, quote, DEFAULT_BACKEND
+from mdb_export import MdbExportWorker
+from mdb_catalog import MdbCatalogWorker, load_catalog, read_catalog
+from mdb_worker import start_worker
+from mdb_journal import write_behind
 from PyQt4.QtCore import Qt, QSettings, QTranslator, qVersion, QCoreApplication
-from PyQt4.QtGui import QApplication, QCursor, QAction, QIcon, QFileDialog
-from qgis.core import QgsMessageLog, QgsProject
+from PyQt4.QtGui import QApplication, QCursor, QAction, QIcon, QFileDialog, QProgressBar, QPushButton
+from qgis.core import QgsMessageLog, QgsProject, QgsExpression
+from qgis.gui import QgsMessageBar
 
 # Initialize Qt resources from file resources.py
-import resources, pyodbc
+import resources
 # Import the code for the dialog
 from mdb_loader_select_table import MdbLoaderSelectTable
 import os.path
 
 logger = lambda msg: QgsMessageLog.logMessage(msg, 'Mdb Loader', 1)
 
+PAGED_FROM = 500000     # tables known to have more records are opened paged
+PAGE_SIZE = 10000
+
 
 class MdbLoader:
     """QGIS Plugin Implementation."""
@@ -69,6 +81,10 @@ class MdbLoader:
         self.menu = self.tr(u'&Mdb Loader')
         self.toolbar = self.iface.addToolBar(u'MdbLoader')
         self.toolbar.setObjectName(u'MdbLoader')
+        self.catalog = None
+        self.catalog_workers = {}       # database path: (worker, thread) reading its catalog
+        self.journal_message_item = None
+        self.journal_failed = 0
 
     # noinspection PyMethodMayBeStatic
     def tr(self, message):
@@ -170,6 +186,55 @@ class MdbLoader:
             text=self.tr(u'Open MS Access Table'),
             callback=self.run,
             parent=self.iface.mainWindow())
+        self.add_action(
+            icon_path,
+            text=self.tr(u'Open MS Access Table From Several Databases'),
+            callback=self.run_federated,
+            add_to_toolbar=False,
+            parent=self.iface.mainWindow())
+        self.add_action(
+            icon_path,
+            text=self.tr(u'Export MS Access Tables'),
+            callback=self.export,
+            add_to_toolbar=False,
+            parent=self.iface.mainWindow())
+        self.add_action(
+            icon_path,
+            text=self.tr(u'Load More MS Access Records'),
+            callback=self.load_more,
+            add_to_toolbar=False,
+            parent=self.iface.mainWindow())
+        self.add_action(
+            icon_path,
+            text=self.tr(u'Refresh MS Access Layer'),
+            callback=self.refresh_layer,
+            add_to_toolbar=False,
+            parent=self.iface.mainWindow())
+        self.add_action(
+            icon_path,
+            text=self.tr(u'Clear MS Access Table Cache'),
+            callback=self.clear_cache,
+            add_to_toolbar=False,
+            parent=self.iface.mainWindow())
+
+        # the same work, without dialogs, for scripts, models and batch runs
+        try:
+            from processing.core.Processing import Processing
+            from mdb_processing import MdbAlgorithmProvider
+        except ImportError as e:
+            logger("Processing algorithms not available. Error: {}".format(e))
+            self.provider = None
+        else:
+            self.provider = MdbAlgorithmProvider()
+            Processing.addProvider(self.provider)
+
+        # write what is left in the journal from the last session
+        try:
+            write_behind().state_changed.connect(self.journal_state)
+            write_behind().progress.connect(self.journal_progress)
+            write_behind().start()
+        except Exception as e:
+            logger("Couldn't open the journal. Error: {}".format(e))
 
     def unload(self):
         """Removes the plugin menu item and icon from QGIS GUI."""
@@ -180,58 +245,267 @@ class MdbLoader:
             self.iface.removeToolBarIcon(action)
         # remove the toolbar
         del self.toolbar
+        if self.provider is not None:
+            from processing.core.Processing import Processing
+            Processing.removeProvider(self.provider)
+        # the expression functions are registered when mdb_layer is imported
+        QgsExpression.unregisterFunction('mdb_lookup')
+        QgsExpression.unregisterFunction('mdb_large_value')
+        # commits that aren't written yet stay in the journal for the next session
+        try:
+            write_behind().state_changed.disconnect(self.journal_state)
+            write_behind().progress.disconnect(self.journal_progress)
+            write_behind().stop()
+        except Exception as e:
+            logger("Couldn't stop writing the journal. Error: {}".format(e))
+        # close all database connections
+        close_all()
 
     def run(self):
         """Run method that performs all the real work"""
-        mdb_file = QFileDialog.getOpenFileName(None, "Select database file",
+        mdb_file = self.select_tables()
+        if mdb_file is None:
+            return
+
+        selected_tables = self.dlg.selected_tables()
+        if len(selected_tables) > 1:
+            self.batch = MdbBatchImport(mdb_file, selected_tables,
+                                        page_sizes=dict((table, self.page_size(table)) for table in selected_tables),
+                                        backend=get_backend(), write_behind=get_write_behind())
+            return
+
+        selected_table = self.dlg.selected_table()
+        if selected_table is None:
+            return
+        columns = self.dlg.selected_columns()
+        if columns == []:
+            self.iface.messageBar().pushWarning("MDB Loader", "No columns selected")
+            return
+        mdb_columns = ", ".join(quote(column) for column in columns) if columns else '*'
+
+        self.mdblayer = MdbLayer(mdb_file, selected_table, mdb_columns=mdb_columns,
+                                 mdb_subset=self.dlg.filter(), page_size=self.page_size(selected_table),
+                                 backend=get_backend(), write_behind=get_write_behind())
+
+    def page_size(self, table):
+        """ Return the page size to open a table with, None to load all of its records """
+        # browse huge tables a page at a time
+        return PAGE_SIZE if self.catalog.row_counts.get(table, 0) > PAGED_FROM else None
+
+    def run_federated(self):
+        """Load one table from several databases with the same schema into one layer"""
+        mdb_files = QFileDialog.getOpenFileNames(None, "Select database files",
                 get_default_path(), 'Ms Access Database (*.mdb *.accdb)')
-        if not mdb_file: return
+        if not mdb_files:
+            return
+        # the table and columns are chosen from the first database
+        if self.select_tables(mdb_files[0]) is None:
+            return
+        selected_table = self.dlg.selected_table()
+        if selected_table is None:
+            return
+        columns = self.dlg.selected_columns()
+        if columns == []:
+            self.iface.messageBar().pushWarning("MDB Loader", "No columns selected")
+            return
+        mdb_columns = ", ".join(quote(column) for column in columns) if columns else '*'
+        self.mdblayer = MdbFederatedLayer(list(mdb_files), selected_table, mdb_columns=mdb_columns,
+                                          mdb_subset=self.dlg.filter(), backend=get_backend())
+
+    def select_tables(self, mdb_file=None):
+        """Ask for a database, unless it is given, and let the user select tables in the dialog
+
+        :returns: The path of the database, or None if the user cancelled.
+        :rtype: str
+        """
+        if mdb_file is None:
+            mdb_file = QFileDialog.getOpenFileName(None, "Select database file",
+                    get_default_path(), 'Ms Access Database (*.mdb *.accdb)')
+        if not mdb_file: return None
 
         # store path; check if file exists
         set_default_path(mdb_file)
         if not os.path.isfile(mdb_file):
             self.iface.messageBar().pushError("MDB Loader", "File not found")
+            return None
+
+        # get tables and queries from the stored catalog, or else from the database
+        # the connection stays in the pool for the layer that is opened next
+        pool = get_pool(mdb_file, get_backend())
+        self.catalog = load_catalog(mdb_file)
+        if self.catalog is None:
+            try:
+                with wait_cursor(), pool.connection() as conn:
+                    self.catalog = read_catalog(conn.cursor(), mdb_file, tables_only=True)
+            except Exception as e:
+                self.iface.messageBar().pushWarning("MDB Loader", "Couldn't connect. Error: {}".format(e))
+                return None
+        if not self.catalog.tables:
+            self.iface.messageBar().pushWarning("MDB Loader", "No tables or queries were found")
+            return None
+
+        # show the dialog, while the complete catalog is read in the background
+        self.dlg.tableListWidget.clear()
+        self.dlg.queryListWidget.clear()
+        self.dlg.filterLineEdit.clear()
+        self.dlg.column_loader = lambda table: self.get_column_names(pool, table)
+        self.dlg.set_tables(self.catalog.tables, self.catalog.row_counts)
+        self.refresh_catalog(pool, mdb_file)
+        self.dlg.show()
+
+        # run the dialog event loop / see if OK was pressed
+        result = self.dlg.exec_()
+        return mdb_file if result else None
+
+    def refresh_catalog(self, pool, mdb_file):
+        """Read the catalog of a database on a worker thread, and update the dialog when it's done"""
+        if mdb_file in self.catalog_workers:
+            return          # still reading this catalog
+        worker = MdbCatalogWorker(pool, mdb_file)
+        worker.finished.connect(self.catalog_refreshed)
+        self.catalog_workers[mdb_file] = (worker, start_worker(worker))
+
+    def catalog_refreshed(self, mdb_file, catalog):
+        self.catalog_workers.pop(mdb_file, None)
+        if catalog is None or self.catalog is None or mdb_file != self.catalog.mdb_path:
             return
+        changed = (catalog.tables, catalog.row_counts) != (self.catalog.tables, self.catalog.row_counts)
+        self.catalog = catalog
+        if changed and self.dlg.isVisible():
+            self.dlg.set_tables(catalog.tables, catalog.row_counts)
+
+    def export(self):
+        """Write the selected tables to a GeoPackage or to Parquet files, without loading them in layers"""
+        mdb_file = self.select_tables()
+        if mdb_file is None:
+            return
+        tables = self.dlg.selected_tables()
+        if not tables:
+            return
+        subsets = {tables[0]: self.dlg.filter()} if len(tables) == 1 else {}
 
-        # connect to the database, get tables and queries
-        constr = "DRIVER={Microsoft Access Driver (*.mdb, *.accdb)};FIL={MS Access};DBQ=" + mdb_file
+        output, file_filter = QFileDialog.getSaveFileNameAndFilter(
+            None, "Export to", os.path.splitext(mdb_file)[0] + '.gpkg',
+            'GeoPackage (*.gpkg);;Parquet, a folder with a file per table (*)')
+        if not output:
+            return
+        file_format = 'parquet' if file_filter.startswith('Parquet') else 'gpkg'
+
+        self.export_failure = None
+        self.export_worker = MdbExportWorker(mdb_file, tables, output, file_format, subsets=subsets,
+                                             backend=get_backend())
+        self.export_worker.progress.connect(self.export_progress)
+        self.export_worker.error.connect(self.export_error)
+        self.export_worker.finished.connect(self.export_finished)
+        self.setup_export_progressbar(len(tables))
+        self.export_thread = start_worker(self.export_worker)
+
+    def setup_export_progressbar(self, table_count):
+        message_bar_item = self.iface.messageBar().createMessage(
+            "Exporting {} tables...".format(table_count))
+        self.export_progress_bar = QProgressBar()
+        self.export_progress_bar.setMaximum(0)
+        self.export_progress_bar.setAlignment(Qt.AlignLeft | Qt.AlignVCenter)
+        message_bar_item.layout().addWidget(self.export_progress_bar)
+        cancel_button = QPushButton("Cancel")
+        cancel_button.clicked.connect(self.export_worker.kill)
+        message_bar_item.layout().addWidget(cancel_button)
+        self.export_message_item = message_bar_item
+        self.iface.messageBar().pushWidget(message_bar_item, QgsMessageBar.INFO)
+
+    def export_progress(self, table, count):
+        self.export_message_item.setText("Exporting {}: {} records...".format(table, count))
+
+    def export_error(self, message):
+        self.export_failure = message
+
+    def export_finished(self, count, cancelled):
+        self.export_worker = None
+        self.export_thread = None
+        self.iface.messageBar().clearWidgets()
+        if self.export_failure is not None:
+            self.iface.messageBar().pushCritical("MDB Loader", "Export failed after {} records. Error: {}"
+                                                 .format(count, self.export_failure))
+            return
+        message = "{} records exported".format(count)
+        if cancelled:
+            message = "Export cancelled, " + message
+        self.iface.messageBar().pushMessage("Ready", message, level=QgsMessageBar.INFO)
+
+    def journal_state(self, pending, failed):
+        """ Show the commits waiting to be written, and a way to retry the ones that failed """
+        if self.journal_message_item is not None:
+            try:
+                self.iface.messageBar().popWidget(self.journal_message_item)
+            except RuntimeError:
+                pass    # closed by the user
+            self.journal_message_item = None
+        self.journal_failed = failed
+        if not pending and not failed:
+            return
+        if failed:
+            message_bar_item = self.iface.messageBar().createMessage(
+                "{} saved edits could not be written to MS Access, {} are waiting".format(failed, pending))
+            retry_button = QPushButton("Retry")
+            retry_button.clicked.connect(write_behind().retry_failed)
+            message_bar_item.layout().addWidget(retry_button)
+            level = QgsMessageBar.WARNING
+        else:
+            message_bar_item = self.iface.messageBar().createMessage(
+                "Writing {} saved edits to MS Access...".format(pending))
+            progress_bar = QProgressBar()
+            progress_bar.setMaximum(0)
+            progress_bar.setAlignment(Qt.AlignLeft | Qt.AlignVCenter)
+            message_bar_item.layout().addWidget(progress_bar)
+            level = QgsMessageBar.INFO
+        self.journal_message_item = message_bar_item
+        self.iface.messageBar().pushWidget(message_bar_item, level)
+
+    def journal_progress(self, written, total):
+        if self.journal_message_item is not None and not self.journal_failed:
+            try:
+                self.journal_message_item.setText("Writing saved edits to MS Access: {} of {}...".format(written, total))
+            except RuntimeError:
+                self.journal_message_item = None
+
+    def get_column_names(self, pool, table):
+        """Return the column names of a table for the dialog, or an empty list if they can't be read"""
+        names = self.catalog.column_names(table) if self.catalog is not None else None
+        if names is not None:
+            return names
         try:
-            conn = pyodbc.connect(constr, timeout=3)
-            cur = conn.cursor()
+            with wait_cursor(), pool.connection() as conn:
+                return column_names(conn.cursor(), table)
         except Exception as e:
-            self.iface.messageBar().pushWarning("MDB Loader", "Couldn't connect. Error: {}".format(e))
-            return
+            logger("Couldn't read the columns of {}. Error: {}".format(table, e))
+            return []
 
-        with wait_cursor():
-            tables = cur.tables(tableType="TABLE, VIEW").fetchall()
-            if not tables:
-                self.iface.messageBar().pushWarning("MDB Loader", "No tables or queries were found")
-                conn.close()
-                return
-            else:
-                self.dlg.tableListWidget.clear()
-                self.dlg.queryListWidget.clear()
-                for row in tables:
-                    if row.table_type == 'TABLE':
-                        self.dlg.tableListWidget.addItem(row.table_name)
-                    else:
-                        self.dlg.queryListWidget.addItem(row.table_name)
-                conn.close()
-
-        # show the dialog
-        self.dlg.tableListWidget.item(0).setSelected(True)
-        self.dlg.queryListWidget.item(0).setSelected(True)
-        self.dlg.show()
 
-        # run the dialog event loop / see if OK was pressed
-        result = self.dlg.exec_()
-        if result:
-            if self.dlg.tabWidget.currentIndex() == 0:
-                selected_table = self.dlg.tableListWidget.selectedItems()[0].text()
-            else:
-                selected_table = self.dlg.queryListWidget.selectedItems()[0].text()
+    def refresh_layer(self):
+        """Apply the changes in the database to the active layer, if it is a MS Access layer"""
+        layer = self.iface.activeLayer()
+        mdb_layer = open_layers.get(layer.id()) if layer is not None else None
+        if mdb_layer is None:
+            self.iface.messageBar().pushWarning("MDB Loader", "The active layer is not a MS Access layer")
+            return
+        with wait_cursor():
+            mdb_layer.refresh()
+
+    def load_more(self):
+        """Add the next page of records to the active layer, if it is a paged MS Access layer"""
+        layer = self.iface.activeLayer()
+        mdb_layer = open_layers.get(layer.id()) if layer is not None else None
+        if mdb_layer is None or not mdb_layer.paged:
+            self.iface.messageBar().pushWarning("MDB Loader", "The active layer is not a paged MS Access layer")
+            return
+        with wait_cursor():
+            if mdb_layer.load_more() == 0:
+                self.iface.messageBar().pushInfo("MDB Loader", "All records are loaded")
 
-            self.mdblayer = MdbLayer(mdb_file, selected_table)
+    def clear_cache(self):
+        """Remove all tables from the on-disk cache, forcing the next loads to read the databases"""
+        MdbCache().invalidate()
+        self.iface.messageBar().pushInfo("MDB Loader", "Cache cleared")
 
 
 def set_default_path(path):
@@ -249,6 +523,16 @@ def get_default_path():
     return path
 
 
+def get_backend():
+    """How databases are read: 'odbc', 'jet' (straight from the file) or 'auto', see mdb_connection"""
+    return QSettings().value("mdb_loader/backend", DEFAULT_BACKEND)
+
+
+def get_write_behind():
+    """Whether saving edits only puts them in the journal, see MdbLayer"""
+    return QSettings().value("mdb_loader/write_behind", False, type=bool)
+
+
 @contextmanager
 def wait_cursor():
     try:
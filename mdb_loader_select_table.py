@@ -24,6 +24,7 @@
 import os
 
 from PyQt4 import QtGui, uic
+from PyQt4.QtCore import Qt
 
 FORM_CLASS, _ = uic.loadUiType(os.path.join(
     os.path.dirname(__file__), 'mdb_loader_select_table.ui'))
@@ -39,3 +40,78 @@ class MdbLoaderSelectTable(QtGui.QDialog, FORM_CLASS):
         # http://qt-project.org/doc/qt-4.8/designer-using-a-ui-file.html
         # #widgets-and-dialogs-with-auto-connect
         self.setupUi(self)
+
+        # function returning the column names of a table, set by the plugin
+        self.column_loader = None
+        self.tableListWidget.setSelectionMode(QtGui.QAbstractItemView.ExtendedSelection)
+        self.queryListWidget.setSelectionMode(QtGui.QAbstractItemView.ExtendedSelection)
+        self.tableListWidget.itemSelectionChanged.connect(self.update_columns)
+        self.queryListWidget.itemSelectionChanged.connect(self.update_columns)
+        self.tabWidget.currentChanged.connect(self.update_columns)
+
+    def set_tables(self, tables, row_counts=None):
+        """List the tables and queries, keeping the selection of the ones that were already listed
+
+        :param tables: (name, 'TABLE' or 'VIEW') of every table and query.
+        :type tables: list
+
+        :param row_counts: Known number of records per table, shown as tooltip.
+        :type row_counts: dict
+        """
+        row_counts = row_counts or {}
+        for list_widget, table_type in ((self.tableListWidget, 'TABLE'), (self.queryListWidget, 'VIEW')):
+            selected = set(item.text() for item in list_widget.selectedItems())
+            list_widget.blockSignals(True)
+            list_widget.clear()
+            for name, item_type in tables:
+                if item_type != table_type:
+                    continue
+                item = QtGui.QListWidgetItem(name)
+                if name in row_counts:
+                    item.setToolTip("{} records".format(row_counts[name]))
+                list_widget.addItem(item)
+                item.setSelected(name in selected)
+            if not list_widget.selectedItems() and list_widget.count():
+                list_widget.item(0).setSelected(True)
+            list_widget.blockSignals(False)
+        self.update_columns()
+
+    def selected_tables(self):
+        """Return the names of the selected tables or queries on the current tab"""
+        if self.tabWidget.currentIndex() == 0:
+            items = self.tableListWidget.selectedItems()
+        else:
+            items = self.queryListWidget.selectedItems()
+        return [item.text() for item in items]
+
+    def selected_table(self):
+        """Return the name of the selected table or query if exactly one is selected, otherwise None"""
+        tables = self.selected_tables()
+        return tables[0] if len(tables) == 1 else None
+
+    def update_columns(self):
+        """List the columns of the selected table, all checked.
+        Columns and filter only apply to a single table, they are disabled when more are selected"""
+        self.columnListWidget.clear()
+        table = self.selected_table()
+        self.columnListWidget.setEnabled(table is not None)
+        self.filterLineEdit.setEnabled(table is not None)
+        if table is None or self.column_loader is None:
+            return
+        for name in self.column_loader(table):
+            item = QtGui.QListWidgetItem(name)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Checked)
+            self.columnListWidget.addItem(item)
+
+    def selected_columns(self):
+        """Return the checked column names, or None if all columns are checked"""
+        items = [self.columnListWidget.item(i) for i in range(self.columnListWidget.count())]
+        checked = [item.text() for item in items if item.checkState() == Qt.Checked]
+        if len(checked) == len(items):
+            return None
+        return checked
+
+    def filter(self):
+        """Return the WHERE condition entered by the user"""
+        return self.filterLineEdit.text().strip()
@@ -0,0 +1,162 @@
+from collections import OrderedDict
+from mdb_connection import quote
+
+LARGE_TEXT_SIZE = 255                   # text and binary columns that can hold more than this are large objects
+CACHE_MAX_BYTES = 64 * 1024 * 1024      # large values kept per layer
+FETCH_CHUNK_SIZE = 100                  # records whose large values are read with one query
+STREAM_CHUNK_SIZE = 1024 * 1024         # characters or bytes of a single value read with one query by chunks()
+
+
+def is_large_object(column):
+    """ Whether a column of a cursor description is a memo or OLE object (long binary) column """
+    python_type, size = column[1], column[3]
+    return python_type in (str, unicode, bytearray, buffer) and not 0 < (size or 0) <= LARGE_TEXT_SIZE
+
+
+def _size(value):
+    """ Approximate memory use of a cached value """
+    return 64 + (len(value) if value is not None else 0)
+
+
+class LargeObjectCache:
+    """ The most recently used large values, up to about max_bytes in total """
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.values = OrderedDict()     # key: value, least recently used first
+        self.nbytes = 0
+
+    def __contains__(self, key):
+        return key in self.values
+
+    def __len__(self):
+        return len(self.values)
+
+    def get(self, key):
+        """ Return a cached value, raises KeyError if it isn't there """
+        value = self.values.pop(key)
+        self.values[key] = value
+        return value
+
+    def put(self, key, value):
+        if key in self.values:
+            self.nbytes -= _size(self.values.pop(key))
+        if _size(value) > self.max_bytes:
+            return
+        self.values[key] = value
+        self.nbytes += _size(value)
+        while self.nbytes > self.max_bytes:
+            _, old = self.values.popitem(last=False)
+            self.nbytes -= _size(old)
+
+    def clear(self):
+        self.values = OrderedDict()
+        self.nbytes = 0
+
+
+class MdbLargeObjects:
+    """ The memo and OLE object values of a table, read by primary key when they are asked for
+
+    Values are read for chunk_size records per query and fetched one row at a time, so only the values that
+    were asked for are in memory: those in the cache, which drops the least recently used ones beyond max_bytes.
+    Values are database values, as pyodbc returns them. A single value too large to hold at once can be read
+    piece by piece with chunks().
+    """
+
+    def __init__(self, pool, table, pk_cols, columns, max_bytes=CACHE_MAX_BYTES, chunk_size=FETCH_CHUNK_SIZE,
+                 binary_columns=()):
+        """
+        :param pool: Connection pool of the database.
+        :type pool: ConnectionPool
+
+        :param columns: The large object columns.
+        :type columns: list
+
+        :param max_bytes: Size of the cache.
+        :type max_bytes: int
+
+        :param chunk_size: Number of records read with one query.
+        :type chunk_size: int
+
+        :param binary_columns: The columns of columns that are OLE objects, the others are memos.
+        :type binary_columns: list
+        """
+        self.pool = pool
+        self.table = table
+        self.pk_cols = list(pk_cols)
+        self.columns = list(columns)
+        self.binary_columns = set(binary_columns)
+        self.chunk_size = chunk_size
+        self.cache = LargeObjectCache(max_bytes)
+
+    def select_sql(self, column, count):
+        """ Return the query for the values of a column of count records, with their primary keys """
+        sql = "SELECT {}, {} FROM {} WHERE ".format(", ".join(quote(pk) for pk in self.pk_cols), quote(column),
+                                                    quote(self.table))
+        if len(self.pk_cols) == 1:
+            return sql + quote(self.pk_cols[0]) + " IN (" + ", ".join("?" * count) + ")"
+        condition = "(" + " AND ".join(quote(pk) + " = ?" for pk in self.pk_cols) + ")"
+        return sql + " OR ".join([condition] * count)
+
+    def get(self, pk_values, column):
+        """ Return the value of a column of one record, None if the record isn't there """
+        return self.get_many([pk_values], column).get(tuple(pk_values))
+
+    def get_many(self, keys, column):
+        """ Return {pk values: value} of a column for many records, from the cache or else from the database
+
+        :param keys: Primary key values of the records.
+        :type keys: list
+        """
+        found = {}
+        missing = []
+        for key in keys:
+            key = tuple(key)
+            if (column, key) in self.cache:
+                found[key] = self.cache.get((column, key))
+            elif key not in found:
+                found[key] = None       # until it's read, records that are gone stay None
+                missing.append(key)
+        if not missing:
+            return found
+
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            try:
+                for start in range(0, len(missing), self.chunk_size):
+                    chunk = missing[start:start + self.chunk_size]
+                    cur.execute(self.select_sql(column, len(chunk)), [value for key in chunk for value in key])
+                    for row in cur:
+                        key = tuple(row[:len(self.pk_cols)])
+                        value = row[len(self.pk_cols)]
+                        self.cache.put((column, key), value)
+                        found[key] = value
+            finally:
+                cur.close()
+        return found
+
+    def chunks(self, pk_values, column, chunk_size=STREAM_CHUNK_SIZE):
+        """ Yield the value of a column of one record in pieces of chunk_size characters (memo) or bytes (OLE
+        object), every one read with its own query, so the value is never in memory as a whole. The cache isn't
+        used. Yields nothing if the record isn't there or the value is NULL """
+        function = "MidB" if column in self.binary_columns else "Mid"
+        where = " AND ".join(quote(pk) + " = ?" for pk in self.pk_cols)
+        start = 1
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            try:
+                while True:
+                    cur.execute("SELECT {}({}, {}, {}) FROM {} WHERE {}".format(
+                        function, quote(column), start, chunk_size, quote(self.table), where), list(pk_values))
+                    row = cur.fetchone()
+                    if row is None or not row[0]:
+                        return
+                    yield row[0]
+                    if len(row[0]) < chunk_size:
+                        return
+                    start += chunk_size
+            finally:
+                cur.close()
+
+    def clear(self):
+        self.cache.clear()
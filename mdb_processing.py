@@ -0,0 +1,312 @@
+import os
+from PyQt4.QtGui import QIcon
+from qgis.core import QGis, QgsCoordinateReferenceSystem, QgsFeatureRequest, QgsMessageLog
+from processing.core.AlgorithmProvider import AlgorithmProvider
+from processing.core.GeoAlgorithm import GeoAlgorithm
+from processing.core.GeoAlgorithmExecutionException import GeoAlgorithmExecutionException
+from processing.core.parameters import (ParameterFile, ParameterString, ParameterBoolean, ParameterSelection,
+                                        ParameterVector, ParameterCrs)
+from processing.core.outputs import OutputVector, OutputFile
+from processing.tools import dataobjects, vector
+from mdb_federated import MdbFederatedLayer
+from mdb_reader import MdbTableReader
+from mdb_export import export_tables, FORMATS
+from mdb_connection import get_pool, quote, BACKENDS
+from mdb_writeback import MdbWriter, changes_from_rows
+from mdb_types import to_db, is_binary
+from mdb_lob import is_large_object
+
+
+logger = lambda msg: QgsMessageLog.logMessage(msg, 'Mdb Processing', 1)
+
+
+READERS = ['Automatic', 'ODBC', 'Straight from the file (read only, no filters)']     # in the order of BACKENDS
+DATABASE_EXTENSIONS = ('.mdb', '.accdb')
+MAX_CONFLICTS_SHOWN = 10    # primary keys of conflicting records listed in the log of the algorithm
+
+
+def is_cancelled(progress):
+    """ Processing in QGIS 2 can't cancel a running algorithm, newer progress objects can tell """
+    return getattr(progress, 'isCanceled', lambda: False)()
+
+
+def check_database(path):
+    """ Return why a path can't be used as database, None if it can. ParameterFile takes a single extension """
+    if path and os.path.splitext(path)[1].lower() not in DATABASE_EXTENSIONS:
+        return "The database must be a {} file".format(" or ".join(DATABASE_EXTENSIONS))
+    return None
+
+
+class MdbAlgorithmProvider(AlgorithmProvider):
+    """ The MS Access algorithms in the Processing toolbox """
+
+    def __init__(self):
+        AlgorithmProvider.__init__(self)
+        self.activate = True
+        self.alglist = [MdbLoadTableAlgorithm(), MdbLoadFederatedAlgorithm(), MdbExportTablesAlgorithm(),
+                        MdbWriteBackAlgorithm()]
+        for alg in self.alglist:
+            alg.provider = self
+
+    def getName(self):
+        return 'mdb'
+
+    def getDescription(self):
+        return 'MS Access'
+
+    def getIcon(self):
+        return QIcon(':/plugins/mdb_loader/mdb_database.png')
+
+    def _loadAlgorithms(self):
+        self.algs = self.alglist
+
+
+class MdbLoadTableAlgorithm(GeoAlgorithm):
+    """ Load a table or query into a vector layer """
+
+    DATABASE = 'DATABASE'
+    TABLE = 'TABLE'
+    COLUMNS = 'COLUMNS'
+    SUBSET = 'SUBSET'
+    X_COLUMN = 'X_COLUMN'
+    Y_COLUMN = 'Y_COLUMN'
+    CRS = 'CRS'
+    READER = 'READER'
+    OUTPUT = 'OUTPUT'
+
+    def defineCharacteristics(self):
+        self.name = 'Load Access table'
+        self.group = 'Import'
+        self.addParameter(ParameterFile(self.DATABASE, 'Database (.mdb or .accdb)'))
+        self.addParameter(ParameterString(self.TABLE, 'Table or query'))
+        self.addParameter(ParameterString(self.COLUMNS, 'Columns (comma separated)', default='*', optional=True))
+        self.addParameter(ParameterString(self.SUBSET, 'Filter (Access SQL condition)', default='', optional=True))
+        self.addParameter(ParameterString(self.X_COLUMN, 'X coordinate column', default='', optional=True))
+        self.addParameter(ParameterString(self.Y_COLUMN, 'Y coordinate column', default='', optional=True))
+        self.addParameter(ParameterCrs(self.CRS, 'Coordinate reference system', 'EPSG:4326'))
+        self.addParameter(ParameterSelection(self.READER, 'Read the database', READERS))
+        self.addOutput(OutputVector(self.OUTPUT, 'Table'))
+
+    def checkParameterValuesBeforeExecuting(self):
+        return check_database(self.getParameterValue(self.DATABASE))
+
+    def processAlgorithm(self, progress):
+        table = self.getParameterValue(self.TABLE)
+        progress.setInfo("Loading {}".format(table))
+        try:
+            reader = MdbTableReader(self.getParameterValue(self.DATABASE), table,
+                                    mdb_columns=self.getParameterValue(self.COLUMNS) or '*',
+                                    mdb_subset=self.getParameterValue(self.SUBSET) or '',
+                                    x_column=self.getParameterValue(self.X_COLUMN) or None,
+                                    y_column=self.getParameterValue(self.Y_COLUMN) or None,
+                                    backend=BACKENDS[self.getParameterValue(self.READER)])
+            with reader:
+                geometry_type = QGis.WKBPoint if reader.xy_indexes else QGis.WKBNoGeometry
+                writer = self.getOutputFromName(self.OUTPUT).getVectorWriter(
+                    reader.fields, geometry_type, QgsCoordinateReferenceSystem(self.getParameterValue(self.CRS)))
+                for features in reader.batches():
+                    for feature in features:
+                        writer.addFeature(feature)
+                    progress.setText("{} records".format(reader.count))
+                    if is_cancelled(progress):
+                        break
+                del writer
+        except Exception as e:
+            raise GeoAlgorithmExecutionException("Couldn't load {}. Error: {}".format(table, e))
+        progress.setInfo("{} records loaded".format(reader.count))
+
+
+def write_layer(output, layer, progress):
+    """ Write the features of a loaded MdbFederatedLayer to an output vector """
+    geometry_type = QGis.WKBPoint if layer.xy_indexes else QGis.WKBNoGeometry
+    writer = output.getVectorWriter(layer.lyr.pendingFields(), geometry_type, QgsCoordinateReferenceSystem(layer.crs))
+    total = max(layer.loaded_count, 1)
+    for i, feature in enumerate(layer.lyr.getFeatures()):
+        writer.addFeature(feature)
+        if i % layer.batch_size == 0:
+            progress.setPercentage(int(100 * i / total))
+            if is_cancelled(progress):
+                break
+    del writer
+    progress.setInfo("{} records loaded".format(layer.loaded_count))
+
+
+class MdbLoadFederatedAlgorithm(GeoAlgorithm):
+    """ Load a table that is in several databases with the same schema into one vector layer """
+
+    DATABASES = 'DATABASES'
+    TABLE = 'TABLE'
+    COLUMNS = 'COLUMNS'
+    SUBSET = 'SUBSET'
+    X_COLUMN = 'X_COLUMN'
+    Y_COLUMN = 'Y_COLUMN'
+    CRS = 'CRS'
+    READER = 'READER'
+    OUTPUT = 'OUTPUT'
+
+    def defineCharacteristics(self):
+        self.name = 'Load Access table from several databases'
+        self.group = 'Import'
+        self.addParameter(ParameterString(self.DATABASES, 'Databases (paths or patterns like C:/crews/*.mdb, '
+                                                          'separated by ;)'))
+        self.addParameter(ParameterString(self.TABLE, 'Table or query'))
+        self.addParameter(ParameterString(self.COLUMNS, 'Columns (comma separated)', default='*', optional=True))
+        self.addParameter(ParameterString(self.SUBSET, 'Filter (Access SQL condition)', default='', optional=True))
+        self.addParameter(ParameterString(self.X_COLUMN, 'X coordinate column', default='', optional=True))
+        self.addParameter(ParameterString(self.Y_COLUMN, 'Y coordinate column', default='', optional=True))
+        self.addParameter(ParameterCrs(self.CRS, 'Coordinate reference system', 'EPSG:4326'))
+        self.addParameter(ParameterSelection(self.READER, 'Read the databases', READERS))
+        self.addOutput(OutputVector(self.OUTPUT, 'Table'))
+
+    def processAlgorithm(self, progress):
+        table = self.getParameterValue(self.TABLE)
+        databases = [path.strip() for path in self.getParameterValue(self.DATABASES).split(';') if path.strip()]
+        progress.setInfo("Loading {} from {}".format(table, ", ".join(databases)))
+        layer = MdbFederatedLayer(databases, table,
+                                  mdb_columns=self.getParameterValue(self.COLUMNS) or '*',
+                                  mdb_subset=self.getParameterValue(self.SUBSET) or '',
+                                  background=False, show_progress=False, add_to_map=False,
+                                  x_column=self.getParameterValue(self.X_COLUMN) or None,
+                                  y_column=self.getParameterValue(self.Y_COLUMN) or None,
+                                  crs=self.getParameterValue(self.CRS),
+                                  backend=BACKENDS[self.getParameterValue(self.READER)])
+        if layer.lyr is None:
+            raise GeoAlgorithmExecutionException(layer.error)
+        if layer.error:
+            progress.setInfo(layer.error)
+        write_layer(self.getOutputFromName(self.OUTPUT), layer, progress)
+
+
+class MdbExportTablesAlgorithm(GeoAlgorithm):
+    """ Stream tables to a GeoPackage or Parquet files, without loading them in a layer """
+
+    DATABASE = 'DATABASE'
+    TABLES = 'TABLES'
+    SUBSET = 'SUBSET'
+    FORMAT = 'FORMAT'
+    X_COLUMN = 'X_COLUMN'
+    Y_COLUMN = 'Y_COLUMN'
+    READER = 'READER'
+    OUTPUT = 'OUTPUT'
+
+    def defineCharacteristics(self):
+        self.name = 'Export Access tables'
+        self.group = 'Export'
+        self.addParameter(ParameterFile(self.DATABASE, 'Database (.mdb or .accdb)'))
+        self.addParameter(ParameterString(self.TABLES, 'Tables or queries (comma separated)'))
+        self.addParameter(ParameterString(self.SUBSET, 'Filter for every table (Access SQL condition)', default='',
+                                          optional=True))
+        self.addParameter(ParameterSelection(self.FORMAT, 'Format', ['GeoPackage', 'Parquet (a folder)']))
+        self.addParameter(ParameterString(self.X_COLUMN, 'X coordinate column (GeoPackage)', default='',
+                                          optional=True))
+        self.addParameter(ParameterString(self.Y_COLUMN, 'Y coordinate column (GeoPackage)', default='',
+                                          optional=True))
+        self.addParameter(ParameterSelection(self.READER, 'Read the database', READERS))
+        self.addOutput(OutputFile(self.OUTPUT, 'GeoPackage file or Parquet folder', ext='gpkg'))
+
+    def checkParameterValuesBeforeExecuting(self):
+        return check_database(self.getParameterValue(self.DATABASE))
+
+    def processAlgorithm(self, progress):
+        tables = [table.strip() for table in self.getParameterValue(self.TABLES).split(',') if table.strip()]
+        subset = self.getParameterValue(self.SUBSET)
+        file_format = FORMATS[self.getParameterValue(self.FORMAT)]
+        output = self.getOutputValue(self.OUTPUT)
+        if file_format == 'parquet':
+            output = os.path.splitext(output)[0]
+
+        def report(table, count):
+            progress.setText("{}: {} records".format(table, count))
+
+        try:
+            counts = export_tables(self.getParameterValue(self.DATABASE), tables, output, file_format,
+                                   subsets=dict((table, subset) for table in tables) if subset else None,
+                                   x_column=self.getParameterValue(self.X_COLUMN) or None,
+                                   y_column=self.getParameterValue(self.Y_COLUMN) or None,
+                                   progress=report, cancelled=lambda: is_cancelled(progress),
+                                   backend=BACKENDS[self.getParameterValue(self.READER)])
+        except Exception as e:
+            raise GeoAlgorithmExecutionException("Export failed. Error: {}".format(e))
+        for table in tables:
+            progress.setInfo("{}: {} records exported".format(table, counts.get(table, 0)))
+
+
+class MdbWriteBackAlgorithm(GeoAlgorithm):
+    """ Make a table match a layer: update the values that differ in the rows with a primary key on the layer,
+    insert the others, and optionally delete the rows that are not on the layer. Everything is written in one
+    transaction; rows that someone changes in the meantime are left alone and reported """
+
+    INPUT = 'INPUT'
+    DATABASE = 'DATABASE'
+    TABLE = 'TABLE'
+    DELETE_MISSING = 'DELETE_MISSING'
+
+    def defineCharacteristics(self):
+        self.name = 'Write back edits to Access table'
+        self.group = 'Export'
+        self.addParameter(ParameterVector(self.INPUT, 'Layer with the edited records', [ParameterVector.VECTOR_TYPE_ANY]))
+        self.addParameter(ParameterFile(self.DATABASE, 'Database (.mdb or .accdb)'))
+        self.addParameter(ParameterString(self.TABLE, 'Table'))
+        self.addParameter(ParameterBoolean(self.DELETE_MISSING, 'Delete records that are not on the layer', False))
+
+    def checkParameterValuesBeforeExecuting(self):
+        return check_database(self.getParameterValue(self.DATABASE))
+
+    def processAlgorithm(self, progress):
+        layer = dataobjects.getObjectFromUri(self.getParameterValue(self.INPUT))
+        table = self.getParameterValue(self.TABLE)
+
+        with get_pool(self.getParameterValue(self.DATABASE), 'odbc').connection() as conn:
+            cur = conn.cursor()
+            pk_cols = [row[8] for row in cur.statistics(table) if row[5] == 'PrimaryKey']
+            cur.execute("SELECT * FROM {} WHERE 1 = 0".format(quote(table)))
+            description = list(cur.description)
+            field_names = [field.name() for field in layer.pendingFields()]
+            if not pk_cols or not set(pk_cols) <= set(field_names):
+                raise GeoAlgorithmExecutionException(
+                    "The layer needs the primary key column(s) of {}: {}".format(table, ", ".join(pk_cols) or "none"))
+            # binary values are hexadecimal text on a layer loaded from Access, they aren't written back
+            columns = [column[0] for column in description if column[0] in field_names and not is_binary(column)]
+            checked = [column[0] for column in description if column[0] in field_names and not is_large_object(column)]
+            indexes = [field_names.index(name) for name in columns]
+
+            request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry).setSubsetOfAttributes(indexes)
+            rows = [[to_db(feature.attributes()[i]) for i in indexes]
+                    for feature in vector.features(layer, request)]
+
+            # the rows are read last, so they change as little as possible before they are written
+            progress.setInfo("Reading the current records of {}".format(table))
+            cur.execute("SELECT {} FROM {}".format(", ".join(quote(column) for column in columns), quote(table)))
+            current = {}
+            for row in cur.fetchall():
+                values = dict(zip(columns, row))
+                current[tuple(values[pk] for pk in pk_cols)] = values
+            changes = changes_from_rows(columns, rows, pk_cols, current, self.getParameterValue(self.DELETE_MISSING),
+                                        checked)
+            progress.setInfo("Writing {} updates, {} inserts and {} deletes".format(
+                len(changes.updates), len(changes.inserts), len(changes.deletes)))
+            if is_cancelled(progress):
+                return
+            writer = MdbWriter(table, pk_cols)
+            try:
+                conflicts = writer.find_conflicts(cur, changes, columns) if changes.originals else {}
+                changes = changes.without(conflicts)
+                counts = writer.apply(cur, changes, conflicts, columns) if len(changes) else {}
+            except Exception as e:
+                raise GeoAlgorithmExecutionException("Nothing was written to {}. Error: {}".format(table, e))
+        for sql, count in counts.items():
+            logger("{} : {} rows".format(sql, count))
+        if conflicts:
+            report_conflicts(table, conflicts, progress)
+        progress.setPercentage(100)
+
+
+def report_conflicts(table, conflicts, progress):
+    """ Tell which records were changed by someone else while the algorithm ran, and weren't written """
+    for pk, values in conflicts.items():
+        logger("{}: record {} was {} by someone else, it was not written".format(
+            table, pk, "deleted" if values is None else "changed"))
+    keys = ", ".join("/".join("{}".format(value) for value in pk) for pk in sorted(conflicts)[:MAX_CONFLICTS_SHOWN])
+    if len(conflicts) > MAX_CONFLICTS_SHOWN:
+        keys += ", ..."
+    progress.setInfo("{} records were changed by someone else and were not written: {}".format(len(conflicts), keys))
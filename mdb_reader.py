@@ -0,0 +1,178 @@
+from qgis.core import QgsFeature, QgsGeometry, QgsPoint, QgsMessageLog
+from mdb_connection import get_pool, quote
+from mdb_types import field_from_column, row_converter
+
+
+logger = lambda msg: QgsMessageLog.logMessage(msg, 'Mdb Reader', 1)
+
+BATCH_SIZE = 5000
+DEFAULT_CRS = 'EPSG:4326'
+
+
+# Reading a table into QgsFeatures, without layer, progress bar or message bar. MdbLayer, MdbFederatedLayer
+# and the Processing algorithms all build their SQL, fields and features here.
+
+def select_list(columns):
+    """ Return the columns for a SELECT, quoted unless they already are. '*' stays as is
+
+    :param columns: Comma separated column names, or a list of them.
+    :type columns: str or list
+    """
+    if isinstance(columns, basestring):
+        columns = [column.strip() for column in columns.split(",")]
+    if columns == ['*']:
+        return '*'
+    return ", ".join(column if column.startswith("[") else quote(column) for column in columns)
+
+
+def select_sql(table, columns='*', conditions=(), top=None, order_by=()):
+    """ Return an Access SQL SELECT on a table or query
+
+    :param columns: The select list, see select_list.
+    :type columns: str
+
+    :param conditions: Access SQL conditions the records must all meet; empty ones are left out.
+    :type conditions: list
+
+    :param top: Only select the first records.
+    :type top: int
+
+    :param order_by: Column names to sort on.
+    :type order_by: list
+    """
+    sql = "SELECT {}{} FROM {}".format("TOP {} ".format(top) if top else "", columns, quote(table))
+    conditions = [condition for condition in conditions if condition]
+    if len(conditions) == 1:
+        sql += " WHERE " + conditions[0]
+    elif conditions:
+        sql += " WHERE " + " AND ".join("(" + condition + ")" for condition in conditions)
+    if order_by:
+        sql += " ORDER BY " + ", ".join(quote(column) for column in order_by)
+    return sql
+
+
+def fields_from_description(description):
+    """ Return a list with a QgsField for every column in a cursor description
+    and whether some columns have a type that can't be edited reliably """
+
+    # falling back to string for types without a QGIS counterpart
+    fields = []
+    unsupported_types = False
+    for column in description:
+        field, supported = field_from_column(column)
+        fields.append(field)
+        if not supported:
+            unsupported_types = True
+    return fields, unsupported_types
+
+
+def coordinate_indexes(field_names, x_column, y_column, table=''):
+    """ Return the positions of the coordinate columns in the fields, None if there are none (or not both) """
+    if not x_column or not y_column:
+        return None
+    if x_column in field_names and y_column in field_names:
+        return field_names.index(x_column), field_names.index(y_column)
+    logger("{}: coordinate columns {} and {} not found, reading without geometry".format(table, x_column, y_column))
+    return None
+
+
+def point_geometry(x, y):
+    """ Return a point QgsGeometry, or None if a coordinate is missing """
+    if x is None or y is None:
+        return None
+    return QgsGeometry.fromPoint(QgsPoint(float(x), float(y)))
+
+
+def features_from_rows(rows, xy_indexes=None, extra=()):
+    """ Return a list of QgsFeatures, one for every list of attribute values
+
+    :param xy_indexes: Positions of the coordinate columns in the rows; the features get a point geometry.
+    :type xy_indexes: tuple
+
+    :param extra: Values added after the attributes of every row.
+    :type extra: list
+    """
+    features = []
+    extra = list(extra)
+    for row in rows:
+        feature = QgsFeature()
+        feature.setAttributes(row + extra if extra else row)
+        features.append(feature)
+
+    if xy_indexes:
+        x_index, y_index = xy_indexes
+        for feature, row in zip(features, rows):
+            geometry = point_geometry(row[x_index], row[y_index])
+            if geometry is not None:
+                feature.setGeometry(geometry)
+    return features
+
+
+class MdbTableReader:
+    """ Read a table or query as QgsFeatures, batch by batch, without a layer, progress bar or message bar
+
+    For Processing and scripts that write the records somewhere else. The query runs when the reader is
+    entered as a context manager; fields then tells what the features look like, and batches() yields them.
+    Features get a point geometry from the coordinate columns, like on an MdbLayer.
+
+        with MdbTableReader(path, 'survey', x_column='x', y_column='y') as reader:
+            for features in reader.batches():
+                ...
+    """
+
+    def __init__(self, mdb_path, mdb_table, mdb_columns='*', mdb_subset='', x_column=None, y_column=None,
+                 batch_size=BATCH_SIZE, backend=None):
+        """
+        :param mdb_columns: Comma separated list of columns to read. Defaults to all (*).
+        :type mdb_columns: str
+
+        :param mdb_subset: Access SQL condition for the records to read.
+        :type mdb_subset: str
+
+        :param backend: How the database is read, see mdb_connection.get_pool.
+        :type backend: str
+        """
+        self.mdb_table = mdb_table
+        self.batch_size = batch_size
+        self.x_column = x_column
+        self.y_column = y_column
+        self.pool = get_pool(mdb_path, backend)
+        self.sql = select_sql(mdb_table, select_list(mdb_columns), [mdb_subset])
+        self.fields = []
+        self.xy_indexes = None
+        self.count = 0
+        self.conn = None
+        self.cur = None
+        self.convert_rows = None
+
+    def __enter__(self):
+        self.conn = self.pool.acquire()
+        try:
+            self.cur = self.conn.cursor()
+            self.cur.execute(self.sql)
+        except Exception:
+            self.__exit__()
+            raise
+        self.fields = fields_from_description(self.cur.description)[0]
+        self.convert_rows = row_converter(self.cur.description)
+        self.xy_indexes = coordinate_indexes([field.name() for field in self.fields], self.x_column, self.y_column,
+                                             self.mdb_table)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.cur is not None:
+            self.cur.close()
+            self.cur = None
+        if self.conn is not None:
+            self.pool.release(self.conn)
+            self.conn = None
+
+    def batches(self):
+        """ Yield lists of up to batch_size QgsFeatures until all records are read """
+        while True:
+            rows = self.cur.fetchmany(self.batch_size)
+            if not rows:
+                return
+            features = features_from_rows(self.convert_rows(rows), self.xy_indexes)
+            self.count += len(features)
+            yield features
@@ -0,0 +1,113 @@
+from array import array
+
+MAX_DICTIONARY_SIZE = 65535     # distinct values of a dictionary encoded column, codes are unsigned shorts
+
+# python type in a cursor description: array type code for columns of that type
+_array_types = {int: 'l', float: 'd', bool: 'B'}
+_text_types = (str, unicode)
+
+
+class ColumnBatch:
+    """ A batch of rows stored column by column, taking a fraction of the memory of a list of lists
+
+    Integer, float and boolean columns are typed arrays with the positions of the NULLs kept aside.
+    Text columns with many repeated values (code lists, categories) are dictionary encoded: an array of
+    codes and a list with every distinct value once. Other columns are plain lists.
+    Batches are made on the worker thread and turned back into rows on the GUI thread.
+    """
+
+    def __init__(self, rows, description):
+        """
+        :param rows: Rows from a cursor.
+        :type rows: list
+
+        :param description: The cursor description of the rows.
+        :type description: list
+        """
+        self.count = len(rows)
+        self.columns = [_stage([row[i] for row in rows], column[1]) for i, column in enumerate(description)]
+
+    def __len__(self):
+        return self.count
+
+    def rows(self):
+        """ Return the rows as a list of lists """
+        if not self.columns:
+            return [[] for _ in range(self.count)]
+        return [list(row) for row in zip(*[column.values() for column in self.columns])]
+
+    def nbytes(self):
+        """ Approximate memory use of the staged values, not counting the text of plain list columns """
+        return sum(column.nbytes() for column in self.columns)
+
+
+def _stage(values, python_type):
+    if python_type in _array_types:
+        nulls = [i for i, value in enumerate(values) if value is None]
+        if nulls:
+            values = [0 if value is None else value for value in values]
+        try:
+            return ArrayColumn(array(_array_types[python_type], values), nulls, python_type)
+        except (OverflowError, TypeError):
+            return ListColumn(values if not nulls else _with_nulls(values, nulls))
+    if python_type in _text_types:
+        codes = {}
+        encoded = [codes.setdefault(value, len(codes)) for value in values]
+        if len(codes) <= MAX_DICTIONARY_SIZE and len(codes) * 2 <= len(values):
+            dictionary = [None] * len(codes)
+            for value, code in codes.items():
+                dictionary[code] = value
+            return DictionaryColumn(array('H', encoded), dictionary)
+    return ListColumn(values)
+
+
+def _with_nulls(values, nulls):
+    values = list(values)
+    for i in nulls:
+        values[i] = None
+    return values
+
+
+class ArrayColumn:
+
+    def __init__(self, data, nulls, python_type):
+        self.data = data
+        self.nulls = nulls
+        self.python_type = python_type
+
+    def values(self):
+        values = self.data.tolist()
+        if self.python_type is bool:
+            values = [bool(value) for value in values]
+        for i in self.nulls:
+            values[i] = None
+        return values
+
+    def nbytes(self):
+        return self.data.itemsize * len(self.data) + 8 * len(self.nulls)
+
+
+class DictionaryColumn:
+
+    def __init__(self, codes, dictionary):
+        self.codes = codes
+        self.dictionary = dictionary
+
+    def values(self):
+        dictionary = self.dictionary
+        return [dictionary[code] for code in self.codes]
+
+    def nbytes(self):
+        return self.codes.itemsize * len(self.codes) + sum(8 + len(value or '') for value in self.dictionary)
+
+
+class ListColumn:
+
+    def __init__(self, values):
+        self.data = values
+
+    def values(self):
+        return self.data
+
+    def nbytes(self):
+        return 8 * len(self.data)
@@ -0,0 +1,85 @@
+import os, time, tempfile, pstats, cProfile, StringIO
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class Timings:
+    """ Time spent per phase and counters of one load or commit
+
+    Phases and counters keep the order in which they were first used. Timing the same phase
+    again adds to its total, so a phase can be timed once per batch.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.phases = OrderedDict()
+        self.counters = OrderedDict()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.time() - start)
+
+    def add_time(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def count(self, name, number=1):
+        self.counters[name] = self.counters.get(name, 0) + number
+
+    def as_dict(self):
+        return {'total': time.time() - self.started,
+                'phases': OrderedDict(self.phases),
+                'counters': OrderedDict(self.counters)}
+
+    def report(self):
+        """ Return a single line with the total time, the time per phase and the counters """
+        parts = ["total {:.3f}s".format(time.time() - self.started)]
+        parts.extend("{} {:.3f}s".format(name, seconds) for name, seconds in self.phases.items())
+        parts.extend("{} {}".format(name, number) for name, number in self.counters.items())
+        return ", ".join(parts)
+
+
+def estimated_size(rows):
+    """ Return the approximate number of bytes in a batch of rows, extrapolated from its first row.
+    Text and binary values count their length, other values 8 bytes """
+    if not rows:
+        return 0
+    size = sum(len(value) if isinstance(value, (basestring, bytearray, buffer)) else 8
+               for value in rows[0] if value is not None)
+    return size * len(rows)
+
+
+class Profiler:
+    """ cProfile capture that can be switched on and off around the parts of a load running on this thread.
+    A disabled Profiler captures nothing """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.profile = cProfile.Profile() if enabled else None
+
+    @contextmanager
+    def running(self):
+        if not self.enabled:
+            yield
+            return
+        self.profile.enable()
+        try:
+            yield
+        finally:
+            self.profile.disable()
+
+    def save(self, name, lines=20):
+        """ Write the statistics to a .prof file in the temp folder
+
+        :returns: The path of the file, and the top functions by cumulative time as text.
+        :rtype: tuple
+        """
+        path = os.path.join(tempfile.gettempdir(), "mdb_{}_{}.prof".format(
+            "".join(c if c.isalnum() else "_" for c in name), time.strftime("%Y%m%d_%H%M%S")))
+        self.profile.dump_stats(path)
+        text = StringIO.StringIO()
+        pstats.Stats(path, stream=text).sort_stats('cumulative').print_stats(lines)
+        return path, text.getvalue()
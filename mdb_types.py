@@ -0,0 +1,115 @@
+import binascii, datetime, decimal
+from PyQt4.QtCore import QVariant, QDate, QDateTime, QTime, QPyNullVariant
+from qgis.core import QgsField
+
+
+# the field types the memory provider of QGIS 2.14 accepts; it leaves out fields of other types
+LAYER_FIELD_TYPES = (QVariant.Int, QVariant.LongLong, QVariant.Double, QVariant.String, QVariant.Date,
+                     QVariant.Time, QVariant.DateTime)
+
+BINARY_TYPE_NAME = 'binary'     # type name of the string fields holding binary values as hexadecimal text
+
+
+def _to_hex(value):
+    return binascii.hexlify(value)
+
+
+# python type in a pyodbc cursor description: (field type, converter from database value to attribute value)
+# datetime, date and time values are converted to their Qt counterparts by PyQt itself. Yes/No values become
+# 0 and 1, binary values hexadecimal text
+field_types = {
+    str: (QVariant.String, None),
+    unicode: (QVariant.String, None),
+    bool: (QVariant.Int, int),
+    int: (QVariant.Int, None),
+    long: (QVariant.LongLong, None),
+    float: (QVariant.Double, None),
+    decimal.Decimal: (QVariant.Double, float),
+    datetime.datetime: (QVariant.DateTime, None),
+    datetime.date: (QVariant.Date, None),
+    datetime.time: (QVariant.Time, None),
+    bytearray: (QVariant.String, _to_hex),
+    buffer: (QVariant.String, _to_hex),
+}
+
+
+def field_from_column(column):
+    """ Return a QgsField for a column of a cursor description, and whether its type is supported.
+    Columns of an unknown type become string fields """
+    name, python_type = column[0], column[1]
+    if python_type not in field_types:
+        return QgsField(name, QVariant.String), False
+
+    field_type = field_types[python_type][0]
+    if python_type is decimal.Decimal:
+        # keep precision and scale of Currency and Decimal columns
+        return QgsField(name, field_type, 'double', column[4] or 0, column[5] or 0), True
+    if is_binary(column):
+        return QgsField(name, field_type, BINARY_TYPE_NAME), True
+    if field_type == QVariant.String:
+        return QgsField(name, field_type, 'string', column[3] or 0), True
+    return QgsField(name, field_type), True
+
+
+def is_binary(column):
+    """ Whether a column of a cursor description holds binary values. On a layer they are hexadecimal text
+    that isn't written back """
+    return column[1] in (bytearray, buffer)
+
+
+def is_binary_field(field):
+    """ Whether a QgsField holds the values of a binary column, see field_from_column """
+    return field.type() == QVariant.String and field.typeName() == BINARY_TYPE_NAME
+
+
+def row_converter(description):
+    """ Return a function converting a list of database rows to lists of attribute values
+
+    The converters are chosen once per column from the description. Rows are converted column by column,
+    and only the columns that need it; without such columns the rows are just turned into lists.
+    """
+    converters = [(i, field_types[column[1]][1]) for i, column in enumerate(description)
+                  if column[1] in field_types and field_types[column[1]][1] is not None]
+
+    def convert(rows):
+        rows = [list(row) for row in rows]
+        for i, converter in converters:
+            for row in rows:
+                if row[i] is not None:
+                    row[i] = converter(row[i])
+        return rows
+    return convert
+
+
+def to_db(value):
+    """ Convert an attribute value of a QgsFeature to a value for the database """
+    if isinstance(value, QPyNullVariant):
+        return None
+    if isinstance(value, QDateTime):
+        return value.toPyDateTime()
+    if isinstance(value, QDate):
+        return value.toPyDate()
+    if isinstance(value, QTime):
+        return value.toPyTime()
+    return value
+
+
+def to_attribute(value):
+    """ Convert a single database value to an attribute value, like row_converter does for rows """
+    converter = field_types.get(type(value), (None, None))[1]
+    return value if value is None or converter is None else converter(value)
+
+
+def parse_datetime(value):
+    """ Convert the isoformat() text of a datetime back to a datetime """
+    return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f' if '.' in value else '%Y-%m-%dT%H:%M:%S')
+
+
+def parse_date(value):
+    """ Convert the isoformat() text of a date back to a date """
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def parse_time(value):
+    """ Convert the isoformat() text of a time back to a time """
+    return datetime.datetime.strptime(value, '%H:%M:%S.%f' if '.' in value else '%H:%M:%S').time()
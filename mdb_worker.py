@@ -0,0 +1,112 @@
+import time, threading
+from PyQt4.QtCore import QObject, QThread, pyqtSignal
+from mdb_staging import ColumnBatch
+
+MAX_PENDING_BATCHES = 3     # batches emitted but not yet added to the layer
+
+
+class MdbLoadWorker(QObject):
+    """ Fetch the rows of a query on a separate thread and hand them over in batches
+
+    The worker takes a connection from the pool for as long as it runs; no other thread may use it meanwhile.
+    Batches are emitted as compact ColumnBatch objects; connected slots on the GUI thread receive
+    them through a queued connection and call batch_done() when they have handled one. The worker
+    waits while MAX_PENDING_BATCHES are not handled yet, so a fast database can't fill the memory
+    with batches the GUI thread hasn't gotten to. Right before finishing, the seconds spent executing
+    the query, fetching the rows and staging them are emitted as {'select': seconds, 'fetch': seconds,
+    'stage': seconds}.
+    An optional check gets the cursor before the query runs, to look at the database first; when it raises,
+    the worker stops with that error.
+    """
+
+    rows_fetched = pyqtSignal(object)
+    finished = pyqtSignal(int, bool)
+    error = pyqtSignal(str)
+    timings = pyqtSignal(dict)
+
+    def __init__(self, pool, sql, batch_size, check=None):
+        """
+        :param pool: Connection pool of the database.
+        :type pool: ConnectionPool
+
+        :param sql: Query to execute.
+        :type sql: str
+
+        :param batch_size: Number of rows per emitted batch.
+        :type batch_size: int
+
+        :param check: Called with the cursor before the query runs, on the worker thread.
+        :type check: function
+        """
+        QObject.__init__(self)
+        self.pool = pool
+        self.sql = sql
+        self.batch_size = batch_size
+        self.check = check
+        self.killed = False
+        self.pending = 0
+        self.condition = threading.Condition()
+
+    def run(self):
+        fetched = 0
+        phases = {'select': 0.0, 'fetch': 0.0, 'stage': 0.0}
+        try:
+            with self.pool.connection() as conn:
+                cur = conn.cursor()
+                try:
+                    if self.check is not None:
+                        self.check(cur)
+                    start = time.time()
+                    cur.execute(self.sql)
+                    phases['select'] = time.time() - start
+                    while not self.killed:
+                        start = time.time()
+                        rows = cur.fetchmany(self.batch_size)
+                        phases['fetch'] += time.time() - start
+                        if not rows:
+                            break
+                        start = time.time()
+                        batch = ColumnBatch(rows, cur.description)
+                        del rows
+                        phases['stage'] += time.time() - start
+                        if not self.wait_for_room():
+                            break
+                        self.rows_fetched.emit(batch)
+                        fetched += len(batch)
+                finally:
+                    cur.close()
+        except Exception as e:
+            self.error.emit("{}".format(e))
+        self.timings.emit(phases)
+        self.finished.emit(fetched, self.killed)
+
+    def wait_for_room(self):
+        """ Wait until there are less than MAX_PENDING_BATCHES pending, returns False when killed meanwhile """
+        with self.condition:
+            while self.pending >= MAX_PENDING_BATCHES and not self.killed:
+                self.condition.wait(0.5)
+            self.pending += 1
+            return not self.killed
+
+    def batch_done(self):
+        """ Called from the receiving thread when an emitted batch has been handled """
+        with self.condition:
+            self.pending -= 1
+            self.condition.notify()
+
+    def kill(self):
+        with self.condition:
+            self.killed = True
+            self.condition.notify()
+
+
+def start_worker(worker):
+    """ Move the worker to a new thread and start it. Returns the thread, keep a reference to it! """
+    thread = QThread()
+    worker.moveToThread(thread)
+    thread.started.connect(worker.run)
+    worker.finished.connect(thread.quit)
+    worker.finished.connect(worker.deleteLater)
+    thread.finished.connect(thread.deleteLater)
+    thread.start()
+    return thread
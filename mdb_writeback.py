@@ -0,0 +1,330 @@
+import datetime, decimal
+from collections import OrderedDict
+from mdb_connection import quote
+
+CHECK_CHUNK_SIZE = 250      # rows whose current values are read with one query when looking for conflicts
+
+
+class ChangeSet:
+    """ Edits of one table as plain values: what to update, delete and insert
+
+    Rows to update and delete are identified by a tuple with their primary key values. With originals,
+    rows are only written if they still have the values they had when they were read: the writer puts those
+    values in the WHERE clause and find_conflicts tells which rows were changed by someone else in between.
+    """
+
+    def __init__(self):
+        self.updates = []       # [(pk values, {column: new value})]
+        self.deletes = []       # [pk values]
+        self.inserts = []       # [{column: value}]
+        self.originals = {}     # {pk values: {column: value when read}} of rows to update or delete
+
+    def __len__(self):
+        return len(self.updates) + len(self.deletes) + len(self.inserts)
+
+    def without(self, pks):
+        """ Return a copy without the updates and deletes of these primary keys """
+        changes = ChangeSet()
+        changes.updates = [(pk_values, values) for pk_values, values in self.updates if pk_values not in pks]
+        changes.deletes = [pk_values for pk_values in self.deletes if pk_values not in pks]
+        changes.inserts = list(self.inserts)
+        changes.originals = dict((pk_values, values) for pk_values, values in self.originals.items()
+                                 if pk_values not in pks)
+        return changes
+
+
+def changes_from_rows(columns, rows, pk_cols, current, delete_missing=False, checked=None):
+    """ Return the ChangeSet making a table match a list of rows: rows with a primary key that is in the table
+    become updates of the values that differ, the others inserts. Optionally the rows of the table that aren't
+    in the list are deleted
+
+    Rows to update or delete get their current values as originals, so they are left alone if someone changes
+    them before they are written.
+
+    :param columns: Column names of the values in the rows, including the primary key columns.
+    :type columns: list
+
+    :param rows: Lists of values.
+    :type rows: list
+
+    :param current: {primary key tuple: {column: value}} of the rows in the table, with all columns.
+    :type current: dict
+
+    :param checked: Columns that can be compared in a WHERE clause, not memo or OLE object. Defaults to all.
+    :type checked: list
+    """
+    pk_indexes = [columns.index(pk) for pk in pk_cols]
+    checked = set(columns if checked is None else checked)
+    changes = ChangeSet()
+    seen = set()
+    for row in rows:
+        pk_values = tuple(row[i] for i in pk_indexes)
+        seen.add(pk_values)
+        if pk_values in current:
+            values = dict((column, value) for i, (column, value) in enumerate(zip(columns, row))
+                          if i not in pk_indexes and not _same(current[pk_values][column], value))
+            if values:
+                changes.updates.append((pk_values, values))
+                changes.originals[pk_values] = dict((column, current[pk_values][column]) for column in values
+                                                    if column in checked)
+        else:
+            changes.inserts.append(dict((column, value) for column, value in zip(columns, row) if value is not None))
+    if delete_missing:
+        changes.deletes = [pk_values for pk_values in current if pk_values not in seen]
+        for pk_values in changes.deletes:
+            changes.originals[pk_values] = dict((column, value) for column, value in current[pk_values].items()
+                                                if column in checked)
+    return changes
+
+
+class MdbWriter:
+    """ Write a ChangeSet to a table in one transaction
+
+    Rows are grouped by the columns they change (or insert), so every group is a single executemany with
+    one statement. Statements are kept between calls, letting the driver reuse the prepared statement.
+
+    Rows with original values in the ChangeSet are matched on those values too (optimistic concurrency),
+    so a row that was changed by someone else is left alone instead of overwritten. Run find_conflicts first
+    to know which rows those are and leave them out. Rows changed between find_conflicts and apply are found
+    as well: when the row count of an executemany isn't the number of rows sent (pyodbc reports -1), the rows
+    of the statement are read back to see which of them weren't written.
+    """
+
+    def __init__(self, table, pk_cols):
+        self.table = table
+        self.pk_cols = pk_cols
+        self.statements = {}
+        self.where_clause = " WHERE " + " AND ".join(quote(pk) + " = ?" for pk in pk_cols)
+
+    def update_sql(self, columns, checks=(), nulls=()):
+        key = ('UPDATE', columns, checks, nulls)
+        if key not in self.statements:
+            self.statements[key] = "UPDATE {} SET {}{}{}".format(
+                quote(self.table), ", ".join(quote(column) + " = ?" for column in columns), self.where_clause,
+                self.check_clause(checks, nulls))
+        return self.statements[key]
+
+    def delete_sql(self, checks=(), nulls=()):
+        key = ('DELETE', checks, nulls)
+        if key not in self.statements:
+            self.statements[key] = "DELETE * FROM {}{}{}".format(quote(self.table), self.where_clause,
+                                                               self.check_clause(checks, nulls))
+        return self.statements[key]
+
+    @staticmethod
+    def check_clause(checks, nulls):
+        """ Return the conditions matching the original values; NULL can't be compared with a parameter """
+        return "".join(" AND " + quote(column) + (" IS NULL" if column in nulls else " = ?") for column in checks)
+
+    @staticmethod
+    def checked(originals):
+        """ Return the checked columns, those of them that were NULL and the parameters for the others """
+        if not originals:
+            return (), (), ()
+        checks = tuple(sorted(originals))
+        nulls = tuple(column for column in checks if originals[column] is None)
+        return checks, nulls, tuple(originals[column] for column in checks if originals[column] is not None)
+
+    def insert_sql(self, columns):
+        key = ('INSERT', columns)
+        if key not in self.statements:
+            self.statements[key] = "INSERT INTO {} ({}) VALUES ({})".format(
+                quote(self.table), ", ".join(quote(column) for column in columns), ", ".join("?" * len(columns)))
+        return self.statements[key]
+
+    def apply(self, cur, changes, conflicts=None, columns=(), inserted=None):
+        """ Execute all changes and commit. On any error everything is rolled back and the error is raised
+
+        :param cur: Cursor on the database.
+        :type cur: pyodbc.Cursor
+
+        :param changes: The changes to write.
+        :type changes: ChangeSet
+
+        :param conflicts: Rows with original values that matched no row when they were written are added to it,
+            like find_conflicts returns them. Their current values are read before the commit.
+        :type conflicts: dict
+
+        :param columns: Columns to return the current values of for those rows, see find_conflicts.
+        :type columns: list
+
+        :param inserted: The primary key values of the inserted rows are added to it, in the order of the inserts.
+            Rows inserted without their primary key are written one by one to read the autonumber the database
+            gave them; the key is None if more than one primary key column was left out.
+        :type inserted: list
+
+        :returns: Number of rows sent per statement.
+        :rtype: dict
+        """
+        groups = OrderedDict()     # updates, then deletes, then inserts: [(params, pk values if checked)]
+        for pk_values, values in changes.updates:
+            update_columns = tuple(sorted(values))
+            checks, nulls, check_params = self.checked(changes.originals.get(pk_values))
+            groups.setdefault(self.update_sql(update_columns, checks, nulls), []).append(
+                (tuple(values[column] for column in update_columns) + tuple(pk_values) + check_params,
+                 pk_values if pk_values in changes.originals else None))
+        for pk_values in changes.deletes:
+            checks, nulls, check_params = self.checked(changes.originals.get(pk_values))
+            groups.setdefault(self.delete_sql(checks, nulls), []).append(
+                (tuple(pk_values) + check_params, pk_values if pk_values in changes.originals else None))
+        inserts = OrderedDict()    # [(params, position of the insert if its key is generated)]
+        for position, values in enumerate(changes.inserts):
+            insert_columns = tuple(sorted(values))
+            generated = inserted is not None and not set(self.pk_cols) <= set(values)
+            inserts.setdefault(self.insert_sql(insert_columns), []).append(
+                (tuple(values[column] for column in insert_columns), position if generated else None))
+        keys = [tuple(values.get(pk) for pk in self.pk_cols) for values in changes.inserts]
+
+        counts = {}
+        missed = []
+        try:
+            for sql, rows in groups.items():
+                cur.executemany(sql, [params for params, pk_values in rows])
+                checked = [pk_values for params, pk_values in rows if pk_values is not None]
+                if checked and cur.rowcount != len(rows):
+                    missed.extend(self.unwritten(cur, changes, checked))
+                counts[sql] = len(rows)
+            for sql, rows in inserts.items():
+                given = [params for params, position in rows if position is None]
+                if given:
+                    cur.executemany(sql, given)
+                for params, position in rows:
+                    if position is not None:
+                        cur.execute(sql, params)
+                        keys[position] = self.generated_key(cur, changes.inserts[position])
+                counts[sql] = len(rows)
+            if missed and conflicts is not None:
+                current = self.current_values(cur, missed, self.check_columns(changes, columns))
+                conflicts.update((pk_values, current.get(pk_values)) for pk_values in missed)
+            cur.commit()
+        except Exception:
+            cur.rollback()
+            raise
+        if inserted is not None:
+            inserted.extend(keys)
+        return counts
+
+    def generated_key(self, cur, values):
+        """ Return the primary key values of the row just inserted with these values, reading the autonumber of
+        the one primary key column that wasn't given. None if more columns are missing """
+        missing = [pk for pk in self.pk_cols if pk not in values]
+        if len(missing) != 1:
+            return None
+        cur.execute("SELECT @@IDENTITY")
+        identity = cur.fetchone()[0]
+        return tuple(identity if pk in missing else values[pk] for pk in self.pk_cols)
+
+    def unwritten(self, cur, changes, keys):
+        """ Return the primary keys of rows to update or delete that the statements left alone, reading them back
+        in the transaction: updated rows without their new values and deleted rows that are still there """
+        updates = dict(changes.updates)
+        # an update can change the primary key itself
+        new_keys = dict((pk_values, tuple(updates[pk_values].get(pk, value) for pk, value in zip(self.pk_cols, pk_values))
+                         if pk_values in updates else pk_values) for pk_values in keys)
+        columns = list(self.pk_cols) + sorted(set(column for pk_values in keys if pk_values in updates
+                                                  for column in updates[pk_values]) - set(self.pk_cols))
+        current = self.current_values(cur, list(set(new_keys.values())), columns)
+        missed = []
+        for pk_values in keys:
+            values = current.get(new_keys[pk_values])
+            if pk_values not in updates:
+                if values is not None:
+                    missed.append(pk_values)
+            elif values is None or any(not _written(values[column], value)
+                                       for column, value in updates[pk_values].items()):
+                missed.append(pk_values)
+        return missed
+
+    def find_conflicts(self, cur, changes, columns, chunk_size=CHECK_CHUNK_SIZE):
+        """ Return the rows to update or delete that no longer have their original values in the database
+
+        The current values are read with one query per chunk_size rows and compared here, so all conflicts are
+        found at once.
+
+        :param cur: Cursor on the database.
+        :type cur: pyodbc.Cursor
+
+        :param changes: The changes to write, with the original values of the rows to update and delete.
+        :type changes: ChangeSet
+
+        :param columns: Columns to return the current values of, the primary key columns are added.
+        :type columns: list
+
+        :returns: {pk values: {column: current value}, or None if the row was deleted}.
+        :rtype: dict
+        """
+        keys = list(changes.originals)
+        current = self.current_values(cur, keys, self.check_columns(changes, columns), chunk_size)
+        conflicts = {}
+        for pk_values in keys:
+            values = current.get(pk_values)
+            if values is None or any(not _same(values[column], value)
+                                     for column, value in changes.originals[pk_values].items()):
+                conflicts[pk_values] = values
+        return conflicts
+
+    def check_columns(self, changes, columns):
+        """ Return the primary key columns, columns and the columns with original values in changes """
+        columns = list(self.pk_cols) + [column for column in columns if column not in self.pk_cols]
+        return columns + sorted(set(column for values in changes.originals.values() for column in values) -
+                                set(columns))
+
+    def current_values(self, cur, keys, columns, chunk_size=CHECK_CHUNK_SIZE):
+        """ Return {pk values: {column: value}} of the rows with these primary keys that are in the table,
+        reading chunk_size rows per query
+
+        :param columns: Columns to read, starting with the primary key columns.
+        :type columns: list
+        """
+        select = "SELECT {} FROM {} WHERE ".format(", ".join(quote(column) for column in columns), quote(self.table))
+        if len(self.pk_cols) == 1:
+            condition = lambda count: quote(self.pk_cols[0]) + " IN (" + ", ".join("?" * count) + ")"
+        else:
+            condition = lambda count: " OR ".join(["(" + self.where_clause[7:] + ")"] * count)
+
+        current = {}
+        for start in range(0, len(keys), chunk_size):
+            chunk = keys[start:start + chunk_size]
+            cur.execute(select + condition(len(chunk)), [value for pk_values in chunk for value in pk_values])
+            for row in cur.fetchall():
+                values = dict(zip(columns, row))
+                current[tuple(values[pk] for pk in self.pk_cols)] = values
+        return current
+
+    @staticmethod
+    def applied(changes, conflicts):
+        """ Return the primary keys of conflicting rows that already are what the changes make of them: updated
+        rows with the new values, deleted rows that are gone. Writing the same changes twice isn't a conflict
+
+        :param conflicts: What find_conflicts returned for the changes.
+        :type conflicts: dict
+        """
+        updates = dict(changes.updates)
+        deletes = set(changes.deletes)
+        done = set()
+        for pk_values, current in conflicts.items():
+            if current is None:
+                if pk_values in deletes:
+                    done.add(pk_values)
+            elif pk_values in updates and all(column in current and _same(current[column], value)
+                                              for column, value in updates[pk_values].items()):
+                done.add(pk_values)
+        return done
+
+
+def _written(current, value):
+    """ Whether a value read back is the value that was written, allowing for Single rounding and Access
+    keeping dates and times to the second """
+    if isinstance(current, (float, decimal.Decimal)) and isinstance(value, (float, int, long, decimal.Decimal)):
+        return abs(float(current) - float(value)) <= 1e-6 * max(abs(float(current)), abs(float(value)), 1.0)
+    if isinstance(current, (datetime.datetime, datetime.time)) and isinstance(value, type(current)):
+        return current.replace(microsecond=0) == value.replace(microsecond=0)
+    return _same(current, value)
+
+
+def _same(current, original):
+    if isinstance(current, decimal.Decimal):
+        current = float(current)
+    if isinstance(original, decimal.Decimal):
+        original = float(original)
+    return current == original
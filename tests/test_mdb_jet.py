@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+mdb_jet against a database written by benchmarks/jet_fixture.py. mdb_jet doesn't need QGIS:
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import shutil
+import decimal
+import datetime
+import tempfile
+import unittest
+
+sys.path[:0] = [os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks')]
+
+import mdb_jet
+from jet_fixture import Table, write_database
+from mdb_jet import BOOL, INT, LONG, MONEY, DOUBLE, DATETIME, TEXT, OLE, MEMO
+
+SURVEY_COLUMNS = [('id', LONG), ('checked', BOOL), ('depth', DOUBLE), ('taken', DATETIME), ('cost', MONEY),
+                  ('name', TEXT, 50), ('notes', MEMO), ('photo', OLE)]
+SURVEY_ROWS = [
+    (1, True, 1.5, datetime.datetime(2020, 1, 2, 3, 4, 5), decimal.Decimal('12.3400'), u'Aaron', u'short', None),
+    (2, False, None, datetime.datetime(1760, 6, 5, 12, 0), None, u'Zürich Αθήνα', u'm' * 500,
+     bytearray(range(256)) * 4),
+    (3, False, -2.25, None, decimal.Decimal('-1.0000'), None, u'Ωμέγα' * 700, bytearray(b'\x00\x01') * 2000),
+]
+POINT_ROWS = [(i, i % 7, i * 0.5) for i in range(1, 2001)]
+
+
+class JetReaderTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.path = os.path.join(cls.directory, 'fixture.mdb')
+        write_database(cls.path, [
+            Table('survey', SURVEY_COLUMNS, SURVEY_ROWS, ['id'],
+                  deleted_rows=[(9, True, 0.0, None, None, u'deleted', None, None)]),
+            Table('points', [('id', LONG), ('kind', INT), ('x', DOUBLE)], POINT_ROWS, ['id']),
+        ], queries=['survey_query'])
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        self.conn = mdb_jet.connect(self.path)
+        self.cur = self.conn.cursor()
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_catalog(self):
+        self.assertEqual([row.table_name for row in self.cur.tables().fetchall()], [u'points', u'survey'])
+        self.assertEqual(self.cur.tables(table='SURVEY').fetchall()[0].table_type, 'TABLE')
+        self.assertEqual(self.cur.tables(tableType='VIEW').fetchall(), [])
+
+        statistics = self.cur.statistics('survey').fetchall()
+        self.assertEqual(statistics[0].cardinality, len(SURVEY_ROWS))
+        self.assertEqual([(row.index_name, row.column_name, row.non_unique) for row in statistics[1:]],
+                         [(u'PrimaryKey', u'id', False)])
+
+    def test_description(self):
+        self.cur.execute("SELECT * FROM [survey] WHERE 1 = 0")
+        self.assertEqual([column[:2] for column in self.cur.description],
+                         [(u'id', int), (u'checked', bool), (u'depth', float), (u'taken', datetime.datetime),
+                          (u'cost', decimal.Decimal), (u'name', type(u'')), (u'notes', type(u'')),
+                          (u'photo', bytearray)])
+        self.assertEqual(self.cur.description[5][3], 50)
+        self.assertIsNone(self.cur.fetchone())
+
+    def test_rows(self):
+        rows = self.cur.execute("SELECT * FROM [survey]").fetchall()
+        self.assertEqual([row[:6] for row in rows], [row[:6] for row in SURVEY_ROWS])
+
+    def test_long_values(self):
+        # in the row, on one other page and in a chain of rows over several pages
+        rows = self.cur.execute("SELECT [notes], [photo] FROM [survey]").fetchall()
+        self.assertEqual(rows, [row[6:] for row in SURVEY_ROWS])
+
+    def test_pages(self):
+        self.cur.execute("SELECT [x], id FROM points")
+        rows = []
+        while True:
+            batch = self.cur.fetchmany(500)
+            if not batch:
+                break
+            rows.extend(batch)
+        self.assertEqual(rows, [(x, i) for i, kind, x in POINT_ROWS])
+        self.assertEqual(self.cur.execute("SELECT COUNT(*) FROM points").fetchone(), (len(POINT_ROWS),))
+        self.assertEqual(self.cur.execute("SELECT TOP 3 id FROM points").fetchall(), [(1,), (2,), (3,)])
+
+    def test_unsupported(self):
+        self.assertRaises(mdb_jet.JetError, self.cur.execute, "SELECT * FROM survey_query")
+        self.assertRaises(mdb_jet.JetError, self.cur.execute, "SELECT * FROM survey WHERE id = 1")
+        self.assertRaises(mdb_jet.JetError, self.cur.execute, "SELECT missing FROM survey")
+        self.assertRaises(mdb_jet.JetError, self.cur.executemany, "DELETE * FROM survey", [])
+
+    def test_not_a_database(self):
+        path = os.path.join(self.directory, 'text.mdb')
+        with open(path, 'wb') as f:
+            f.write(b'not an access database' * 200)
+        self.assertRaises(mdb_jet.JetError, mdb_jet.connect, path)
+
+
+if __name__ == '__main__':
+    unittest.main()